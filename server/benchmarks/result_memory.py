@@ -0,0 +1,61 @@
+"""
+Memory used to hold the findings of a large scan: a list of PortResult
+models (the old path) versus a ResultStore converted only at the edge.
+
+    cd server && python -m benchmarks.result_memory --findings 1000000
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+
+from tools.PortScanner import PortScanner
+from tools.ResultStore import Finding, ResultStore
+
+
+def findings(count: int):
+    # a /16 worth of mostly-closed ports, the shape print_closed produces
+    for i in range(count):
+        ip = f"10.0.{(i // 256) % 256}.{i % 256}"
+        port = 1 + (i // 65536) % 65535
+        if i % 1000 == 0:
+            yield Finding(ip, port, "open", "SSH-2.0-OpenSSH_8.9p1 Ubuntu-3")
+        else:
+            yield Finding(ip, port, "closed")
+
+
+def measure(label: str, build) -> None:
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    held = build()
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<22} {len(held):>10} items  {current / 2**20:>9.1f} MiB held  "
+          f"{peak / 2**20:>9.1f} MiB peak  {elapsed:>7.2f} s")
+    del held
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--findings", type=int, default=200_000)
+    args = parser.parse_args()
+
+    scanner = PortScanner()
+
+    def port_results():
+        return [scanner.to_port_result(f, "tcp") for f in findings(args.findings)]
+
+    def result_store():
+        store = ResultStore("tcp")
+        for f in findings(args.findings):
+            store.add(f)
+        return store
+
+    measure("list[PortResult]", port_results)
+    measure("ResultStore", result_store)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+"""
+Local stand-ins for everything the tools talk to over the network, so the
+benchmarks run offline and against fixed, repeatable behaviour. Every
+stand-in binds to loopback, serves from daemon threads and is a context
+manager; ports default to 0 (picked by the OS).
+"""
+import collections
+import http.server
+import os
+import selectors
+import socket
+import socketserver
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import dns.flags
+import dns.message
+import dns.rcode
+import dns.rdatatype
+import dns.rrset
+
+HOST = "127.0.0.1"
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    # the default backlog of 5 drops SYNs under load, adding 1 s retransmits
+    request_queue_size = 1024
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _HttpServer(http.server.ThreadingHTTPServer):
+    request_queue_size = 1024
+
+
+class TcpListeners:
+    """
+    Listening TCP sockets on the given ports. A port mapped to bytes sends
+    them as a banner on accept and closes; a port mapped to None accepts
+    and stays silent until the client hangs up.
+    """
+
+    def __init__(self, ports: Dict[int, Optional[bytes]], host: str = HOST):
+        self.host = host
+        self._selector = selectors.DefaultSelector()
+        self._listeners: List[socket.socket] = []
+        self.ports: Dict[int, Optional[bytes]] = {}
+        for port, banner in ports.items():
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((host, port))
+            sock.listen(1024)
+            sock.setblocking(False)
+            self._listeners.append(sock)
+            self.ports[sock.getsockname()[1]] = banner
+            self._selector.register(sock, selectors.EVENT_READ, ("listen", banner))
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="tcp-standin", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            for key, _ in self._selector.select(0.1):
+                kind, banner = key.data
+                if kind == "listen":
+                    try:
+                        conn, _ = key.fileobj.accept()
+                    except OSError:
+                        continue
+                    if banner is not None:
+                        try:
+                            conn.sendall(banner)
+                        except OSError:
+                            pass
+                        conn.close()
+                    else:
+                        conn.setblocking(False)
+                        self._selector.register(conn, selectors.EVENT_READ, ("silent", None))
+                else:
+                    try:
+                        data = key.fileobj.recv(4096)
+                    except OSError:
+                        data = b""
+                    if not data:
+                        self._selector.unregister(key.fileobj)
+                        key.fileobj.close()
+
+    def __enter__(self) -> "TcpListeners":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        for key in list(self._selector.get_map().values()):
+            key.fileobj.close()
+        self._selector.close()
+
+
+class UdpListeners:
+    """Bound UDP sockets; a port mapped to bytes answers every datagram with them, None stays silent."""
+
+    def __init__(self, ports: Dict[int, Optional[bytes]], host: str = HOST):
+        self._selector = selectors.DefaultSelector()
+        self.ports: Dict[int, Optional[bytes]] = {}
+        for port, reply in ports.items():
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind((host, port))
+            sock.setblocking(False)
+            self.ports[sock.getsockname()[1]] = reply
+            self._selector.register(sock, selectors.EVENT_READ, reply)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="udp-standin", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            for key, _ in self._selector.select(0.1):
+                try:
+                    _, addr = key.fileobj.recvfrom(4096)
+                    if key.data is not None:
+                        key.fileobj.sendto(key.data, addr)
+                except OSError:
+                    pass
+
+    def __enter__(self) -> "UdpListeners":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        for key in list(self._selector.get_map().values()):
+            key.fileobj.close()
+        self._selector.close()
+
+
+class StubDns:
+    """
+    Authoritative-style UDP DNS server for a fixed zone.
+
+    `zone` maps (name, rtype) to rdata strings, e.g.
+    {("www.example.test", "A"): ["10.0.0.1"]}. Names present in the zone
+    answer NOERROR/NODATA for other types; anything else is NXDOMAIN,
+    unless it falls under `wildcard` (a suffix whose A queries all return
+    `wildcard_ips`). Every answer is delayed by `latency` seconds without
+    holding up other queries.
+    """
+
+    def __init__(self, zone: Dict[Tuple[str, str], List[str]], latency: float = 0.0,
+                 wildcard: Optional[str] = None, wildcard_ips: Optional[List[str]] = None,
+                 soa_minimum: int = 60, host: str = HOST, port: int = 0):
+        self.zone = {(name.rstrip(".").lower(), rtype.upper()): rdata for (name, rtype), rdata in zone.items()}
+        self.names = {name for name, _ in self.zone}
+        # parsed rrsets, built on first use so answers stay cheap
+        self._rrsets: Dict[Tuple[str, str], dns.rrset.RRset] = {}
+        self.latency = latency
+        self.wildcard = wildcard.lower().lstrip("*.") if wildcard else None
+        self.wildcard_ips = wildcard_ips or []
+        self.soa = f"ns.stub. hostmaster.stub. 1 3600 600 86400 {soa_minimum}"
+        self.queries = 0
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # bursts of concurrent queries must not overflow the receive buffer
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 2**20)
+        self._sock.bind((host, port))
+        self._sock.settimeout(0.1)
+        self.port = self._sock.getsockname()[1]
+        self._stop = threading.Event()
+        # answers waiting out `latency`, in arrival (and so due-time) order
+        self._delayed: collections.deque = collections.deque()
+        self._delayed_ready = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="dns-standin", daemon=True)
+        self._sender = threading.Thread(target=self._send_delayed, name="dns-standin-send", daemon=True)
+
+    def _answer(self, data: bytes) -> Optional[bytes]:
+        try:
+            query = dns.message.from_wire(data)
+        except Exception:
+            return None
+        response = dns.message.make_response(query)
+        response.flags |= dns.flags.AA
+        question = query.question[0]
+        name = question.name.to_text().rstrip(".").lower()
+        rtype = dns.rdatatype.to_text(question.rdtype)
+        answer = self.zone.get((name, rtype))
+        under_wildcard = self.wildcard is not None and name.endswith("." + self.wildcard)
+        if answer is None and under_wildcard and rtype == "A" and self.wildcard_ips:
+            answer = self.wildcard_ips
+        if answer:
+            response.answer.append(self._rrset(name, rtype, answer))
+        else:
+            if name not in self.names and not under_wildcard:
+                response.set_rcode(dns.rcode.NXDOMAIN)
+            # the SOA lets resolvers cache the negative answer
+            zone_apex = name.split(".", 1)[-1] if "." in name else name
+            response.authority.append(self._rrset(zone_apex, "SOA", [self.soa]))
+        return response.to_wire()
+
+    def _rrset(self, name: str, rtype: str, rdata: List[str]) -> dns.rrset.RRset:
+        rrset = self._rrsets.get((name, rtype))
+        if rrset is None:
+            rrset = self._rrsets[(name, rtype)] = dns.rrset.from_text(name + ".", 300, "IN", rtype, *rdata)
+        return rrset
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                data, addr = self._sock.recvfrom(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            self.queries += 1
+            wire = self._answer(data)
+            if wire is None:
+                continue
+            if self.latency:
+                with self._delayed_ready:
+                    self._delayed.append((time.monotonic() + self.latency, wire, addr))
+                    self._delayed_ready.notify()
+            else:
+                self._send(wire, addr)
+
+    def _send_delayed(self) -> None:
+        while not self._stop.is_set():
+            with self._delayed_ready:
+                while not self._delayed and not self._stop.is_set():
+                    self._delayed_ready.wait(0.1)
+                if not self._delayed:
+                    continue
+                due, wire, addr = self._delayed.popleft()
+            pause = due - time.monotonic()
+            if pause > 0:
+                time.sleep(pause)
+            self._send(wire, addr)
+
+    def _send(self, wire: bytes, addr) -> None:
+        try:
+            self._sock.sendto(wire, addr)
+        except OSError:
+            pass
+
+    def __enter__(self) -> "StubDns":
+        self._thread.start()
+        self._sender.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        self._sender.join()
+        self._sock.close()
+
+
+def whois_text(domain: str) -> str:
+    """A registry-style (Verisign) WHOIS answer for `domain`."""
+    return (
+        f"   Domain Name: {domain.upper()}\r\n"
+        f"   Registry Domain ID: {abs(hash(domain)) % 10**10}_DOMAIN_COM-VRSN\r\n"
+        "   Registrar WHOIS Server: whois.example-registrar.test\r\n"
+        "   Registrar URL: http://www.example-registrar.test\r\n"
+        "   Updated Date: 2024-08-14T07:01:44Z\r\n"
+        "   Creation Date: 1995-08-14T04:00:00Z\r\n"
+        "   Registry Expiry Date: 2025-08-13T04:00:00Z\r\n"
+        "   Registrar: Example Registrar, Inc.\r\n"
+        "   Domain Status: clientDeleteProhibited https://icann.org/epp#clientDeleteProhibited\r\n"
+        "   Name Server: A.IANA-SERVERS.NET\r\n"
+        "   Name Server: B.IANA-SERVERS.NET\r\n"
+        "   DNSSEC: signedDelegation\r\n"
+        ">>> Last update of whois database: 2024-10-01T00:00:00Z <<<\r\n"
+    )
+
+
+class FakeWhois:
+    """
+    WHOIS (port 43 protocol) responder: reads one query line and answers
+    with `records[domain]`, or a generated record, after `latency` seconds.
+    """
+
+    def __init__(self, records: Optional[Dict[str, str]] = None, latency: float = 0.0,
+                 host: str = HOST, port: int = 0):
+        records = records or {}
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                domain = self.rfile.readline().decode("ascii", errors="replace").strip().lower()
+                if latency:
+                    time.sleep(latency)
+                self.wfile.write(records.get(domain, whois_text(domain)).encode())
+
+        self._server = _Server((host, port), Handler)
+        self.address = f"{host}:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, name="whois-standin", daemon=True)
+
+    def __enter__(self) -> "FakeWhois":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def synthetic_page(size: int) -> bytes:
+    filler = ("<div class=\"px-4 text-gray-700\">Lorem ipsum dolor sit amet, "
+              "consectetur adipiscing elit.</div>\n")
+    body = filler * max(1, size // len(filler))
+    return ("<html><head><script src=\"/wp-includes/js/jquery.min.js\"></script>"
+            "<script src=\"https://www.googletagmanager.com/gtag/js?id=G-X\"></script></head><body>"
+            + body + "<div id=\"__next\"></div></body></html>").encode()
+
+
+class PageServer:
+    """
+    HTTP/1.1 (keep-alive) server for recorded pages. `pages` maps a path to
+    its body; unknown paths get the "/" page, so URLs can be made distinct
+    with a query string. `load_pages` reads a directory of saved pages.
+    """
+
+    def __init__(self, pages: Dict[str, bytes], headers: Optional[Dict[str, str]] = None,
+                 latency: float = 0.0, host: str = HOST, port: int = 0):
+        extra = headers or {"Server": "nginx/1.25.3", "X-Powered-By": "Next.js"}
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                body = pages.get(self.path.split("?", 1)[0]) or pages.get("/", b"")
+                if latency:
+                    time.sleep(latency)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in extra.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = _HttpServer((host, port), Handler)
+        self.base_url = f"http://{host}:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, name="http-standin", daemon=True)
+
+    def __enter__(self) -> "PageServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def load_pages(directory: str) -> Dict[str, bytes]:
+    """Every *.html file of `directory`, served at /<file name>; the first one is also "/"."""
+    pages: Dict[str, bytes] = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith((".html", ".htm")):
+            with open(os.path.join(directory, name), "rb") as f:
+                pages["/" + name] = f.read()
+    if pages:
+        pages["/"] = next(iter(pages.values()))
+    return pages
@@ -0,0 +1,337 @@
+"""
+Throughput, latency and memory of every tool, measured offline against the
+local stand-ins of benchmarks/standins.py and compared with a baseline.
+
+    cd server && python -m benchmarks.suite                  # run, compare with the baseline
+    cd server && python -m benchmarks.suite --save-baseline  # run, record a new baseline
+    cd server && python -m benchmarks.suite --only scanner_tcp,dns --quick
+
+Each benchmark runs --runs times, every time in a fresh process so the
+peak RSS it reports is its own, and the median of each figure is kept;
+the stand-ins run in this process. A result is flagged as a regression
+when its throughput drops, or its p99 latency or peak RSS grows, by more
+than --tolerance relative to the baseline, and the exit status is then 1.
+Baselines are machine-specific and live under DATA_DIR.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from typing import Callable, Dict, List, Tuple
+
+from benchmarks.standins import FakeWhois, PageServer, StubDns, TcpListeners, UdpListeners, load_pages, synthetic_page
+from tools.utils import DATA_DIR
+
+DEFAULT_BASELINE = os.path.join(DATA_DIR, "benchmarks", "baseline.json")
+
+SIZES = {
+    "full":  {"ports": 4000, "udp_ports": 400, "domains": 500, "prefixes": 5000,
+              "whois": 300, "requests": 500, "page_size": 100_000},
+    "quick": {"ports": 1000, "udp_ports": 100, "domains": 100, "prefixes": 1000,
+              "whois": 60, "requests": 100, "page_size": 100_000},
+}
+
+# one open port (alternately with a banner and silent) every this many ports
+OPEN_EVERY = 50
+
+
+# -- measured in the child process ---------------------------------------------
+
+def _timed_async(fn, latencies: List[float]):
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - started)
+    return wrapper
+
+
+def _timed_sync(fn, latencies: List[float]):
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - started)
+    return wrapper
+
+
+def bench_scanner_tcp(cfg: dict, engine: str = "async") -> Tuple[int, float, List[float]]:
+    from tools.PortScanner import PortScanner
+    scanner = PortScanner()
+    latencies: List[float] = []
+    if engine == "async":
+        scanner._scan_tcp_async = _timed_async(scanner._scan_tcp_async, latencies)
+    else:
+        scanner._scan_tcp = _timed_sync(scanner._scan_tcp, latencies)
+    started = time.perf_counter()
+    scanner.scan("127.0.0.1", cfg["port_base"], cfg["port_base"] + cfg["ports"] - 1, "tcp",
+                 False, False, engine=engine)
+    return cfg["ports"], time.perf_counter() - started, latencies
+
+
+def bench_scanner_tcp_thread(cfg: dict) -> Tuple[int, float, List[float]]:
+    return bench_scanner_tcp(cfg, engine="thread")
+
+
+def bench_scanner_syn(cfg: dict) -> Tuple[int, float, List[float]]:
+    # needs CAP_NET_RAW; otherwise this measures the connect fallback
+    from tools.PortScanner import PortScanner
+    scanner = PortScanner()
+    started = time.perf_counter()
+    scanner.scan("127.0.0.1", cfg["port_base"], cfg["port_base"] + cfg["ports"] - 1, "syn",
+                 False, False)
+    return cfg["ports"], time.perf_counter() - started, []
+
+
+def bench_scanner_udp(cfg: dict, engine: str = "async") -> Tuple[int, float, List[float]]:
+    from tools.PortScanner import PortScanner
+    scanner = PortScanner(timeout=cfg["udp_timeout"])
+    # the async engine has no per-probe call to time; only throughput is measured
+    latencies: List[float] = []
+    if engine == "thread":
+        scanner._scan_udp = _timed_sync(scanner._scan_udp, latencies)
+    started = time.perf_counter()
+    scanner.scan("127.0.0.1", cfg["udp_base"], cfg["udp_base"] + cfg["udp_ports"] - 1, "udp",
+                 False, True, engine=engine)
+    return cfg["udp_ports"], time.perf_counter() - started, latencies
+
+
+def bench_scanner_udp_thread(cfg: dict) -> Tuple[int, float, List[float]]:
+    return bench_scanner_udp(cfg, engine="thread")
+
+
+def bench_dns(cfg: dict) -> Tuple[int, float, List[float]]:
+    from tools.DNS import DnsTool
+    from tools.Resolver import SharedResolver
+    tool = DnsTool(SharedResolver(nameservers=["127.0.0.1"], port=cfg["dns_port"]))
+    latencies: List[float] = []
+    tool.aenumerate = _timed_async(tool.aenumerate, latencies)
+    domains = [f"host{i}.bench.test" for i in range(cfg["domains"])]
+
+    async def run():
+        async for _ in tool.aenumerate_many(domains):
+            pass
+
+    started = time.perf_counter()
+    asyncio.run(run())
+    return len(domains), time.perf_counter() - started, latencies
+
+
+def bench_subdomains(cfg: dict) -> Tuple[int, float, List[float]]:
+    from tools.Resolver import SharedResolver
+    from tools.SubdomainScanner import SubdomainTool
+    tool = SubdomainTool(resolver=SharedResolver(nameservers=["127.0.0.1"], port=cfg["dns_port"]))
+    tool.COMMON_SUBDOMAINS = [f"sub{i}" for i in range(cfg["prefixes"])]
+    latencies: List[float] = []
+    tool._resolve_a = _timed_async(tool._resolve_a, latencies)
+    started = time.perf_counter()
+    tool.scan("bench.test")
+    # the wildcard probes are resolutions too
+    return len(latencies), time.perf_counter() - started, latencies
+
+
+def bench_whois(cfg: dict) -> Tuple[int, float, List[float]]:
+    from tools.WHOIS import WhoisTool
+    from tools.WhoisCache import WhoisCache
+    tool = WhoisTool(cache=WhoisCache(":memory:"), registry_interval=0, server=cfg["whois_server"])
+    latencies: List[float] = []
+    tool.lookup = _timed_sync(tool.lookup, latencies)
+    domains = [f"domain{i}.test" for i in range(cfg["whois"])]
+    started = time.perf_counter()
+    for _, _, error in tool.lookup_many(domains):
+        if error:
+            raise RuntimeError(error)
+    return len(domains), time.perf_counter() - started, latencies
+
+
+def bench_wappalyzer(cfg: dict) -> Tuple[int, float, List[float]]:
+    from tools.Wappalyzer import Wappalyzer
+    analyzer = Wappalyzer()
+    latencies: List[float] = []
+    analyzer.analyze = _timed_sync(analyzer.analyze, latencies)
+    urls = [f"{cfg['base_url']}/?page={i}" for i in range(cfg["requests"])]
+    started = time.perf_counter()
+    for item in analyzer.analyze_many(urls, max_workers=16):
+        if "error" in item:
+            raise RuntimeError(item["error"])
+    return len(urls), time.perf_counter() - started, latencies
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile; 0 for no values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, round(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def run_child(name: str, cfg: dict) -> Dict[str, float]:
+    fn = BENCHMARKS[name][1]
+    count, elapsed, latencies = fn(cfg)
+    return {
+        "throughput": count / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        # ru_maxrss is in KiB on Linux, bytes on macOS
+        "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                        / (2**20 if sys.platform == "darwin" else 2**10),
+        "seconds": elapsed,
+    }
+
+
+# -- stand-ins, set up in this process ------------------------------------------
+
+def tcp_standins(stack: ExitStack, cfg: dict) -> None:
+    ports = {}
+    for i, port in enumerate(range(cfg["port_base"], cfg["port_base"] + cfg["ports"], OPEN_EVERY)):
+        ports[port] = b"SSH-2.0-OpenSSH_9.6p1 Ubuntu-3ubuntu13\r\n" if i % 2 == 0 else None
+    stack.enter_context(TcpListeners(ports))
+
+
+def udp_standins(stack: ExitStack, cfg: dict) -> None:
+    ports = {port: b"\x00" * 48 for port in range(cfg["udp_base"], cfg["udp_base"] + cfg["udp_ports"], OPEN_EVERY)}
+    stack.enter_context(UdpListeners(ports))
+
+
+def dns_standins(stack: ExitStack, cfg: dict) -> None:
+    zone = {}
+    for i in range(cfg["domains"]):
+        name = f"host{i}.bench.test"
+        zone[(name, "A")] = [f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}"]
+        zone[(name, "MX")] = [f"10 mail.{name}."]
+        zone[(name, "TXT")] = ['"v=spf1 -all"']
+    # one prefix in ten exists
+    for i in range(0, cfg["prefixes"], 10):
+        zone[(f"sub{i}.bench.test", "A")] = [f"10.1.{i // 256 % 256}.{i % 256}"]
+    zone[("bench.test", "A")] = ["10.0.0.1"]
+    dns_server = stack.enter_context(StubDns(zone, latency=cfg["dns_latency"]))
+    cfg["dns_port"] = dns_server.port
+
+
+def whois_standins(stack: ExitStack, cfg: dict) -> None:
+    cfg["whois_server"] = stack.enter_context(FakeWhois(latency=cfg["whois_latency"])).address
+
+
+def http_standins(stack: ExitStack, cfg: dict) -> None:
+    pages = load_pages(cfg["pages"]) if cfg.get("pages") else {"/": synthetic_page(cfg["page_size"])}
+    server = stack.enter_context(PageServer(pages, latency=cfg["http_latency"]))
+    cfg["base_url"] = server.base_url
+
+
+# name -> (stand-in setup, benchmark, unit)
+BENCHMARKS: Dict[str, Tuple[Callable, Callable, str]] = {
+    "scanner_tcp":        (tcp_standins, bench_scanner_tcp, "ports/s"),
+    "scanner_tcp_thread": (tcp_standins, bench_scanner_tcp_thread, "ports/s"),
+    "scanner_syn":        (tcp_standins, bench_scanner_syn, "ports/s"),
+    "scanner_udp":        (udp_standins, bench_scanner_udp, "ports/s"),
+    "scanner_udp_thread": (udp_standins, bench_scanner_udp_thread, "ports/s"),
+    "dns":                (dns_standins, bench_dns, "domains/s"),
+    "subdomains":         (dns_standins, bench_subdomains, "resolutions/s"),
+    "whois":              (whois_standins, bench_whois, "lookups/s"),
+    "wappalyzer":         (http_standins, bench_wappalyzer, "requests/s"),
+}
+
+
+# -- baseline comparison ----------------------------------------------------------
+
+def regressions(result: Dict[str, float], baseline: Dict[str, float], tolerance: float) -> List[str]:
+    found = []
+    if result["throughput"] < baseline["throughput"] * (1 - tolerance):
+        found.append("throughput")
+    for key in ("p99_ms", "peak_rss_mib"):
+        if result[key] > baseline[key] * (1 + tolerance):
+            found.append(key)
+    return found
+
+
+def change(value: float, before: float) -> str:
+    if not before:
+        return ""
+    return f"({(value - before) / before * 100:+.0f}%)"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--only", help="comma-separated benchmarks: " + ",".join(BENCHMARKS))
+    parser.add_argument("--quick", action="store_true", help="smaller workloads")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--runs", type=int, default=3, help="runs per benchmark; medians are reported")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    parser.add_argument("--port-base", type=int, default=40000, help="first TCP port scanned")
+    parser.add_argument("--udp-base", type=int, default=47000, help="first UDP port scanned")
+    parser.add_argument("--udp-timeout", type=float, default=0.2)
+    parser.add_argument("--dns-latency", type=float, default=0.002)
+    parser.add_argument("--whois-latency", type=float, default=0.005)
+    parser.add_argument("--http-latency", type=float, default=0.0)
+    parser.add_argument("--pages", help="directory of recorded *.html pages to serve")
+    args = parser.parse_args()
+
+    names = args.only.split(",") if args.only else list(BENCHMARKS)
+    unknown = [n for n in names if n not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+    baseline: Dict[str, Dict[str, float]] = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    results: Dict[str, Dict[str, float]] = {}
+    flagged = False
+    spawn = multiprocessing.get_context("spawn")
+    print(f"{'benchmark':<20} {'throughput':>22} {'p50 ms':>9} {'p99 ms':>9} {'peak RSS MiB':>13}")
+    for name in names:
+        setup, _, unit = BENCHMARKS[name]
+        cfg = dict(SIZES["quick" if args.quick else "full"], port_base=args.port_base,
+                   udp_base=args.udp_base, udp_timeout=args.udp_timeout,
+                   dns_latency=args.dns_latency, whois_latency=args.whois_latency,
+                   http_latency=args.http_latency, pages=args.pages)
+        runs = []
+        with ExitStack() as stack:
+            setup(stack, cfg)
+            for _ in range(args.runs):
+                with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+                    runs.append(pool.submit(run_child, name, cfg).result())
+        result = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+        result["unit"] = unit
+        results[name] = result
+
+        before = baseline.get(name)
+        print(f"{name:<20} {result['throughput']:>12.1f} {unit:<9} {result['p50_ms']:>9.2f} "
+              f"{result['p99_ms']:>9.2f} {result['peak_rss_mib']:>13.1f}")
+        if before:
+            bad = regressions(result, before, args.tolerance)
+            flagged = flagged or bool(bad)
+            print(f"{'  vs baseline':<20} {change(result['throughput'], before['throughput']):>22} "
+                  f"{change(result['p50_ms'], before['p50_ms']):>9} {change(result['p99_ms'], before['p99_ms']):>9} "
+                  f"{change(result['peak_rss_mib'], before['peak_rss_mib']):>13}"
+                  + (f"  REGRESSION: {', '.join(bad)}" if bad else ""))
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        merged = dict(baseline, **results)
+        with open(args.baseline, "w") as f:
+            json.dump({"recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "python": platform.python_version(),
+                       "machine": platform.machine(),
+                       "results": merged}, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+    elif not baseline:
+        print("no baseline yet; record one with --save-baseline")
+    sys.exit(1 if flagged else 0)
+
+
+if __name__ == "__main__":
+    main()
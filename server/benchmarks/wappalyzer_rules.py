@@ -0,0 +1,109 @@
+"""
+Rule matching cost of Wappalyzer: one regex per rule over the whole body
+(the old loop) versus the combined MultiPatternMatcher.
+
+    cd server && python -m benchmarks.wappalyzer_rules --rules technologies/ --corpus pages/
+
+Without --rules, thousands of synthetic rules are generated; without
+--corpus, synthetic pages are used.
+"""
+import argparse
+import glob
+import os
+import random
+import re
+import string
+import time
+
+from tools.Wappalyzer import Wappalyzer
+
+
+def synthetic_rules(count: int, rng: random.Random):
+    def word(n: int) -> str:
+        return "".join(rng.choice(string.ascii_lowercase) for _ in range(n))
+
+    shapes = [
+        lambda w: re.escape(w),
+        lambda w: re.escape(w) + r"(?:\.min)?\.js",
+        lambda w: r"data-" + re.escape(w) + r"=[\"'][^\"']+",
+        lambda w: re.escape(w) + r"\s*\.\s*init\(",
+        lambda w: r"/" + re.escape(w) + r"/(?:v\d+/)?",
+    ]
+    rules = []
+    for i in range(count):
+        name = word(8)
+        rules.append({
+            "name": f"synthetic-{i}-{name}",
+            "category": "Synthetic",
+            "html": [re.compile(rng.choice(shapes)(name), re.I)],
+            "script": [re.compile(re.escape(name) + r"(?:\.min)?\.js", re.I)],
+            "headers": [],
+        })
+    return rules
+
+
+def synthetic_pages(count: int, size: int, rules, rng: random.Random):
+    filler = ("<div class=\"px-4 text-gray-700\">Lorem ipsum dolor sit amet, "
+              "consectetur adipiscing elit.</div>\n")
+    pages = []
+    for _ in range(count):
+        body = [filler] * (size // len(filler))
+        # plant a few technologies so the verification path is exercised
+        for rule in rng.sample(rules, k=min(5, len(rules))):
+            body.insert(rng.randrange(len(body)), rule["name"].split("-")[-1] + ".init(")
+        pages.append("<html><head><script src=\"/static/app.min.js\"></script></head>"
+                     + "".join(body) + "</html>")
+    return pages
+
+
+def naive_match(analyzer: Wappalyzer, html: str, script_srcs):
+    found = []
+    for rule in analyzer.rules:
+        if any(rx.search(html) for rx in rule["html"]) or \
+                any(rx.search(src) for rx in rule["script"] for src in script_srcs):
+            found.append(rule["name"])
+    return found
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rules", help="upstream technologies.json or directory")
+    parser.add_argument("--synthetic-rules", type=int, default=3000)
+    parser.add_argument("--corpus", help="directory of saved .html pages")
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--page-size", type=int, default=200_000)
+    args = parser.parse_args()
+    rng = random.Random(1234)
+
+    started = time.perf_counter()
+    analyzer = Wappalyzer(rules_path=args.rules)
+    if not args.rules:
+        analyzer.rules.extend(synthetic_rules(args.synthetic_rules, rng))
+        analyzer._compile()
+    print(f"{len(analyzer.rules)} rules compiled in {time.perf_counter() - started:.2f} s")
+
+    if args.corpus:
+        pages = []
+        for path in sorted(glob.glob(os.path.join(args.corpus, "*.htm*"))):
+            with open(path, encoding="utf-8", errors="ignore") as f:
+                pages.append(f.read())
+    else:
+        pages = synthetic_pages(args.pages, args.page_size, analyzer.rules, rng)
+    total_bytes = sum(len(p) for p in pages)
+    print(f"{len(pages)} pages, {total_bytes / 2**20:.1f} MiB")
+
+    script_srcs = ["/static/app.min.js"]
+    for label, run in (
+        ("per-rule loop", lambda html: naive_match(analyzer, html, script_srcs)),
+        ("combined matcher", lambda html: [t["name"] for t in analyzer.match(html, script_srcs, {})]),
+    ):
+        started = time.perf_counter()
+        results = [sorted(run(html)) for html in pages]
+        elapsed = time.perf_counter() - started
+        print(f"{label:<18} {elapsed:>8.3f} s  {len(pages) / elapsed:>8.1f} pages/s  "
+              f"{total_bytes / 2**20 / elapsed:>8.1f} MiB/s  "
+              f"{sum(map(len, results))} detections")
+
+
+if __name__ == "__main__":
+    main()
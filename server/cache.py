@@ -0,0 +1,166 @@
+# cache.py
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Mapping, Optional, Set, Tuple
+
+from tools.Metrics import Counter, Gauge
+
+# seconds a response stays fresh, by endpoint; 0 only coalesces identical requests in flight
+DEFAULT_TTLS: Dict[str, float] = {
+    endpoint: float(os.environ.get(f"RESPONSE_CACHE_TTL_{endpoint.upper()}", ttl))
+    for endpoint, ttl in (("analyze", 300), ("dns", 60), ("whois", 3600), ("subdomains", 600))
+}
+# responses kept across all endpoints before the least recently used is dropped
+MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_SIZE", 1000))
+# request header that skips the cache, besides Cache-Control: no-cache / no-store / max-age=0
+BYPASS_HEADER = os.environ.get("RESPONSE_CACHE_BYPASS_HEADER", "X-Cache-Bypass").lower()
+
+# "hit" (cached), "shared" (joined an identical request in flight), "miss" or "bypass"
+REQUESTS = Counter("response_cache_requests_total", "Requests to cached endpoints, by how they were answered.",
+                   ("endpoint", "outcome"))
+SAVED_CALLS = Counter("response_cache_saved_calls_total",
+                      "Tool executions avoided by a cached response or a shared in-flight request.", ("endpoint",))
+HIT_RATIO = Gauge("response_cache_hit_ratio", "Share of requests answered without running the tool.", ("endpoint",))
+ENTRIES = Gauge("response_cache_entries", "Responses held in the response cache.")
+
+OUTCOMES = ("hit", "shared", "miss", "bypass")
+
+
+def bypassed(headers: Mapping[str, str]) -> bool:
+    """Whether a request asked for a fresh answer (`headers` with lower-case names, as Starlette's)."""
+    if headers.get(BYPASS_HEADER, "").strip().lower() not in ("", "0", "false", "no"):
+        return True
+    directives = {d.strip().lower() for d in headers.get("cache-control", "").split(",")}
+    return bool(directives & {"no-cache", "no-store", "max-age=0"})
+
+
+class ResponseCache:
+    """
+    Shared layer between the endpoints and the tools they call. Identical
+    requests (same endpoint and normalized key) that arrive while one is
+    running wait for its result instead of running the tool again, and
+    the result is kept for the endpoint's TTL in a bounded LRU cache.
+    Errors are shared with the requests waiting on them but never cached.
+
+    A bypassing request skips the cached response and its fresh result
+    replaces it; it still joins an identical request already in flight,
+    which is just as fresh.
+    """
+
+    def __init__(self, ttls: Optional[Mapping[str, float]] = None, max_entries: int = MAX_ENTRIES):
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # (endpoint, key) -> (expires at, response), least recently used first
+        self._entries: "OrderedDict[Tuple[str, Hashable], Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[Tuple[str, Hashable], Future] = {}
+        self._counts: Dict[str, Dict[str, int]] = {}
+        # shared executions started by `arun`, kept alive until they finish
+        self._tasks: Set[asyncio.Task] = set()
+
+    def export_metrics(self) -> None:
+        """Expose the number of cached responses as the response_cache_entries metric."""
+        ENTRIES.set_function(lambda: len(self._entries))
+
+    def _begin(self, endpoint: str, key: Hashable, bypass: bool) -> Tuple[str, Any]:
+        """(outcome, response) for a hit, else (outcome, future of the shared execution)."""
+        slot = (endpoint, key)
+        with self._lock:
+            entry = self._entries.get(slot)
+            if entry is not None and not bypass:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(slot)
+                    return self._count(endpoint, "hit"), entry[1]
+                del self._entries[slot]
+            pending = self._inflight.get(slot)
+            if pending is not None:
+                return self._count(endpoint, "shared"), pending
+            self._inflight[slot] = Future()
+            return self._count(endpoint, "bypass" if bypass else "miss"), self._inflight[slot]
+
+    def _count(self, endpoint: str, outcome: str) -> str:
+        # under self._lock
+        counts = self._counts.setdefault(endpoint, dict.fromkeys(OUTCOMES, 0))
+        counts[outcome] += 1
+        REQUESTS.labels(endpoint, outcome).inc()
+        if outcome in ("hit", "shared"):
+            SAVED_CALLS.labels(endpoint).inc()
+        HIT_RATIO.labels(endpoint).set((counts["hit"] + counts["shared"]) / sum(counts.values()))
+        return outcome
+
+    def _finish(self, endpoint: str, key: Hashable, pending: Future,
+                value: Any = None, error: Optional[BaseException] = None) -> None:
+        slot = (endpoint, key)
+        ttl = self.ttls.get(endpoint, 0)
+        with self._lock:
+            del self._inflight[slot]
+            if error is None and ttl > 0:
+                self._entries[slot] = (time.monotonic() + ttl, value)
+                self._entries.move_to_end(slot)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        if error is None:
+            pending.set_result(value)
+        else:
+            pending.set_exception(error)
+
+    def run(self, endpoint: str, key: Hashable, compute: Callable[[], Any],
+            bypass: bool = False) -> Tuple[Any, str]:
+        """(response, outcome) of `compute()`, or of the cache or an identical request in flight."""
+        outcome, found = self._begin(endpoint, key, bypass)
+        if outcome == "hit":
+            return found, outcome
+        if outcome == "shared":
+            return found.result(), outcome
+        try:
+            value = compute()
+        except BaseException as e:
+            self._finish(endpoint, key, found, error=e)
+            raise
+        self._finish(endpoint, key, found, value)
+        return value, outcome
+
+    async def arun(self, endpoint: str, key: Hashable, compute: Callable[[], Awaitable[Any]],
+                   bypass: bool = False) -> Tuple[Any, str]:
+        """
+        `run` for a coroutine. The shared execution runs as its own task, so
+        a client that disconnects does not cancel it for the others waiting.
+        """
+        outcome, found = self._begin(endpoint, key, bypass)
+        if outcome == "hit":
+            return found, outcome
+        if outcome != "shared":
+            async def execute(pending: Future = found):
+                try:
+                    value = await compute()
+                except BaseException as e:
+                    self._finish(endpoint, key, pending, error=e)
+                else:
+                    self._finish(endpoint, key, pending, value)
+
+            task = asyncio.ensure_future(execute())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        # shielded: a waiter that is cancelled must not cancel the shared future
+        return await asyncio.shield(asyncio.wrap_future(found)), outcome
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Counters, hit ratio and cached responses of each endpoint seen so far."""
+        with self._lock:
+            sizes: Dict[str, int] = {}
+            for endpoint, _ in self._entries:
+                sizes[endpoint] = sizes.get(endpoint, 0) + 1
+            counts = {endpoint: dict(c) for endpoint, c in self._counts.items()}
+        stats = []
+        for endpoint in sorted(set(self.ttls) | set(counts)):
+            c = counts.get(endpoint, dict.fromkeys(OUTCOMES, 0))
+            total = sum(c.values())
+            saved = c["hit"] + c["shared"]
+            stats.append({"endpoint": endpoint, "ttl": self.ttls.get(endpoint, 0), "entries": sizes.get(endpoint, 0),
+                          "hits": c["hit"], "shared": c["shared"], "misses": c["miss"], "bypassed": c["bypass"],
+                          "saved_calls": saved, "hit_ratio": saved / total if total else 0.0})
+        return stats
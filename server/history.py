@@ -0,0 +1,385 @@
+# history.py
+import asyncio
+import functools
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from ipaddress import ip_address
+from typing import (Any, AsyncIterator, Callable, Collection, Dict, Iterator, List, Optional,
+                    Sequence, Tuple, Union)
+
+from models import PortChange, PortResult, ScanInfo, ScanRequest
+from tools.Metrics import timed
+from tools.PortScanner import PortScanner
+from tools.PortSpec import parse_ports, port_rank
+from tools.ResultStore import Finding, ResultStore
+from tools.ServiceProbe import ServiceProber
+from tools.utils import DATA_DIR
+
+DEFAULT_PATH = os.environ.get("SCAN_HISTORY_PATH", os.path.join(DATA_DIR, "scans.sqlite3"))
+
+# findings are written in batches of this size
+FLUSH_SIZE = 500
+
+_SCAN_COLUMNS = ("id, target, protocol, start_port, end_port, ports, incremental, previous,"
+                 " status, results, started_at, finished_at")
+
+
+def request_ports(ports: Optional[str], start_port: int, end_port: int,
+                  protocol: str) -> List[int]:
+    """Ports a scan covers, in frequency order: its port list if it has one, else its range."""
+    if ports:
+        return parse_ports(ports, protocol)
+    if not 1 <= start_port <= end_port <= 65535:
+        raise ValueError("Port range must be within 1-65535")
+    return parse_ports(f"{start_port}-{end_port}", protocol)
+
+
+def scan_scope(target: str, ports: Collection[int]) -> Callable[[str, int], bool]:
+    """Predicate telling whether an (ip, port) pair falls within a scan of `target` over `ports`."""
+    span = PortScanner.host_range(target)
+    ports = set(ports)
+
+    def covers(ip: str, port: int) -> bool:
+        if port not in ports:
+            return False
+        if span is None:
+            return ip == target
+        try:
+            address = ip_address(ip)
+        except ValueError:
+            return False
+        return address.version == span[0].version and span[0] <= address <= span[1]
+    return covers
+
+
+class ScanHistory:
+    """
+    SQLite record of every scan and of the PortResults it reported. Results
+    are keyed by (ip, port, protocol, scan_id), so the history of a port
+    and the comparison of two scans are index lookups, with a second index
+    to read one scan back in address order.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS scans ("
+            " id TEXT PRIMARY KEY,"
+            " target TEXT NOT NULL,"
+            " protocol TEXT NOT NULL,"
+            " start_port INTEGER NOT NULL,"
+            " end_port INTEGER NOT NULL,"
+            " ports TEXT,"
+            " incremental INTEGER NOT NULL,"
+            " previous TEXT,"
+            " status TEXT NOT NULL,"
+            " results INTEGER NOT NULL DEFAULT 0,"
+            " started_at REAL NOT NULL,"
+            " finished_at REAL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS scans_target ON scans (target, protocol, started_at)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS port_results ("
+            " ip TEXT NOT NULL,"
+            " port INTEGER NOT NULL,"
+            " protocol TEXT NOT NULL,"
+            " scan_id TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " result TEXT NOT NULL,"
+            " PRIMARY KEY (ip, port, protocol, scan_id)) WITHOUT ROWID"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS port_results_scan ON port_results (scan_id, ip, port)"
+        )
+        self._db.commit()
+
+    def begin(self, request: ScanRequest, protocol: str, previous: Optional[str] = None,
+              scan_id: Optional[str] = None) -> str:
+        scan_id = scan_id or uuid.uuid4().hex
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO scans (id, target, protocol, start_port, end_port, ports, incremental,"
+                " previous, status, started_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'running', ?)",
+                (scan_id, request.target.strip(), protocol, request.start_port,
+                 request.end_port, request.ports, int(request.incremental), previous, time.time()),
+            )
+            self._db.commit()
+        return scan_id
+
+    def add(self, scan_id: str, results: List[PortResult]) -> None:
+        if not results:
+            return
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO port_results (ip, port, protocol, scan_id, status, result)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                ((r.ip, r.port, r.protocol, scan_id, r.status, r.model_dump_json()) for r in results),
+            )
+            self._db.execute("UPDATE scans SET results = results + ? WHERE id = ?",
+                             (len(results), scan_id))
+            self._db.commit()
+
+    def finish(self, scan_id: str, status: str) -> None:
+        with self._lock:
+            self._db.execute("UPDATE scans SET status = ?, finished_at = ? WHERE id = ?",
+                             (status, time.time(), scan_id))
+            self._db.commit()
+
+    def get(self, scan_id: str) -> Optional[ScanInfo]:
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {_SCAN_COLUMNS} FROM scans WHERE id = ?", (scan_id,)
+            ).fetchone()
+        return self._info(row) if row else None
+
+    def recent(self, limit: int, target: Optional[str] = None) -> List[ScanInfo]:
+        with self._lock:
+            if target is None:
+                rows = self._db.execute(
+                    f"SELECT {_SCAN_COLUMNS} FROM scans ORDER BY started_at DESC LIMIT ?", (limit,)
+                ).fetchall()
+            else:
+                rows = self._db.execute(
+                    f"SELECT {_SCAN_COLUMNS} FROM scans WHERE target = ?"
+                    " ORDER BY started_at DESC LIMIT ?", (target.strip(), limit)
+                ).fetchall()
+        return [self._info(row) for row in rows]
+
+    @staticmethod
+    def _info(row) -> ScanInfo:
+        return ScanInfo(**dict(zip((c.strip() for c in _SCAN_COLUMNS.split(",")), row)))
+
+    def results(self, scan_id: str, offset: int, limit: int,
+                status: Optional[str] = None) -> List[PortResult]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT result FROM port_results WHERE scan_id = ? AND (? IS NULL OR status = ?)"
+                " ORDER BY ip, port LIMIT ? OFFSET ?",
+                (scan_id, status, status, limit, offset),
+            ).fetchall()
+        return [PortResult.model_validate_json(row[0]) for row in rows]
+
+    def latest(self, target: str, protocol: str, after: Optional[float] = None,
+               completed: bool = False) -> Optional[str]:
+        """Id of the newest scan of `target` (started after `after`, if given), or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id FROM scans WHERE target = ? AND protocol = ? AND started_at > ?"
+                " AND (? = 0 OR status = 'completed') ORDER BY started_at DESC LIMIT 1",
+                (target.strip(), protocol.lower(), after or 0.0, int(completed)),
+            ).fetchone()
+        return row[0] if row else None
+
+    def open_ports(self, scan_id: str) -> List[Tuple[str, int]]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT ip, port FROM port_results WHERE scan_id = ? AND status = 'open'"
+                " ORDER BY ip, port", (scan_id,)
+            ).fetchall()
+        return [(ip, port) for ip, port in rows]
+
+    def port_counts(self, target: str, protocol: str) -> Dict[int, int]:
+        """port -> how many times it was found open in past scans of `target`."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT r.port, COUNT(*) FROM scans s JOIN port_results r ON r.scan_id = s.id"
+                " WHERE s.target = ? AND s.protocol = ? AND r.status = 'open' GROUP BY r.port",
+                (target.strip(), protocol.lower()),
+            ).fetchall()
+        return dict(rows)
+
+    def changes(self, since: str, scan: str) -> List[PortChange]:
+        """
+        Ports open in `scan` but not in `since` ("opened"), and ports open in
+        `since` that `scan` found in another state or, once it completed,
+        did not report within its range ("closed").
+        """
+        info = self.get(scan)
+        with self._lock:
+            opened = self._db.execute(
+                "SELECT n.result, o.result FROM port_results n"
+                " LEFT JOIN port_results o ON o.ip = n.ip AND o.port = n.port"
+                " AND o.protocol = n.protocol AND o.scan_id = ?"
+                " WHERE n.scan_id = ? AND n.status = 'open' AND (o.status IS NULL OR o.status != 'open')",
+                (since, scan),
+            ).fetchall()
+            gone = self._db.execute(
+                "SELECT o.result, n.result FROM port_results o"
+                " LEFT JOIN port_results n ON n.ip = o.ip AND n.port = o.port"
+                " AND n.protocol = o.protocol AND n.scan_id = ?"
+                " WHERE o.scan_id = ? AND o.status = 'open' AND (n.status IS NULL OR n.status != 'open')",
+                (scan, since),
+            ).fetchall()
+
+        def load(raw: Optional[str]) -> Optional[PortResult]:
+            return PortResult.model_validate_json(raw) if raw else None
+
+        changes = [self._change("opened", load(before), load(after)) for after, before in opened]
+        covers = scan_scope(info.target, request_ports(info.ports, info.start_port,
+                                                       info.end_port, info.protocol))
+        for before, after in gone:
+            before, after = load(before), load(after)
+            # an unreported port only counts as closed if the scan got to it
+            if after is None and not (info.status == "completed" and covers(before.ip, before.port)):
+                continue
+            changes.append(self._change("closed", before, after))
+        return sorted(changes, key=lambda c: (c.ip, c.port))
+
+    @staticmethod
+    def _change(change: str, before: Optional[PortResult], after: Optional[PortResult]) -> PortChange:
+        ref = after or before
+        return PortChange(ip=ref.ip, port=ref.port, protocol=ref.protocol, change=change,
+                          before=before, after=after)
+
+
+class ScanRunner:
+    """
+    Runs scans through the PortScanner and records each one in the
+    ScanHistory as its results come in. Open TCP ports go through the
+    ServiceProber on the way, unless the request turns fingerprinting off.
+
+    An incremental scan starts from the last completed scan of the same
+    target: the ports it found open are probed first and reported whatever
+    their state, so changes show up within the first seconds; then the rest
+    of the range is swept in priority order (ports most often open on this
+    target, then the rest in the usual frequency order).
+    """
+
+    def __init__(self, scanner: PortScanner, history: Optional[ScanHistory] = None,
+                 prober: Optional[ServiceProber] = None):
+        self.scanner = scanner
+        self.history = history or ScanHistory()
+        self.prober = prober or ServiceProber()
+
+    def protocol(self, request: ScanRequest) -> str:
+        """Protocol the results of `request` are reported under."""
+        return self.scanner._engine_for(request.protocol, request.engine)[0]
+
+    def validate(self, request: ScanRequest) -> List[int]:
+        """Check a request like the scanner would; returns the ports it covers, in scan order."""
+        ports = request_ports(request.ports, request.start_port, request.end_port, self.protocol(request))
+        self.scanner._prepare(request.target, request.start_port, request.end_port,
+                              request.protocol, request.engine, request.discovery, ports)
+        return ports
+
+    def stream(self, request: ScanRequest, progress: Optional[Callable[[], None]] = None,
+               scan_id: Optional[str] = None) -> Tuple[str, Union[Iterator[Finding], AsyncIterator[Finding]]]:
+        """
+        Validate and start recording a scan; returns its id and its findings,
+        as a plain or async iterator like `PortScanner.stream_findings`.
+        Only what is saved to the history is turned into PortResults here.
+        """
+        ports = self.validate(request)
+        proto, engine = self.scanner._engine_for(request.protocol, request.engine)
+        target = request.target.strip()
+        previous = None
+        recheck: List[Tuple[str, int]] = []
+        if request.incremental:
+            previous = self.history.latest(target, proto, completed=True)
+            if previous is not None:
+                covers = scan_scope(target, ports)
+                recheck = [pair for pair in self.history.open_ports(previous) if covers(*pair)]
+            ports = self._priority(target, proto, ports)
+        scan_id = self.history.begin(request, proto, previous, scan_id)
+
+        def rechecks():
+            # every state is reported so that closed ports are recorded too
+            return self.scanner.stream_pair_findings(recheck, request.protocol, True, True,
+                                                     engine=request.engine, progress=progress)
+
+        def sweep():
+            return self.scanner.stream_findings(target, request.start_port, request.end_port,
+                                                request.protocol, request.print_closed, request.print_filtered,
+                                                engine=request.engine, discovery=request.discovery,
+                                                progress=progress, ports=ports, skip=set(recheck))
+
+        phases = [rechecks, sweep] if recheck else [sweep]
+        if request.fingerprint and proto == "tcp":
+            phases = [self.probed(phase, engine) for phase in phases]
+        convert = functools.partial(self.scanner.to_port_result, protocol=proto)
+        if engine == "thread":
+            return scan_id, self.recorded(scan_id, phases, convert)
+        return scan_id, self.recorded_async(scan_id, phases, convert)
+
+    @timed("scanner", "scan")
+    def scan(self, request: ScanRequest) -> Tuple[str, ResultStore]:
+        """
+        Run a whole scan; returns its id and its findings in a compact
+        ResultStore, for `PortScanner.to_port_result` at the API edge.
+        """
+        scan_id, findings = self.stream(request)
+        store = ResultStore(self.protocol(request))
+        if hasattr(findings, "__aiter__"):
+            async def collect():
+                async for finding in findings:
+                    store.add(finding)
+            asyncio.run(collect())
+        else:
+            for finding in findings:
+                store.add(finding)
+        return scan_id, store
+
+    def probed(self, phase: Callable, engine: str) -> Callable:
+        """`phase` with its open ports fingerprinted by the service probe stage."""
+        enrich = self.prober.enrich_sync if engine == "thread" else self.prober.enrich
+        return lambda: enrich(phase())
+
+    def _priority(self, target: str, protocol: str, ports: Sequence[int]) -> List[int]:
+        counts = self.history.port_counts(target, protocol)
+        return sorted(ports, key=lambda p: (-counts.get(p, 0), port_rank(p, protocol)))
+
+    def recorded(self, scan_id: str, phases: List[Callable],
+                 convert: Optional[Callable[[Any], PortResult]] = None) -> Iterator[Any]:
+        """
+        Pass through the results of each phase (a callable returning an
+        iterator) while saving them under `scan_id`, which is finished as
+        completed or, if the results are not read to the end, aborted.
+        Results are saved as they are, or as `convert` turns them into
+        PortResults (findings are only converted for the history).
+        """
+        pending: List[PortResult] = []
+        status = "aborted"
+        try:
+            for phase in phases:
+                for res in phase():
+                    pending.append(convert(res) if convert else res)
+                    if len(pending) >= FLUSH_SIZE:
+                        self.history.add(scan_id, pending)
+                        pending = []
+                    yield res
+                # rechecks are saved as soon as they are done, for /changes to see
+                self.history.add(scan_id, pending)
+                pending = []
+            status = "completed"
+        finally:
+            self.history.add(scan_id, pending)
+            self.history.finish(scan_id, status)
+
+    async def recorded_async(self, scan_id: str, phases: List[Callable],
+                             convert: Optional[Callable[[Any], PortResult]] = None) -> AsyncIterator[Any]:
+        """`recorded` for phases returning async iterators."""
+        pending: List[PortResult] = []
+        status = "aborted"
+        try:
+            for phase in phases:
+                async for res in phase():
+                    pending.append(convert(res) if convert else res)
+                    if len(pending) >= FLUSH_SIZE:
+                        self.history.add(scan_id, pending)
+                        pending = []
+                    yield res
+                self.history.add(scan_id, pending)
+                pending = []
+            status = "completed"
+        finally:
+            self.history.add(scan_id, pending)
+            self.history.finish(scan_id, status)
@@ -0,0 +1,348 @@
+# jobs.py
+import asyncio
+import os
+import queue
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from history import ScanRunner
+from models import JobInfo, PortResult, ScanRequest
+from tools.ResultStore import Finding
+from tools.utils import DATA_DIR
+
+DEFAULT_PATH = os.environ.get("JOBS_DB_PATH", os.path.join(DATA_DIR, "jobs.sqlite3"))
+# scans run side by side; each one keeps its own probe concurrency
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+
+# progress is saved every this many findings, or at least this often
+FLUSH_SIZE = 500
+FLUSH_INTERVAL = 1.0
+
+def _boot_id() -> str:
+    try:
+        with open("/proc/sys/kernel/random/boot_id") as f:
+            return f.read().strip()
+    except OSError:
+        return "unknown"
+
+
+# identifies the process running a job: pids are only meaningful on the
+# same machine and boot
+OWNER = f"{socket.gethostname()} {_boot_id()} {os.getpid()}"
+
+
+def owner_alive(owner: Optional[str]) -> bool:
+    """Whether the process that claimed a job may still be running it."""
+    if not owner:
+        return False  # claimed by a version that did not record owners
+    host, boot, pid = owner.rsplit(" ", 2)
+    this_host, this_boot, _ = OWNER.rsplit(" ", 2)
+    if host != this_host:
+        return True   # cannot tell from here; its own host recovers it
+    if boot != this_boot:
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # exists, under another user
+    return True
+
+
+_JOB_COLUMNS = ("id, kind, status, done, total, results, created_at,"
+                " started_at, finished_at, error")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobStore:
+    """
+    SQLite-backed record of jobs, so they outlive the process. Their
+    findings are recorded once, in the ScanHistory under the job id;
+    job_results only holds those of jobs run by older versions.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " kind TEXT NOT NULL,"
+            " params TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " done INTEGER NOT NULL DEFAULT 0,"
+            " total INTEGER NOT NULL,"
+            " results INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL,"
+            " started_at REAL,"
+            " finished_at REAL,"
+            " error TEXT,"
+            " cancel_requested INTEGER NOT NULL DEFAULT 0,"
+            " owner TEXT)"
+        )
+        self._add_column("jobs", "cancel_requested INTEGER NOT NULL DEFAULT 0")
+        self._add_column("jobs", "owner TEXT")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS job_results ("
+            " job_id TEXT NOT NULL,"
+            " seq INTEGER NOT NULL,"
+            " result TEXT NOT NULL,"
+            " PRIMARY KEY (job_id, seq)) WITHOUT ROWID"
+        )
+        self._db.commit()
+
+    def _add_column(self, table: str, column: str) -> None:
+        """Add `column` to a table created by an older version."""
+        names = {row[1] for row in self._db.execute(f"PRAGMA table_info({table})")}
+        if column.split()[0] not in names:
+            self._db.execute(f"ALTER TABLE {table} ADD COLUMN {column}")
+
+    def create(self, kind: str, params: str, total: int) -> str:
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, kind, params, status, total, created_at)"
+                " VALUES (?, ?, ?, 'queued', ?, ?)",
+                (job_id, kind, params, total, time.time()),
+            )
+            self._db.commit()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[JobInfo]:
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {_JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._info(row) if row else None
+
+    def recent(self, limit: int) -> List[JobInfo]:
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {_JOB_COLUMNS} FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [self._info(row) for row in rows]
+
+    @staticmethod
+    def _info(row) -> JobInfo:
+        return JobInfo(**dict(zip((c.strip() for c in _JOB_COLUMNS.split(",")), row)))
+
+    def params(self, job_id: str) -> str:
+        with self._lock:
+            return self._db.execute("SELECT params FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+
+    def claim(self, job_id: str) -> bool:
+        """Move a queued job to running, owned by this process; False if it was cancelled or claimed meanwhile."""
+        with self._lock:
+            cur = self._db.execute(
+                "UPDATE jobs SET status = 'running', started_at = ?, owner = ?"
+                " WHERE id = ? AND status = 'queued'",
+                (time.time(), OWNER, job_id),
+            )
+            self._db.commit()
+        return cur.rowcount == 1
+
+    def cancel_queued(self, job_id: str) -> bool:
+        with self._lock:
+            cur = self._db.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+                (time.time(), job_id),
+            )
+            self._db.commit()
+        return cur.rowcount == 1
+
+    def request_cancel(self, job_id: str) -> None:
+        """Flag a running job for cancellation, for whichever process runs it."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status IN ('queued', 'running')",
+                (job_id,),
+            )
+            self._db.commit()
+
+    def cancel_requested(self, job_id: str) -> bool:
+        with self._lock:
+            row = self._db.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def save(self, job_id: str, done: int, results: int) -> None:
+        """Record `done` probes and `results` findings reported so far."""
+        with self._lock:
+            self._db.execute("UPDATE jobs SET done = ?, results = ? WHERE id = ?", (done, results, job_id))
+            self._db.commit()
+
+    def finish(self, job_id: str, status: str, error: Optional[str] = None) -> None:
+        with self._lock:
+            # hosts skipped by discovery count as done once the scan completes
+            self._db.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ?,"
+                " done = CASE WHEN ? = 'completed' THEN total ELSE done END WHERE id = ?",
+                (status, error, time.time(), status, job_id),
+            )
+            self._db.commit()
+
+    def results(self, job_id: str, offset: int, limit: int) -> List[str]:
+        """Findings of a job run before they were recorded in the ScanHistory."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT result FROM job_results WHERE job_id = ? AND seq >= ? ORDER BY seq LIMIT ?",
+                (job_id, offset, limit),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def recover(self) -> List[str]:
+        """
+        After a restart: running jobs whose process is gone lost their
+        worker and are marked interrupted (their partial results are kept);
+        those of other live processes sharing the database are left alone.
+        Queued jobs are returned, oldest first, to be queued again.
+        """
+        with self._lock:
+            running = self._db.execute("SELECT id, owner FROM jobs WHERE status = 'running'").fetchall()
+            now = time.time()
+            self._db.executemany(
+                "UPDATE jobs SET status = 'interrupted', finished_at = ? WHERE id = ? AND status = 'running'",
+                [(now, job_id) for job_id, owner in running if not owner_alive(owner)],
+            )
+            self._db.commit()
+            rows = self._db.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+
+class JobManager:
+    """
+    Runs long scans in the background on its own `workers` threads, away
+    from the web server's request threadpool. A job is queued and gets an
+    id right away; its status, progress and findings are read from the
+    JobStore while it runs and after it is finished. Scans are also
+    recorded in the runner's ScanHistory, under the job id.
+    """
+
+    def __init__(self, runner: ScanRunner, store: Optional[JobStore] = None,
+                 workers: int = JOB_WORKERS):
+        self.runner = runner
+        self.store = store or JobStore()
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._cancel: Dict[str, threading.Event] = {}
+        self._cancel_lock = threading.Lock()
+        for job_id in self.store.recover():
+            self._queue.put(job_id)
+        self._threads = [threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit_scan(self, request: ScanRequest) -> JobInfo:
+        """Validate and queue a scan; raises ValueError on bad input, like the scanner."""
+        ports = self.runner.validate(request)
+        total = self.runner.scanner.count_probes(request.target, request.start_port,
+                                                 request.end_port, ports)
+        job_id = self.store.create("scan", request.model_dump_json(), total)
+        self._queue.put(job_id)
+        return self.store.get(job_id)
+
+    def status(self, job_id: str) -> Optional[JobInfo]:
+        return self.store.get(job_id)
+
+    def recent(self, limit: int = 50) -> List[JobInfo]:
+        return self.store.recent(limit)
+
+    def results(self, job_id: str, offset: int = 0, limit: int = 100) -> List[PortResult]:
+        """Findings recorded so far, in address order (read from the ScanHistory, by job id)."""
+        if self.runner.history.get(job_id) is None:
+            return [PortResult.model_validate_json(r) for r in self.store.results(job_id, offset, limit)]
+        return self.runner.history.results(job_id, offset, limit)
+
+    def cancel(self, job_id: str) -> Optional[JobInfo]:
+        """
+        Cancel a queued or running job. A running scan stops at its next
+        probe; findings saved so far are kept. Finished jobs are left alone.
+        """
+        if not self.store.cancel_queued(job_id):
+            # persisted, for a scan run by another process or not started yet
+            self.store.request_cancel(job_id)
+            with self._cancel_lock:
+                event = self._cancel.get(job_id)
+            if event is not None:
+                event.set()
+        return self.store.get(job_id)
+
+    def _work(self) -> None:
+        while True:
+            job_id = self._queue.get()
+            # registered before the claim, so that a cancel arriving right
+            # after it finds the event
+            event = threading.Event()
+            with self._cancel_lock:
+                self._cancel[job_id] = event
+            if not self.store.claim(job_id):
+                with self._cancel_lock:
+                    del self._cancel[job_id]
+                continue
+            if self.store.cancel_requested(job_id):
+                event.set()
+            try:
+                self._run_scan(job_id, ScanRequest.model_validate_json(self.store.params(job_id)), event)
+            except JobCancelled:
+                self.store.finish(job_id, "cancelled")
+            except Exception as e:
+                self.store.finish(job_id, "failed", str(e))
+            else:
+                self.store.finish(job_id, "completed")
+            finally:
+                with self._cancel_lock:
+                    del self._cancel[job_id]
+
+    def _run_scan(self, job_id: str, request: ScanRequest, cancelled: threading.Event) -> None:
+        # findings are saved by the runner, in the ScanHistory; only counts are kept here
+        done = 0
+        found = 0
+        last_flush = time.monotonic()
+
+        def flush() -> None:
+            nonlocal last_flush
+            self.store.save(job_id, done, found)
+            last_flush = time.monotonic()
+            if self.store.cancel_requested(job_id):
+                cancelled.set()
+
+        def progress() -> None:
+            nonlocal done
+            if cancelled.is_set():
+                raise JobCancelled()
+            done += 1
+            # closed ports are usually not reported, so progress is also
+            # saved on a timer and not only along with findings
+            if time.monotonic() - last_flush >= FLUSH_INTERVAL:
+                flush()
+
+        def add(finding: Finding) -> None:
+            nonlocal found
+            found += 1
+            if found % FLUSH_SIZE == 0:
+                flush()
+
+        _, findings = self.runner.stream(request, progress, scan_id=job_id)
+        try:
+            if hasattr(findings, "__aiter__"):
+                async def drain():
+                    async for finding in findings:
+                        add(finding)
+                asyncio.run(drain())
+            else:
+                for finding in findings:
+                    add(finding)
+        finally:
+            flush()
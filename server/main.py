@@ -1,20 +1,84 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from typing import List
-
-from models import PortResult, ScanRequest, AnalyzeResult, AnalyzeRequest, WhoisRequest, WhoisRecord, DnsRequest, DnsRecord, SubdomainRequest, SubdomainResult  
-from tools.PortScanner import PortScanner
-from tools.Wappalyzer import Wappalyzer
-from tools.WHOIS import WhoisTool
-from tools.DNS import DnsTool
-from tools.SubdomainScanner import SubdomainTool
-
-app = FastAPI()
-scanner = PortScanner()
-analyzer = Wappalyzer()
-whois_tool = WhoisTool()
-dns_tool = DnsTool()
-subdomain_tool = SubdomainTool()
+import asyncio
+import shutil
+import tempfile
+import time
+from contextlib import asynccontextmanager
+
+# first, so that the imports below show up in the startup report
+from startup import STARTUP, WARMUP, Lazy, warm_in_background
+
+with STARTUP.phase("import", "fastapi"):
+    from fastapi import FastAPI, File, HTTPException, Query, Request, Response, UploadFile
+    from fastapi.middleware.cors import CORSMiddleware
+    from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from typing import Iterable, Iterator, List, Optional
+
+with STARTUP.phase("import", "models"):
+    from models import PortResult, ScanRequest, ShardedScanRequest, ShardSpec, ScanInfo, ScanDiff, JobInfo, AnalyzeResult, AnalyzeRequest, AnalyzeBatchRequest, AnalyzeBatchItem, WhoisRequest, WhoisRecord, WhoisBatchItem, DomainBatchRequest, DnsRequest, DnsRecord, DnsBatchItem, DnsCacheStats, ResponseCacheStats, SchedulerStats, SubdomainRequest, SubdomainResult, ReconRequest, StartupReport
+with STARTUP.phase("import", "scanner"):
+    from tools.PortScanner import PortScanner
+    from tools.ServiceProbe import ServiceProber
+    from history import ScanHistory, ScanRunner
+    from jobs import JobManager
+    from sharding import ShardCoordinator
+    from cache import ResponseCache, bypassed
+    from profiling import SLOW_REQUEST_SECONDS, SamplingProfiler, profile_name, profile_path, profile_requested, saved_profiles
+    from tools.Metrics import REGISTRY, Histogram
+    from tools.Scheduler import default_scheduler
+    from tools.utils import normalize_domain
+
+
+def _resolver(module):
+    resolver = module.SharedResolver()
+    resolver.export_metrics()
+    return resolver
+
+
+# the other tools, and what they import (requests, bs4, whois, dnspython),
+# are built on first use or by the warmup that follows startup
+analyzer = Lazy("wappalyzer", "tools.Wappalyzer", lambda m: m.Wappalyzer())
+whois_tool = Lazy("whois", "tools.WHOIS", lambda m: m.WhoisTool())
+# one DNS cache for every tool, so repeated recon of a target hits it
+dns_resolver = Lazy("resolver", "tools.Resolver", _resolver)
+dns_tool = Lazy("dns", "tools.DNS", lambda m: m.DnsTool(dns_resolver.get()))
+subdomain_tool = Lazy("subdomains", "tools.SubdomainScanner",
+                      lambda m: m.SubdomainTool(resolver=dns_resolver.get()))
+
+with STARTUP.phase("init", "scanner"):
+    # sockets and probe rate shared out among concurrent scans, sized from the fd limit
+    scheduler = default_scheduler()
+    scheduler.export_metrics()
+    scanner = PortScanner(scheduler=scheduler)
+    # every scan is recorded, so later ones can be compared and run incrementally
+    scan_history = ScanHistory()
+    # banners, versions and OS of open ports, probed apart from the sweep
+    service_prober = ServiceProber(scheduler=scheduler)
+    scan_runner = ScanRunner(scanner, scan_history, service_prober)
+    # long scans run here, off the request threadpool
+    jobs = JobManager(scan_runner)
+    # large scans split into shards, run on local cores or other instances
+    shard_coordinator = ShardCoordinator(scan_runner)
+
+# identical /analyze, /dns, /whois and /subdomains requests share one run and its result
+responses = ResponseCache()
+responses.export_metrics()
+
+recon_pipeline = Lazy("recon", "pipeline", lambda m: m.ReconPipeline(
+    subdomain_tool.get(), dns_tool.get(), scanner, analyzer.get(), prober=service_prober))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    STARTUP.mark_ready()
+    if WARMUP:
+        warm_in_background([dns_resolver, dns_tool, subdomain_tool, whois_tool, analyzer, recon_pipeline,
+                            # tables a first scan would otherwise load
+                            Lazy("port tables", "tools.PortSpec", lambda m: m.port_rank(1, "tcp")),
+                            Lazy("signatures", "tools.ServiceProbe", lambda m: m.default_signatures())])
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -25,40 +89,308 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+REQUEST_SECONDS = Histogram("http_request_duration_seconds",
+                            "Time until the response body is sent, by endpoint.",
+                            ("method", "route", "status"))
+
+
+@app.middleware("http")
+async def instrument(request: Request, call_next):
+    """
+    Record per-endpoint latency. A request sent with an `X-Profile` header
+    carrying PROFILE_TOKEN (or, with PROFILE_SLOW_SECONDS set, any request
+    slower than that) is run under the sampling profiler; the saved
+    profile's name comes back in the `X-Profile` response header when the
+    headers are not sent yet, is listed by /profiles and served from
+    /profiles/{name}.
+
+    `call_next` returns once the headers are ready, so for a streamed body
+    the timing and the profile run until its last chunk is sent.
+    """
+    # the token also authorizes /profiles, which is not itself profiled
+    requested = profile_requested(request.headers.get("x-profile")) and not request.url.path.startswith("/profiles")
+    profiler = None
+    if requested or SLOW_REQUEST_SECONDS:
+        profiler = SamplingProfiler().start()
+    started = time.perf_counter()
+    label = f"{request.method} {request.url.path}"
+
+    def finish(status: int, name: Optional[str] = None) -> None:
+        elapsed = time.perf_counter() - started
+        route = request.scope.get("route")
+        REQUEST_SECONDS.labels(request.method, route.path if route else "unmatched", status).observe(elapsed)
+        if profiler is None:
+            return
+        profiler.stop()
+        if name is None and SLOW_REQUEST_SECONDS and elapsed >= SLOW_REQUEST_SECONDS:
+            name = profile_name(label)
+        if name is not None:
+            # file I/O: off the event loop, and not awaited, as the client may be gone
+            asyncio.get_running_loop().run_in_executor(None, profiler.save, name)
+
+    try:
+        response = await call_next(request)
+    except BaseException:
+        finish(500)
+        raise
+    name = None
+    if profiler is not None and (requested or time.perf_counter() - started >= SLOW_REQUEST_SECONDS):
+        name = profile_name(label)
+        response.headers["X-Profile"] = name
+
+    async def body(chunks=response.body_iterator):
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            finish(response.status_code, name)
+
+    response.body_iterator = body()
+    return response
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Counters, gauges and latency histograms in the Prometheus text format."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/startup", response_model=StartupReport)
+def startup_report():
+    """Where startup time went: imports, tool initialization and the background warmup."""
+    return STARTUP.summary()
+
+
+@app.get("/scheduler", response_model=SchedulerStats)
+def scheduler_stats():
+    """Socket budget and probe rate of all scans, and the sockets each scan holds."""
+    return scheduler.stats()
+
+
+@app.get("/cache", response_model=List[ResponseCacheStats])
+def response_cache_stats():
+    """Hit ratio, tool runs saved and cached responses of each cached endpoint."""
+    return responses.stats()
+
+
+@app.get("/profiles", response_model=List[str])
+def list_profiles(request: Request):
+    """Names of the saved profiles, newest first; needs PROFILE_TOKEN in `X-Profile`."""
+    if not profile_requested(request.headers.get("x-profile")):
+        raise HTTPException(status_code=403, detail="Profile token required")
+    return saved_profiles()
+
+
+@app.get("/profiles/{name}", response_class=PlainTextResponse)
+def get_profile(name: str, request: Request):
+    """A saved profile, as folded stacks (flamegraph.pl / speedscope input); needs PROFILE_TOKEN too."""
+    if not profile_requested(request.headers.get("x-profile")):
+        raise HTTPException(status_code=403, detail="Profile token required")
+    path = profile_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="text/plain")
+
 
 @app.post("/scan", response_model=List[PortResult])
-def scan(request: ScanRequest):
+def scan(request: ScanRequest, response: Response):
+    """Run a scan and return its results; the id it is recorded under comes in `X-Scan-Id`."""
+    try:
+        scan_id, store = scan_runner.scan(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    response.headers["X-Scan-Id"] = scan_id
+    return [scanner.to_port_result(f, store.protocol) for f in store]
+
+
+@app.post("/scan/stream")
+def scan_stream(request: ScanRequest):
+    """
+    Streaming variant of /scan.
+    Emits one PortResult per line (NDJSON) as soon as each probe completes.
+    """
+    try:
+        scan_id, findings = scan_runner.stream(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    results = scanner.port_results(findings, scan_runner.protocol(request))
+    if hasattr(results, "__aiter__"):
+        async def body():
+            async for res in results:
+                yield res.model_dump_json() + "\n"
+    else:
+        def body():
+            for res in results:
+                yield res.model_dump_json() + "\n"
+    return StreamingResponse(body(), media_type="application/x-ndjson",
+                             headers={"X-Scan-Id": scan_id})
+
+
+@app.post("/scan/sharded")
+def scan_sharded(request: ShardedScanRequest):
+    """
+    Scan split into deterministic shards of addresses x ports, run in a
+    local process pool or, with `workers`, on other instances of this
+    server (through /shards/run). Merged, deduplicated results are
+    streamed as NDJSON; a failed shard is retried on its own.
+    """
     try:
-        results = scanner.scan(
-            request.target,
-            request.start_port,
-            request.end_port,
-            request.protocol.lower(),
-            request.print_closed,
-            request.print_filtered
-        )
-        return results
-    except ValueError:
-        raise HTTPException(
-            status_code=400, detail="Protocol inválido; use 'tcp' ou 'udp'.")
+        scan_id, results = shard_coordinator.stream(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def body():
+        async for res in results:
+            yield res.model_dump_json() + "\n"
+    return StreamingResponse(body(), media_type="application/x-ndjson",
+                             headers={"X-Scan-Id": scan_id})
+
+
+@app.post("/shards/run")
+def run_shard(shard: ShardSpec):
+    """Worker side of /scan/sharded: scan one shard, streaming its PortResults as NDJSON."""
+    try:
+        results = shard_coordinator.run(shard)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if hasattr(results, "__aiter__"):
+        async def body():
+            async for res in results:
+                yield res.model_dump_json() + "\n"
+    else:
+        def body():
+            for res in results:
+                yield res.model_dump_json() + "\n"
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
+@app.get("/scans", response_model=List[ScanInfo])
+def list_scans(target: Optional[str] = None, limit: int = Query(50, ge=1, le=500)):
+    """Recorded scans, newest first; optionally only those of one target."""
+    return scan_history.recent(limit, target)
+
+
+@app.get("/scans/{scan_id}", response_model=ScanInfo)
+def scan_info(scan_id: str):
+    info = scan_history.get(scan_id)
+    if info is None:
+        raise HTTPException(status_code=404, detail="Scan not found")
+    return info
+
+
+@app.get("/scans/{scan_id}/results", response_model=List[PortResult])
+def scan_results(scan_id: str, status: Optional[str] = None,
+                 offset: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=1000)):
+    """Recorded results of a scan in address order, optionally of one status; page with offset/limit."""
+    if scan_history.get(scan_id) is None:
+        raise HTTPException(status_code=404, detail="Scan not found")
+    return scan_history.results(scan_id, offset, limit, status)
+
+
+@app.get("/scans/{scan_id}/changes", response_model=ScanDiff)
+def scan_changes(scan_id: str, scan: Optional[str] = None):
+    """
+    What changed since scan `scan_id`: ports opened and closed in `scan`,
+    by default the latest scan of the same target and protocol.
+    Can be read while that scan is still running.
+    """
+    since = scan_history.get(scan_id)
+    if since is None:
+        raise HTTPException(status_code=404, detail="Scan not found")
+    if scan is None:
+        scan = scan_history.latest(since.target, since.protocol, after=since.started_at.timestamp())
+        if scan is None:
+            raise HTTPException(status_code=404, detail="No later scan of this target")
+    elif scan_history.get(scan) is None:
+        raise HTTPException(status_code=404, detail="Scan not found")
+    return ScanDiff(since=scan_id, scan=scan, changes=scan_history.changes(scan_id, scan))
+
+
+@app.post("/jobs/scan", response_model=JobInfo, status_code=202)
+def submit_scan_job(request: ScanRequest):
+    """
+    Queue a scan as a background job and return right away.
+    Poll /jobs/{id} for status and progress, read findings from /jobs/{id}/results.
+    """
+    try:
+        return jobs.submit_scan(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/jobs", response_model=List[JobInfo])
+def list_jobs(limit: int = Query(50, ge=1, le=500)):
+    return jobs.recent(limit)
+
+
+@app.get("/jobs/{job_id}", response_model=JobInfo)
+def job_status(job_id: str):
+    job = jobs.status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/jobs/{job_id}/results", response_model=List[PortResult])
+def job_results(job_id: str, offset: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=1000)):
+    """Findings saved so far, in address order; page with offset/limit. Also under /scans/{job_id}/results."""
+    if jobs.status(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return jobs.results(job_id, offset, limit)
+
+
+@app.post("/jobs/{job_id}/cancel", response_model=JobInfo)
+def cancel_job(job_id: str):
+    job = jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 
 @app.post("/analyze", response_model=AnalyzeResult)
-def analyze(request: AnalyzeRequest):
+def analyze(request: AnalyzeRequest, http: Request, response: Response):
+    """
+    Technologies used by a web page. This and /dns, /whois and /subdomains
+    answer from the response cache while fresh (`X-Cache` tells how a
+    response was made); send `Cache-Control: no-cache` or `X-Cache-Bypass: 1`
+    for a fresh one.
+    """
+    url = str(request.url)
     try:
-        return analyzer.analyze(request.url)
+        result, outcome = responses.run(
+            "analyze", url, lambda: analyzer.get().analyze(url), bypassed(http.headers))
+        response.headers["X-Cache"] = outcome
+        return result
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@app.post("/analyze/batch")
+def analyze_batch(request: AnalyzeBatchRequest):
+    """
+    Fingerprint many URLs at once over pooled keep-alive connections.
+    Emits one AnalyzeBatchItem per line (NDJSON) as each URL completes.
+    """
+    def body():
+        for item in analyzer.get().analyze_many(str(url) for url in request.urls):
+            yield AnalyzeBatchItem(**item).model_dump_json() + "\n"
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
 @app.post("/whois", response_model=WhoisRecord)
-def whois_lookup(request: WhoisRequest):
+def whois_lookup(request: WhoisRequest, http: Request, response: Response):
     """
     WHOIS lookup endpoint.
     Client sends {"domain": "example.com"} and receives registrant info.
     """
+    domain = normalize_domain(request.domain)
     try:
-        return whois_tool.lookup(request.domain)
+        record, outcome = responses.run(
+            "whois", domain, lambda: whois_tool.get().lookup(domain), bypassed(http.headers))
+        response.headers["X-Cache"] = outcome
+        return record
     except ValueError as e:
         # lookup failure (invalid domain, network issue, etc.)
         raise HTTPException(status_code=400, detail=str(e))
@@ -66,14 +398,59 @@ def whois_lookup(request: WhoisRequest):
         # unexpected errors
         raise HTTPException(status_code=500, detail="Internal WHOIS error")
 
+def _upload_lines(upload: UploadFile) -> Iterator[str]:
+    """
+    Lines of an uploaded newline-delimited file, read as they are needed.
+    The upload is closed once the endpoint returns, so it is first copied
+    to a private temporary file that the (streamed) response reads from.
+    The copy is blocking I/O: call this from plain `def` endpoints only.
+    """
+    spool = tempfile.TemporaryFile()
+    shutil.copyfileobj(upload.file, spool)
+    spool.seek(0)
+
+    def lines():
+        with spool:
+            for raw in spool:
+                yield raw.decode("utf-8", errors="ignore")
+    return lines()
+
+
+def _whois_batch(domains: Iterable[str]) -> StreamingResponse:
+    def body():
+        for domain, record, error in whois_tool.get().lookup_many(domains):
+            yield WhoisBatchItem(domain=domain, record=record, error=error).model_dump_json() + "\n"
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
+@app.post("/whois/batch")
+def whois_batch(request: DomainBatchRequest):
+    """
+    WHOIS lookup for a list of domains.
+    Duplicates (after normalization) are looked up once; emits one
+    WhoisBatchItem per line (NDJSON), with per-domain errors.
+    """
+    return _whois_batch(request.domains)
+
+
+@app.post("/whois/batch/file")
+def whois_batch_file(file: UploadFile = File(...)):
+    """Same as /whois/batch, for an uploaded file with one domain per line."""
+    return _whois_batch(_upload_lines(file))
+
+
 @app.post("/dns", response_model=DnsRecord)
-def dns_enumeration(request: DnsRequest):
+async def dns_enumeration(request: DnsRequest, http: Request, response: Response):
     """
     DNS enumeration endpoint.
     Client sends { "domain": "example.com" }
     """
+    domain = normalize_domain(request.domain)
     try:
-        return dns_tool.enumerate(request.domain)
+        record, outcome = await responses.arun(
+            "dns", domain, lambda: dns_tool.get().aenumerate(domain), bypassed(http.headers))
+        response.headers["X-Cache"] = outcome
+        return record
     except ValueError as ve:
         # bad domain / NXDOMAIN
         raise HTTPException(status_code=400, detail=str(ve))
@@ -81,20 +458,75 @@ def dns_enumeration(request: DnsRequest):
         # anything else (resolver timeout, etc.)
         raise HTTPException(status_code=500, detail="Internal DNS enumeration error")
 
+def _dns_batch(domains: Iterable[str]) -> StreamingResponse:
+    async def body():
+        async for domain, record, error in dns_tool.get().aenumerate_many(domains):
+            yield DnsBatchItem(domain=domain, record=record, error=error).model_dump_json() + "\n"
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+@app.post("/dns/batch")
+async def dns_batch(request: DomainBatchRequest):
+    """
+    DNS enumeration for a list of domains.
+    Duplicates (after normalization) are queried once; emits one
+    DnsBatchItem per line (NDJSON), with per-domain errors.
+    """
+    return _dns_batch(request.domains)
+
+@app.post("/dns/batch/file")
+def dns_batch_file(file: UploadFile = File(...)):
+    """Same as /dns/batch, for an uploaded file with one domain per line."""
+    # plain def: copying the upload (see `_upload_lines`) blocks, so it runs in the threadpool
+    return _dns_batch(_upload_lines(file))
+
+@app.get("/dns/cache", response_model=DnsCacheStats)
+def dns_cache_stats():
+    """Hit/miss counters and size of the shared DNS cache."""
+    return dns_resolver.get().stats()
+
 @app.post("/subdomains", response_model=SubdomainResult)
-def subdomain_scan(request: SubdomainRequest):
+async def subdomain_scan(request: SubdomainRequest, http: Request, response: Response):
     """
-    Scan a fixed list of 50 common subdomains under `request.domain`.
-    Returns only those that resolve to an A record.
+    Resolve `<prefix>.<request.domain>` for every prefix of the chosen
+    wordlist (a built-in list of common names by default).
+    Returns only those that resolve to an A record outside any wildcard.
     """
+    domain = normalize_domain(request.domain)
+
+    async def scan_subdomains():
+        wildcard = await subdomain_tool.get().detect_wildcard(domain)
+        subs = await subdomain_tool.get().ascan(domain, request.wordlist, wildcard)
+        return SubdomainResult(subdomains=subs, wildcard_ips=sorted(wildcard))
+
     try:
-        subs = subdomain_tool.scan(request.domain)
-        return SubdomainResult(subdomains=subs)
+        result, outcome = await responses.arun(
+            "subdomains", (domain, request.wordlist), scan_subdomains, bypassed(http.headers))
+        response.headers["X-Cache"] = outcome
+        return result
     except ValueError as ve:
         raise HTTPException(status_code=400, detail=str(ve))
     except Exception:
         raise HTTPException(status_code=500, detail="Internal subdomain scan error")
 
+
+@app.post("/recon")
+async def recon(request: ReconRequest):
+    """
+    Full recon of a domain: subdomains, DNS, a port scan of each unique
+    address and fingerprinting of the web ports found open.
+    Emits one ReconEvent per line (NDJSON) as each stage produces it.
+    """
+    try:
+        events = recon_pipeline.get().run(request.domain, request.wordlist,
+                                    request.start_port, request.end_port)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def body():
+        async for event in events:
+            yield event.model_dump_json(exclude_none=True) + "\n"
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,16 +1,84 @@
 from datetime import datetime
 from pydantic import BaseModel, HttpUrl
-from typing import Optional, List, Union
+from typing import Dict, Optional, List, Union
 
 
 class ScanRequest(BaseModel):
-    # IP ou rede (ex: "192.168.1.1" ou "192.168.1.0/24")
+    # IP, rede ou intervalo (ex: "192.168.1.1", "192.168.1.0/24" ou "192.168.1.10-192.168.1.99")
     target: str
-    start_port: int
-    end_port: int
-    protocol: str           # "tcp" ou "udp"
+    start_port: int = 1
+    end_port: int = 1024
+    # lista de portas, ex: "22,80,443,8000-8100,top-1000"; substitui start/end_port
+    ports: Optional[str] = None
+    # "tcp", "udp" ou "syn" (varredura TCP semiaberta; exige CAP_NET_RAW,
+    # senão vira "tcp"); resultados de "syn" são reportados como "tcp"
+    protocol: str
+    print_closed: bool = False
+    print_filtered: bool = False
+    engine: str = "async"   # "async" ou "thread"
+    discovery: bool = False  # descarta hosts inativos de uma rede antes da varredura
+    # reverifica antes as portas abertas na última varredura do mesmo alvo
+    # (sempre reportadas, mesmo fechadas) e depois varre o resto por prioridade
+    incremental: bool = False
+    # sonda as portas TCP abertas para identificar serviço, versão e SO
+    fingerprint: bool = True
+
+
+class ShardedScanRequest(ScanRequest):
+    # nº de fatias (endereços x portas); None: automático
+    shards: Optional[int] = None
+    # processos locais quando não há workers; None: um por núcleo
+    processes: Optional[int] = None
+    # URLs de outras instâncias deste servidor (ex: "http://10.0.0.2:8000");
+    # vazio: fatias rodam num pool de processos local
+    workers: List[str] = []
+
+
+class ShardSpec(BaseModel):
+    # fatia determinística de uma varredura, executada por /shards/run
+    scan: str               # id da varredura de origem (só informativo)
+    index: int
+    count: int
+    target: str             # IP, rede ou intervalo de endereços
+    ports: List[int]        # na ordem de varredura
+    protocol: str
     print_closed: bool = False
     print_filtered: bool = False
+    engine: str = "async"
+    discovery: bool = False
+    fingerprint: bool = True
+    # sondagens por segundo desta fatia; None: só o limite do próprio worker
+    rate: Optional[float] = None
+
+
+class JobInfo(BaseModel):
+    id: str
+    kind: str               # "scan"
+    # "queued", "running", "completed", "failed", "cancelled" ou "interrupted"
+    status: str
+    done: int               # sondagens (ip, porta) concluídas
+    total: int              # sondagens previstas (sem descoberta de hosts)
+    results: int            # resultados já gravados
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None
+
+
+class ScanInfo(BaseModel):
+    id: str
+    target: str
+    protocol: str
+    start_port: int
+    end_port: int
+    ports: Optional[str] = None
+    incremental: bool
+    # varredura usada como base pelo modo incremental
+    previous: Optional[str] = None
+    status: str             # "running", "completed" ou "aborted"
+    results: int            # resultados gravados
+    started_at: datetime
+    finished_at: Optional[datetime] = None
 
 
 class PortResult(BaseModel):
@@ -20,12 +88,29 @@ class PortResult(BaseModel):
     # "open", "closed", "filtered", "open|filtered", "unknown", ou "error"
     status: str
     service: Optional[str] = None
+    # produto e versão identificados pela sondagem de serviço, ex: "OpenSSH 9.6p1"
+    version: Optional[str] = None
     os_info: Optional[str] = None
     banner: Optional[str] = None
     error_code: Optional[int] = None
     error_message: Optional[str] = None
 
 
+class PortChange(BaseModel):
+    ip: str
+    port: int
+    protocol: str
+    change: str             # "opened" ou "closed"
+    before: Optional[PortResult] = None   # None: não reportada
+    after: Optional[PortResult] = None
+
+
+class ScanDiff(BaseModel):
+    since: str              # varredura de referência
+    scan: str               # varredura comparada
+    changes: List[PortChange]
+
+
 class AnalyzeRequest(BaseModel):
     url: HttpUrl
 
@@ -40,6 +125,16 @@ class AnalyzeResult(BaseModel):
     technologies: List[Technology]
 
 
+class AnalyzeBatchRequest(BaseModel):
+    urls: List[HttpUrl]
+
+
+class AnalyzeBatchItem(BaseModel):
+    url: str
+    technologies: Optional[List[Technology]] = None
+    error: Optional[str] = None
+
+
 class WhoisRequest(BaseModel):
     domain: str
 
@@ -65,6 +160,14 @@ class WhoisRecord(BaseModel):
     zipcode: Optional[str]
     country: Optional[str]
 
+class DomainBatchRequest(BaseModel):
+    domains: List[str]
+
+class WhoisBatchItem(BaseModel):
+    domain: str
+    record: Optional[WhoisRecord] = None
+    error: Optional[str] = None
+
 class DnsRequest(BaseModel):
     domain: str
 
@@ -75,9 +178,89 @@ class DnsRecord(BaseModel):
     ns:       List[str] = []
     txt:      List[str] = []
     cname:    List[str] = []
+    soa:      List[str] = []
+    srv:      List[str] = []
+    caa:      List[str] = []
+    ptr:      List[str] = []
+
+class DnsBatchItem(BaseModel):
+    domain: str
+    record: Optional[DnsRecord] = None
+    error: Optional[str] = None
+
+class DnsCacheStats(BaseModel):
+    hits: int
+    misses: int
+    size: int
+    max_size: int
+
+class SchedulerLease(BaseModel):
+    name: str               # protocolo da varredura, ou "service probe"
+    sockets: int            # sockets em uso
+    waiting: int            # sondagens esperando um socket
+
+class SchedulerStats(BaseModel):
+    # sockets que todas as varreduras podem ter abertos ao mesmo tempo
+    budget: int
+    in_use: int
+    rate: float             # sondagens por segundo, somando as varreduras; 0: sem limite
+    fd_limit: int           # RLIMIT_NOFILE
+    threads: int            # threads compartilhadas pelas varreduras com engine "thread"
+    leases: List[SchedulerLease]
+
+class ResponseCacheStats(BaseModel):
+    endpoint: str
+    # segundos que uma resposta fica em cache; 0 só agrupa requisições simultâneas
+    ttl: float
+    entries: int
+    hits: int
+    # requisições que esperaram outra idêntica em andamento
+    shared: int
+    misses: int
+    bypassed: int
+    saved_calls: int
+    hit_ratio: float
 
 class SubdomainRequest(BaseModel):
     domain: str
+    # nome de um arquivo em SUBDOMAIN_WORDLIST_DIR (ex.: "common.txt", incluído);
+    # None usa a lista embutida
+    wordlist: Optional[str] = None
 
 class SubdomainResult(BaseModel):
     subdomains: List[str]
+    # endereços do registro wildcard, se o domínio tiver um
+    wildcard_ips: List[str] = []
+
+class ReconRequest(BaseModel):
+    domain: str
+    wordlist: Optional[str] = None
+    # portas varridas em cada IP único
+    start_port: int = 1
+    end_port: int = 1024
+
+class ReconEvent(BaseModel):
+    # "subdomain", "dns", "ports", "technologies" ou "error"
+    stage: str
+    host: str
+    ip: Optional[str] = None
+    record: Optional[DnsRecord] = None
+    ports: Optional[List[PortResult]] = None
+    url: Optional[str] = None
+    technologies: Optional[List[Technology]] = None
+    error: Optional[str] = None
+
+
+class StartupPhase(BaseModel):
+    kind: str               # "import", "init" ou "warmup"
+    name: str
+    thread: str
+    started: float          # segundos desde o início da subida do servidor
+    seconds: float
+
+
+class StartupReport(BaseModel):
+    # até o servidor aceitar requisições; None enquanto sobe
+    ready_seconds: Optional[float] = None
+    totals: Dict[str, float]  # segundos por tipo de fase
+    phases: List[StartupPhase]
@@ -0,0 +1,183 @@
+# pipeline.py
+import asyncio
+from typing import AsyncIterator, Dict, List, Optional, Set
+
+from models import PortResult, ReconEvent
+from tools.DNS import DnsTool
+from tools.PortScanner import PortScanner
+from tools.ServiceProbe import ServiceProber
+from tools.SubdomainScanner import SubdomainTool
+from tools.Wappalyzer import Wappalyzer
+from tools.utils import normalize_domain
+
+# end-of-stage marker passed down the queues, one per downstream worker
+_DONE = object()
+
+# ports fingerprinted whatever the services table calls them
+WEB_PORTS = {80: "http", 443: "https", 8000: "http", 8008: "http",
+             8080: "http", 8443: "https", 8888: "http"}
+
+
+def web_url(host: str, port: PortResult) -> Optional[str]:
+    """URL to fingerprint for an open port of `host`, or None if it does not look like HTTP(S)."""
+    scheme = WEB_PORTS.get(port.port)
+    if scheme is None:
+        service = port.service or ""
+        if not service.startswith("http"):
+            return None
+        scheme = "https" if "https" in service else "http"
+    default = 443 if scheme == "https" else 80
+    return f"{scheme}://{host}" if port.port == default else f"{scheme}://{host}:{port.port}"
+
+
+class ReconPipeline:
+    """
+    Subdomains -> DNS -> port scan -> web fingerprinting, as concurrent
+    stages connected by bounded queues: each stage starts on the first item
+    the previous one produces, and a slow stage holds back the ones before
+    it instead of letting work pile up.
+
+    Every address is port-scanned once, however many hostnames resolve to
+    it; its open ports are reported for each of those hostnames. Only open
+    HTTP(S) ports are fingerprinted, once per URL.
+    """
+
+    def __init__(self, subdomains: SubdomainTool, dns: DnsTool,
+                 scanner: PortScanner, analyzer: Wappalyzer,
+                 dns_workers: int = 20, scan_workers: int = 4,
+                 web_workers: int = 8, queue_size: int = 100,
+                 prober: Optional[ServiceProber] = None):
+        self.subdomains = subdomains
+        self.dns = dns
+        self.scanner = scanner
+        self.prober = prober or ServiceProber()
+        self.analyzer = analyzer
+        self.dns_workers = dns_workers
+        self.scan_workers = scan_workers
+        self.web_workers = web_workers
+        self.queue_size = queue_size
+
+    def run(self, domain: str, wordlist: Optional[str] = None,
+            start_port: int = 1, end_port: int = 1024) -> AsyncIterator[ReconEvent]:
+        """
+        Validate the arguments and return an async iterator of ReconEvents,
+        yielded as each stage produces them. Failures of a single host are
+        reported as "error" events and do not stop the run.
+        """
+        domain = normalize_domain(domain)
+        if not domain:
+            raise ValueError("Domain is required")
+        if not 1 <= start_port <= end_port <= 65535:
+            raise ValueError("Port range must be within 1-65535")
+        if wordlist:
+            self.subdomains._wordlist_path(wordlist)
+        return self._events(domain, wordlist, start_port, end_port)
+
+    async def _events(self, domain: str, wordlist: Optional[str],
+                      start_port: int, end_port: int) -> AsyncIterator[ReconEvent]:
+        out: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        hosts: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        ips: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        urls: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+
+        ip_hosts: Dict[str, List[str]] = {}          # address -> hostnames resolving to it
+        scanned: Dict[str, List[PortResult]] = {}    # address -> open ports, once scanned
+        seen_urls: Set[str] = set()
+
+        async def publish(host: str, ip: str, ports: List[PortResult]) -> None:
+            await out.put(ReconEvent(stage="ports", host=host, ip=ip, ports=ports))
+            for port in ports:
+                url = web_url(host, port)
+                if url and url not in seen_urls:
+                    seen_urls.add(url)
+                    await urls.put((host, url))
+
+        async def find_hosts():
+            # the apex itself is recon'd too, it just is not a "subdomain" event
+            await hosts.put(domain)
+            async for fqdn in self.subdomains.iter_scan(domain, wordlist):
+                await out.put(ReconEvent(stage="subdomain", host=fqdn))
+                await hosts.put(fqdn)
+
+        async def resolve():
+            while (host := await hosts.get()) is not _DONE:
+                try:
+                    record = await self.dns.aenumerate(host)
+                except ValueError as e:
+                    await out.put(ReconEvent(stage="error", host=host, error=str(e)))
+                    continue
+                await out.put(ReconEvent(stage="dns", host=host, record=record))
+                for ip in record.a:
+                    known = ip_hosts.get(ip)
+                    if known is None:
+                        ip_hosts[ip] = [host]
+                        await ips.put(ip)
+                        continue
+                    known.append(host)
+                    # the address was already scanned: fan its result out right away
+                    if ip in scanned:
+                        await publish(host, ip, scanned[ip])
+
+        async def scan():
+            while (ip := await ips.get()) is not _DONE:
+                # open ports are fingerprinted, so HTTP on odd ports is found too
+                findings = self.prober.enrich(self.scanner.stream_findings(ip, start_port, end_port, "tcp",
+                                                                           False, False, engine="async"))
+                try:
+                    ports = [self.scanner.to_port_result(f, "tcp") async for f in findings if f.status == "open"]
+                except Exception as e:
+                    ports = []
+                    await out.put(ReconEvent(stage="error", host=ip_hosts[ip][0], ip=ip, error=str(e)))
+                scanned[ip] = ports
+                # hostnames that show up during the loop publish themselves (see resolve)
+                for host in list(ip_hosts[ip]):
+                    await publish(host, ip, ports)
+
+        async def fingerprint():
+            while (item := await urls.get()) is not _DONE:
+                host, url = item
+                try:
+                    result = await asyncio.to_thread(self.analyzer.analyze, url)
+                except ValueError as e:
+                    await out.put(ReconEvent(stage="error", host=host, url=url, error=str(e)))
+                    continue
+                await out.put(ReconEvent(stage="technologies", host=host, url=url,
+                                         technologies=result["technologies"]))
+
+        async def then_close(tasks: List[asyncio.Future], queue: asyncio.Queue, workers: int):
+            await asyncio.gather(*tasks)
+            for _ in range(workers):
+                await queue.put(_DONE)
+
+        finders = [asyncio.ensure_future(find_hosts())]
+        resolvers = [asyncio.ensure_future(resolve()) for _ in range(self.dns_workers)]
+        scanners = [asyncio.ensure_future(scan()) for _ in range(self.scan_workers)]
+        fingerprinters = [asyncio.ensure_future(fingerprint()) for _ in range(self.web_workers)]
+        tasks = finders + resolvers + scanners + fingerprinters + [
+            asyncio.ensure_future(then_close(finders, hosts, self.dns_workers)),
+            asyncio.ensure_future(then_close(resolvers, ips, self.scan_workers)),
+            asyncio.ensure_future(then_close(scanners, urls, self.web_workers)),
+        ]
+
+        async def supervise():
+            try:
+                await asyncio.gather(*tasks)
+            except Exception as e:
+                await out.put(e)
+            else:
+                await out.put(_DONE)
+
+        supervisor = asyncio.ensure_future(supervise())
+        try:
+            while True:
+                item = await out.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # the consumer may stop early (client disconnect): stop every stage
+            for task in tasks:
+                task.cancel()
+            supervisor.cancel()
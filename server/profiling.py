@@ -0,0 +1,150 @@
+# profiling.py
+import glob
+import hmac
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Dict, List, Optional, Set
+
+from tools.utils import DATA_DIR
+
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(DATA_DIR, "profiles"))
+# every request is sampled and kept if it takes at least this long; 0 disables
+SLOW_REQUEST_SECONDS = float(os.environ.get("PROFILE_SLOW_SECONDS", 0))
+SAMPLE_INTERVAL = float(os.environ.get("PROFILE_SAMPLE_INTERVAL", 0.005))
+# value a request's X-Profile header must carry to be profiled on demand; unset disables it
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN") or None
+# saved profiles kept; the oldest are deleted past this
+MAX_PROFILES = int(os.environ.get("PROFILE_MAX_FILES", 100))
+
+
+def profile_requested(header: Optional[str]) -> bool:
+    """Whether an X-Profile header value asks for (and may have) a profile."""
+    return PROFILE_TOKEN is not None and header is not None and \
+        hmac.compare_digest(header.encode(), PROFILE_TOKEN.encode())
+
+
+class _Sampler:
+    """
+    The one sampler thread of the process: every `interval` seconds it
+    records the Python stack of every other thread into each active
+    SamplingProfiler. It runs only while some profiler is active, so
+    concurrent profiled requests cost one stack walk per tick, not one each.
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._profilers: Set["SamplingProfiler"] = set()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, profiler: "SamplingProfiler") -> None:
+        with self._lock:
+            self._profilers.add(profiler)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+                self._thread.start()
+
+    def remove(self, profiler: "SamplingProfiler") -> None:
+        with self._lock:
+            self._profilers.discard(profiler)
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._profilers:
+                    self._thread = None
+                    return
+            names: Dict[int, str] = {t.ident: t.name for t in threading.enumerate()}
+            stacks = []
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                calls = []
+                while frame is not None:
+                    code = frame.f_code
+                    calls.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                calls.append(names.get(ident, str(ident)))
+                stacks.append(";".join(reversed(calls)))
+            with self._lock:  # only into profiles not stopped meanwhile
+                for profiler in self._profilers:
+                    profiler.stacks.update(stacks)
+
+
+_SAMPLER = _Sampler()
+
+
+class SamplingProfiler:
+    """
+    Statistical profile of the time between `start` and `stop`: the stacks
+    of every thread are sampled each SAMPLE_INTERVAL seconds by a shared
+    sampler thread. Nothing is hooked into the profiled code, so the
+    overhead is the sampler thread alone, however many profiles are taken
+    at once.
+
+    It samples the whole process, so concurrent requests and idle worker
+    threads show up too; stacks are prefixed with their thread name to tell
+    them apart. Results come out in the folded format ("a;b;c count")
+    understood by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self):
+        self.stacks: Counter = Counter()
+
+    def start(self) -> "SamplingProfiler":
+        _SAMPLER.add(self)
+        return self
+
+    def stop(self) -> Counter:
+        """Stop sampling into this profile; cheap, does not wait for the sampler."""
+        _SAMPLER.remove(self)
+        return self.stacks
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def save(self, name: str) -> None:
+        """Write the folded stacks to PROFILE_DIR under `name` (blocking I/O)."""
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(os.path.join(PROFILE_DIR, name), "w") as f:
+            f.write(self.folded())
+        _prune()
+
+
+def profile_name(label: str) -> str:
+    """A new, unique file name for a profile of `label`, picked before it is saved."""
+    safe = "".join(c if c.isalnum() else "_" for c in label).strip("_")[:60]
+    now = time.time()
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f".{int(now * 1e6) % 1_000_000:06d}"
+    return f"{stamp}-{safe}-{uuid.uuid4().hex[:8]}.folded"
+
+
+def saved_profiles() -> List[str]:
+    """Names of the saved profiles, newest first."""
+    return sorted((os.path.basename(path) for path in glob.glob(os.path.join(PROFILE_DIR, "*.folded"))),
+                  reverse=True)
+
+
+def _prune() -> None:
+    # names start with their timestamp (to the microsecond), so they sort oldest first
+    saved = sorted(glob.glob(os.path.join(PROFILE_DIR, "*.folded")), key=os.path.basename)
+    for path in saved[:max(0, len(saved) - MAX_PROFILES)]:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def profile_path(name: str) -> Optional[str]:
+    """Path of a saved profile, or None if `name` is not one (no path traversal)."""
+    base = os.path.realpath(PROFILE_DIR)
+    path = os.path.realpath(os.path.join(base, name))
+    if os.path.dirname(path) != base or not os.path.isfile(path):
+        return None
+    return path
@@ -0,0 +1,337 @@
+# sharding.py
+import asyncio
+import copy
+import math
+import multiprocessing
+import os
+import queue
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union
+
+from history import ScanRunner
+from models import PortResult, ShardedScanRequest, ShardSpec
+from tools.Metrics import Counter
+from tools.PortScanner import PortScanner
+from tools.Scheduler import SocketScheduler
+from tools.ServiceProbe import ServiceProber
+
+if TYPE_CHECKING:
+    import httpx
+
+# probes per shard aimed for: small enough that a retried shard costs little
+# and results come back steadily, large enough that per-shard overhead
+# (a process task or an HTTP request) does not matter
+SHARD_PROBES = int(os.environ.get("SHARD_PROBES", 50_000))
+MAX_SHARDS = 10_000
+# further attempts of a shard that failed, before the whole scan fails
+SHARD_RETRIES = int(os.environ.get("SHARD_RETRIES", 2))
+# shards run at once by each worker instance
+WORKER_SLOTS = int(os.environ.get("SHARD_WORKER_SLOTS", 2))
+# longest silence tolerated on a worker's result stream
+WORKER_READ_TIMEOUT = float(os.environ.get("SHARD_READ_TIMEOUT", 300))
+# a local shard process sends its results back in batches of this many lines,
+# and may get this many batches ahead of the coordinator
+BATCH_LINES = 256
+BATCHES_AHEAD = 8
+
+SHARDS = Counter("scanner_shards_total", "Shard runs finished, by runner and outcome.", ("runner", "status"))
+
+# end-of-stream marker passed through the result queue
+_DONE = object()
+
+
+def plan(request: ShardedScanRequest, scan_id: str, ports: Sequence[int], count: int) -> List[ShardSpec]:
+    """
+    Split a scan into about `count` shards. The address space is cut into
+    contiguous ranges when there are enough addresses; otherwise every
+    shard gets all addresses and every count-th port, which keeps each
+    shard in frequency order. The same request always gives the same shards.
+    """
+    target = request.target.strip()
+    span = PortScanner.host_range(target)
+    hosts = 1 if span is None else int(span[1]) - int(span[0]) + 1
+    count = max(1, min(count, hosts * len(ports)))
+    if count == 1:
+        pieces = [(target, list(ports))]
+    elif hosts >= count:
+        first = span[0]
+        pieces = [(f"{first + i * hosts // count}-{first + (i + 1) * hosts // count - 1}", list(ports))
+                  for i in range(count)]
+    else:
+        count = min(count, len(ports))
+        pieces = [(target, list(ports[i::count])) for i in range(count)]
+    return [ShardSpec(scan=scan_id, index=i, count=len(pieces), target=shard_target, ports=shard_ports,
+                      protocol=request.protocol, print_closed=request.print_closed,
+                      print_filtered=request.print_filtered, engine=request.engine,
+                      discovery=request.discovery, fingerprint=request.fingerprint)
+            for i, (shard_target, shard_ports) in enumerate(pieces)]
+
+
+def _shard_results(scanner: PortScanner, prober: ServiceProber,
+                   shard: ShardSpec) -> Union[Iterator[PortResult], AsyncIterator[PortResult]]:
+    """The results of one shard, as a plain or async iterator like `PortScanner.stream`."""
+    proto, engine = scanner._engine_for(shard.protocol, shard.engine)
+    if shard.rate:
+        scanner = copy.copy(scanner)
+        scanner.scan_rate = shard.rate
+    findings = scanner.stream_findings(shard.target, 1, 65535, shard.protocol, shard.print_closed,
+                                       shard.print_filtered, engine=shard.engine,
+                                       discovery=shard.discovery, ports=shard.ports)
+    if shard.fingerprint and proto == "tcp":
+        findings = (prober.enrich_sync if engine == "thread" else prober.enrich)(findings)
+    # they leave the process as JSON lines, so this is the API edge
+    return scanner.port_results(findings, proto)
+
+
+_scanner: Optional[PortScanner] = None
+_prober: Optional[ServiceProber] = None
+
+
+def _init_process(budget: int, rate: float) -> None:
+    """Process pool initializer: scans of this process share its part of the coordinator's budget and rate."""
+    global _scanner, _prober
+    scheduler = SocketScheduler(budget, rate)
+    _scanner, _prober = PortScanner(scheduler=scheduler), ServiceProber(scheduler=scheduler)
+
+
+def run_shard(spec: str, out: "queue.Queue[Optional[List[str]]]") -> None:
+    """
+    Process pool entry point: scan one shard, sending its results to `out`
+    as batches of JSON lines as they come, then None. A coordinator that
+    stops reading for WORKER_READ_TIMEOUT aborts the shard.
+    """
+    batch: List[str] = []
+
+    def add(res: PortResult) -> None:
+        batch.append(res.model_dump_json())
+        if len(batch) >= BATCH_LINES:
+            out.put(batch[:], timeout=WORKER_READ_TIMEOUT)
+            batch.clear()
+
+    results = _shard_results(_scanner, _prober, ShardSpec.model_validate_json(spec))
+    if hasattr(results, "__aiter__"):
+        async def drain():
+            async for res in results:
+                add(res)
+        asyncio.run(drain())
+    else:
+        for res in results:
+            add(res)
+    out.put(batch, timeout=WORKER_READ_TIMEOUT)
+    out.put(None, timeout=WORKER_READ_TIMEOUT)
+
+
+class _Processes:
+    """
+    Spawned process pool for local shards, replaced if one of its processes
+    dies. Each process gets an equal part of `budget` sockets and `rate`
+    probes per second, so that together they stay within the coordinator's.
+    """
+
+    def __init__(self, size: int, budget: int, rate: float):
+        self.size = size
+        self.share = (max(1, budget // size), rate / size)
+        # spawn, not fork: the server process has threads and open databases
+        self.context = multiprocessing.get_context("spawn")
+        # results come back through its queues while a shard runs
+        self.manager = self.context.Manager()
+        self.pool = self._new()
+
+    def _new(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(self.size, mp_context=self.context,
+                                   initializer=_init_process, initargs=self.share)
+
+    async def run(self, shard: ShardSpec) -> AsyncIterator[str]:
+        loop = asyncio.get_running_loop()
+        pool = self.pool
+        out = self.manager.Queue(BATCHES_AHEAD)
+        try:
+            future = loop.run_in_executor(pool, run_shard, shard.model_dump_json(), out)
+            while True:
+                try:
+                    batch = await loop.run_in_executor(None, out.get, True, 0.5)
+                except queue.Empty:
+                    if future.done():
+                        future.result()  # raises why the shard stopped short
+                        raise OSError(f"Shard {shard.index} ended without its results")
+                    continue
+                if batch is None:
+                    break
+                for line in batch:
+                    yield line
+            await future
+        except BrokenProcessPool:
+            if self.pool is pool:
+                pool.shutdown(wait=False, cancel_futures=True)
+                self.pool = self._new()
+            raise
+
+    def close(self) -> None:
+        # queued shards are dropped; running ones fail on their next batch
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.manager.shutdown()
+
+
+class ShardCoordinator:
+    """
+    Runs a large scan as independent shards (see `plan`), either in a local
+    process pool (one scanner per core) or on other instances of this
+    server through their /shards/run endpoint, several shards per worker.
+    Results are merged as they stream in and recorded in the scan history
+    like any other scan. Local processes and remote workers get a part of
+    this process's probe rate (and local processes of its socket budget),
+    so a sharded scan is no faster on the wire than the limits allow.
+
+    A shard that fails (worker unreachable or dropped mid-stream, crashed
+    process) goes back to the queue and is run again, on whichever slot
+    is free first; the other shards are unaffected, and results the failed
+    attempt already sent are not reported twice.
+    """
+
+    def __init__(self, runner: ScanRunner, retries: int = SHARD_RETRIES,
+                 worker_slots: int = WORKER_SLOTS):
+        self.runner = runner
+        self.retries = retries
+        self.worker_slots = worker_slots
+
+    def stream(self, request: ShardedScanRequest) -> Tuple[str, AsyncIterator[PortResult]]:
+        """Validate and start recording a sharded scan; returns its id and its results."""
+        if request.incremental:
+            raise ValueError("Incremental scans cannot be sharded")
+        if request.shards is not None and not 1 <= request.shards <= MAX_SHARDS:
+            raise ValueError(f"shards must be within 1-{MAX_SHARDS}")
+        if request.processes is not None and request.processes < 1:
+            raise ValueError("processes must be at least 1")
+        workers = [url.strip().rstrip("/") for url in request.workers]
+        if not all(url.startswith(("http://", "https://")) for url in workers):
+            raise ValueError("Worker URLs must start with http:// or https://")
+        ports = self.runner.validate(request)
+        scanner = self.runner.scanner
+        proto, _ = scanner._engine_for(request.protocol, request.engine)
+
+        processes = request.processes or os.cpu_count() or 1
+        slots = len(workers) * self.worker_slots if workers else processes
+        count = request.shards
+        if count is None:
+            total = scanner.count_probes(request.target.strip(), request.start_port,
+                                         request.end_port, ports)
+            # a few shards per slot keeps every slot busy until the end
+            count = min(MAX_SHARDS, max(4 * slots, math.ceil(total / SHARD_PROBES)))
+
+        scan_id = self.runner.history.begin(request, proto)
+        shards = plan(request, scan_id, ports, count)
+        rate = scanner.scheduler.rate
+        if workers and rate:
+            # the probe rate is this process's to share out, wherever the shards run
+            for shard in shards:
+                shard.rate = rate / slots
+        return scan_id, self.runner.recorded_async(
+            scan_id, [lambda: self._run(shards, workers, min(processes, len(shards)))])
+
+    def run(self, shard: ShardSpec) -> Union[Iterator[PortResult], AsyncIterator[PortResult]]:
+        """Worker side: scan one shard handed over by a coordinator, within its rate if it has one."""
+        if shard.rate is not None and shard.rate <= 0:
+            raise ValueError("rate must be positive")
+        return _shard_results(self.runner.scanner, self.runner.prober, shard)
+
+    async def _run(self, shards: List[ShardSpec], workers: List[str],
+                   processes: int) -> AsyncIterator[PortResult]:
+        pending: asyncio.Queue = asyncio.Queue()
+        for shard in shards:
+            pending.put_nowait((shard, 0))
+        lines: asyncio.Queue = asyncio.Queue(maxsize=1024)
+        remaining = len(shards)
+
+        local = client = None
+        retryable: Tuple[type, ...] = (OSError, BrokenProcessPool)
+        if workers:
+            import httpx  # only coordinators of remote workers need it
+            client = httpx.AsyncClient(timeout=httpx.Timeout(WORKER_READ_TIMEOUT, connect=10.0))
+            retryable += (httpx.HTTPError,)
+            executors = [(url, self._remote(client, url)) for url in workers
+                         for _ in range(self.worker_slots)]
+        else:
+            scheduler = self.runner.scanner.scheduler
+            local = _Processes(processes, scheduler.budget, scheduler.rate)
+            executors = [("local", local.run)] * processes
+
+        async def slot(name: str, execute: Callable[[ShardSpec], AsyncIterator[str]]):
+            nonlocal remaining
+            failures = 0
+            while True:
+                item = await pending.get()
+                if item is None:
+                    return
+                shard, attempt = item
+                try:
+                    async for line in execute(shard):
+                        await lines.put((shard.index, line))
+                except retryable as e:
+                    SHARDS.labels("local" if local else "worker", "failed").inc()
+                    if attempt >= self.retries:
+                        raise RuntimeError(f"Shard {shard.index} failed on {name}: {e}") from e
+                    pending.put_nowait((shard, attempt + 1))
+                    # back off, so that a healthy slot picks the shard up first
+                    failures += 1
+                    await asyncio.sleep(min(30.0, 0.5 * 2 ** failures))
+                    continue
+                failures = 0
+                await lines.put((shard.index, _DONE))
+                SHARDS.labels("local" if local else "worker", "completed").inc()
+                remaining -= 1
+                if not remaining:
+                    for _ in executors:
+                        pending.put_nowait(None)
+
+        tasks = [asyncio.ensure_future(slot(name, execute)) for name, execute in executors]
+
+        async def supervise():
+            try:
+                await asyncio.gather(*tasks)
+            except Exception as e:
+                await lines.put(e)
+            else:
+                await lines.put(_DONE)
+
+        supervisor = asyncio.ensure_future(supervise())
+        # shards do not overlap, so only a retry repeats results: what each
+        # shard reported is kept until it completes, and no longer
+        reported: Dict[int, Set[Tuple[str, int, str]]] = {}
+        try:
+            while True:
+                item = await lines.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                index, line = item
+                if line is _DONE:
+                    reported.pop(index, None)
+                    continue
+                res = PortResult.model_validate_json(line)
+                key = (res.ip, res.port, res.protocol)
+                seen = reported.setdefault(index, set())
+                if key in seen:
+                    continue  # reported again by a retried shard
+                seen.add(key)
+                yield res
+        finally:
+            for task in tasks:
+                task.cancel()
+            supervisor.cancel()
+            if local:
+                local.close()
+            if client:
+                await client.aclose()
+
+    @staticmethod
+    def _remote(client: "httpx.AsyncClient", url: str) -> Callable[[ShardSpec], AsyncIterator[str]]:
+        async def execute(shard: ShardSpec) -> AsyncIterator[str]:
+            async with client.stream("POST", f"{url}/shards/run", content=shard.model_dump_json(),
+                                     headers={"Content-Type": "application/json"}) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if line:
+                        yield line
+        return execute
@@ -0,0 +1,107 @@
+# startup.py
+import importlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from tools.Metrics import Gauge
+
+# build the lazily created tools in the background once the server is up
+WARMUP = os.environ.get("STARTUP_WARMUP", "1") not in ("0", "false", "no")
+
+PHASE_SECONDS = Gauge("startup_phase_seconds", "Time spent in each startup phase.", ("kind", "name"))
+
+
+class StartupReport:
+    """
+    Where startup time goes: each phase is an import, the initialization
+    of a tool, or the background warmup, timed from when it began
+    relative to this module's import (the first thing main.py does).
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.ready: Optional[float] = None
+        self.phases: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, kind: str, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            PHASE_SECONDS.labels(kind, name).set(seconds)
+            with self._lock:
+                self.phases.append({"kind": kind, "name": name, "thread": threading.current_thread().name,
+                                    "started": started - self.origin, "seconds": seconds})
+
+    def mark_ready(self) -> None:
+        """Record when the server started accepting requests."""
+        self.ready = time.perf_counter() - self.origin
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            phases = list(self.phases)
+        totals: Dict[str, float] = {}
+        for phase in phases:
+            totals[phase["kind"]] = totals.get(phase["kind"], 0.0) + phase["seconds"]
+        return {"ready_seconds": self.ready, "totals": totals, "phases": phases}
+
+
+STARTUP = StartupReport()
+
+
+class Lazy:
+    """
+    A tool built on first use: `module` is imported and `factory(module)`
+    called once, under a lock, both timed into the startup report. Heavy
+    dependencies stay unimported until a request needs them or the
+    background warmup gets to them.
+    """
+
+    def __init__(self, name: str, module: str, factory: Callable[[Any], Any]):
+        self.name = name
+        self.module = module
+        self.factory = factory
+        self._value: Any = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._value is not None
+
+    def get(self) -> Any:
+        value = self._value
+        if value is not None:
+            return value
+        with self._lock:
+            if self._value is None:
+                with STARTUP.phase("import", self.module):
+                    module = importlib.import_module(self.module)
+                with STARTUP.phase("init", self.name):
+                    self._value = self.factory(module)
+            return self._value
+
+    def warm(self) -> None:
+        tool = self.get()
+        warm = getattr(tool, "warm", None)
+        if warm is not None:
+            with STARTUP.phase("warmup", self.name):
+                warm()
+
+
+def warm_in_background(tools: Iterable[Lazy]) -> threading.Thread:
+    """Build `tools` (and run their `warm` method, if any) one after the other, off the request path."""
+    def run():
+        for tool in tools:
+            try:
+                tool.warm()
+            except Exception:
+                pass  # the request that needs it will raise it
+    thread = threading.Thread(target=run, name="startup-warmup", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,21 @@
+# tests/test_profiles.py
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import profiling
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, "PROFILE_TOKEN", "secret")
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    (tmp_path / "saved.folded").write_text("main;handler 3\n")
+    return TestClient(main.app)
+
+
+@pytest.mark.parametrize("path", ["/profiles", "/profiles/saved.folded"])
+def test_profiles_need_the_token(client, path):
+    assert client.get(path).status_code == 403
+    assert client.get(path, headers={"X-Profile": "wrong"}).status_code == 403
+    assert client.get(path, headers={"X-Profile": "secret"}).status_code == 200
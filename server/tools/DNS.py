@@ -1,39 +1,160 @@
+import asyncio
+import os
+import weakref
 import dns.resolver
-from typing import Dict, List
+import dns.reversename
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
 
 from models import DnsRecord
+from tools.Metrics import timed
+from tools.Resolver import QUERIES, SharedResolver, query_outcome
+from tools.utils import normalize_domain, unique_domains
+
+# DNS queries in flight at once on an event loop, across every domain being enumerated
+MAX_INFLIGHT = int(os.environ.get("DNS_MAX_INFLIGHT", 100))
 
 class DnsTool:
-    def enumerate(self, domain: str) -> DnsRecord:
+    # DnsRecord field -> record type queried on the domain itself
+    RECORD_MAP: Dict[str, str] = {
+        "a":     "A",
+        "aaaa":  "AAAA",
+        "mx":    "MX",
+        "ns":    "NS",
+        "txt":   "TXT",
+        "cname": "CNAME",
+        "soa":   "SOA",
+        "caa":   "CAA",
+    }
+
+    # SRV records only live under service labels, so probe the usual ones
+    SRV_SERVICES = [
+        "_sip._tcp", "_sip._udp", "_sips._tcp", "_xmpp-client._tcp",
+        "_xmpp-server._tcp", "_ldap._tcp", "_kerberos._tcp", "_kerberos._udp",
+        "_autodiscover._tcp", "_caldav._tcp", "_carddav._tcp",
+        "_submission._tcp", "_imaps._tcp", "_pop3s._tcp",
+    ]
+
+    def __init__(self, resolver: Optional[SharedResolver] = None, max_inflight: int = MAX_INFLIGHT):
+        self.resolver = resolver or SharedResolver()
+        self.max_inflight = max_inflight
+        # one limit per event loop: asyncio semaphores cannot be shared between loops
+        self._inflight: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = \
+            weakref.WeakKeyDictionary()
+
+    def _slots(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        slots = self._inflight.get(loop)
+        if slots is None:
+            slots = self._inflight[loop] = asyncio.Semaphore(self.max_inflight)
+        return slots
+
+    async def _query(self, name: str, rtype: str) -> List[str]:
+        try:
+            async with self._slots():
+                answers = await self.resolver.aio.resolve(name, rtype)
+            QUERIES.labels("dns", rtype, "ok").inc()
+            return [rdata.to_text() for rdata in answers]
+        except dns.resolver.NoAnswer as e:
+            QUERIES.labels("dns", rtype, query_outcome(e)).inc()
+            return []
+        except dns.resolver.NXDOMAIN as e:
+            QUERIES.labels("dns", rtype, query_outcome(e)).inc()
+            raise
+        except Exception as e:
+            # catch timeouts, servfail, etc.
+            QUERIES.labels("dns", rtype, query_outcome(e)).inc()
+            return []
+
+    async def _srv(self, domain: str) -> List[str]:
+        async def one(service: str) -> List[str]:
+            name = f"{service}.{domain}"
+            try:
+                return [f"{name} {rdata}" for rdata in await self._query(name, "SRV")]
+            except dns.resolver.NXDOMAIN:
+                return []
+
+        found = await asyncio.gather(*(one(s) for s in self.SRV_SERVICES))
+        return [record for records in found for record in records]
+
+    async def _a_and_ptr(self, domain: str) -> List[List[str]]:
+        """A records, then the PTR of each address as soon as they are known."""
+        a = await self._query(domain, "A")
+
+        async def ptr(ip: str) -> List[str]:
+            try:
+                name = dns.reversename.from_address(ip).to_text()
+                return [f"{ip} {host}" for host in await self._query(name, "PTR")]
+            except dns.resolver.NXDOMAIN:
+                return []
+
+        ptrs = await asyncio.gather(*(ptr(ip) for ip in a))
+        return [a, [record for records in ptrs for record in records]]
+
+    @timed("dns", "enumerate")
+    async def aenumerate(self, domain: str) -> DnsRecord:
         """
-        Query the common DNS record types for `domain` and return a DnsRecord.
+        Query the common DNS record types for `domain` concurrently and
+        return a DnsRecord, so the slowest single query sets the latency.
         Raises ValueError if the domain doesn't exist or is malformed.
         """
-        # normalize
-        domain = domain.strip().lower()
-        if domain.startswith(("http://", "https://")):
-            domain = domain.split("://", 1)[1].split("/", 1)[0]
-
-        record_map: Dict[str,str] = {
-            "a":     "A",
-            "aaaa":  "AAAA",
-            "mx":    "MX",
-            "ns":    "NS",
-            "txt":   "TXT",
-            "cname": "CNAME",
-        }
-
-        results: Dict[str, List[str]] = {}
-        for field, rtype in record_map.items():
-            try:
-                answers = dns.resolver.resolve(domain, rtype)
-                results[field] = [rdata.to_text() for rdata in answers]
-            except dns.resolver.NoAnswer:
-                results[field] = []
-            except dns.resolver.NXDOMAIN as e:
-                raise ValueError(f"Domain not found: {domain}") from e
-            except Exception:
-                # catch timeouts, servfail, etc.
-                results[field] = []
+        domain = normalize_domain(domain)
 
+        fields = [f for f in self.RECORD_MAP if f != "a"]
+        # collect every outcome so a NXDOMAIN doesn't leave the other queries unobserved
+        outcomes = await asyncio.gather(
+            self._a_and_ptr(domain),
+            self._srv(domain),
+            *(self._query(domain, self.RECORD_MAP[f]) for f in fields),
+            return_exceptions=True,
+        )
+        for outcome in outcomes:
+            if isinstance(outcome, dns.resolver.NXDOMAIN):
+                raise ValueError(f"Domain not found: {domain}") from outcome
+            if isinstance(outcome, BaseException):
+                raise outcome
+        (a, ptr), srv, *answers = outcomes
+
+        results: Dict[str, List[str]] = dict(zip(fields, answers))
+        results.update(a=a, ptr=ptr, srv=srv)
         return DnsRecord(**results)
+
+    def enumerate(self, domain: str) -> DnsRecord:
+        return asyncio.run(self.aenumerate(domain))
+
+    async def aenumerate_many(self, domains: Iterable[str], concurrency: int = 50
+                              ) -> AsyncIterator[Tuple[str, Optional[DnsRecord], Optional[str]]]:
+        """
+        Enumerate every distinct normalized domain, at most `concurrency` at
+        a time, yielding (domain, record, error) as each one finishes. Their
+        queries together stay within `max_inflight`.
+        """
+        names = unique_domains(domains)
+        done: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+
+        async def worker():
+            for domain in names:
+                try:
+                    await done.put((domain, await self.aenumerate(domain), None))
+                except ValueError as e:
+                    await done.put((domain, None, str(e)))
+                except Exception:
+                    await done.put((domain, None, "Internal DNS enumeration error"))
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+        finished = asyncio.ensure_future(asyncio.gather(*workers))
+        try:
+            while True:
+                getter = asyncio.ensure_future(done.get())
+                await asyncio.wait((getter, finished), return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    yield getter.result()
+                    continue
+                getter.cancel()
+                finished.result()
+                while not done.empty():
+                    yield done.get_nowait()
+                return
+        finally:
+            for task in workers:
+                task.cancel()
+            finished.cancel()
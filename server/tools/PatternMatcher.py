@@ -0,0 +1,212 @@
+# tools/PatternMatcher.py
+import re
+import time
+from typing import Dict, Iterable, List, Optional, Pattern, Sequence, Set, Tuple
+
+try:
+    import re._parser as sre_parse
+    import re._constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_parse
+    import sre_constants
+
+# literals shorter than this match too often to be a useful prefilter
+MIN_ATOM_LENGTH = 3
+
+_ZERO_WIDTH = {sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT}
+_REPEATS = {sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT}
+if hasattr(sre_constants, "POSSESSIVE_REPEAT"):
+    _REPEATS.add(sre_constants.POSSESSIVE_REPEAT)
+
+
+def _weakest(atoms: List[str]) -> int:
+    return min(len(a) for a in atoms)
+
+
+def _required(items) -> Optional[List[str]]:
+    """
+    Literal strings of which at least one occurs in any text the parsed
+    regex `items` matches, or None if no such set is known.
+    """
+    best: Optional[List[str]] = None
+    run: List[str] = []
+
+    def consider(atoms: Optional[List[str]]) -> None:
+        nonlocal best
+        if atoms and (best is None or _weakest(atoms) > _weakest(best)):
+            best = atoms
+
+    for op, av in items:
+        if op is sre_constants.LITERAL:
+            run.append(chr(av))
+            continue
+        if op in _ZERO_WIDTH:
+            continue
+        if run:
+            consider(["".join(run)])
+            run = []
+        if op is sre_constants.SUBPATTERN:
+            consider(_required(av[-1]))
+        elif op in _REPEATS and av[0] >= 1:
+            consider(_required(av[2]))
+        elif op is sre_constants.BRANCH:
+            alternatives = [_required(branch) for branch in av[1]]
+            if all(alternatives):
+                consider([atom for alt in alternatives for atom in alt])
+    if run:
+        consider(["".join(run)])
+    return best
+
+
+def required_atoms(pattern: Pattern) -> Optional[List[str]]:
+    """Lower-cased literals one of which must appear for `pattern` to match."""
+    try:
+        atoms = _required(sre_parse.parse(pattern.pattern, pattern.flags))
+    except Exception:
+        return None
+    if not atoms or _weakest(atoms) < MIN_ATOM_LENGTH:
+        return None
+    return sorted({a.lower() for a in atoms})
+
+
+class LazyPattern:
+    """
+    A regex compiled on its first search. A large ruleset then only pays
+    for the patterns some text actually gets to (most are ruled out by
+    MultiPatternMatcher's prefilter); a pattern `re` rejects never matches.
+    """
+    __slots__ = ("pattern", "flags", "_compiled")
+
+    def __init__(self, pattern: str, flags: int = 0):
+        self.pattern = pattern
+        self.flags = flags
+        self._compiled: Optional[Pattern] = None
+
+    def __reduce__(self):
+        return LazyPattern, (self.pattern, self.flags)
+
+    def search(self, string: str, *args):
+        compiled = self._compiled
+        if compiled is None:
+            try:
+                compiled = re.compile(self.pattern, self.flags)
+            except re.error:
+                compiled = _NEVER
+            self._compiled = compiled
+        return compiled.search(string, *args)
+
+
+_NEVER = re.compile(r"(?!)")
+
+# (pattern source, flags) -> required_atoms of it
+AtomTable = Dict[Tuple[str, int], Optional[List[str]]]
+
+
+def trie_regex(words: Iterable[str]) -> str:
+    """
+    Regex source for an alternation of `words` factored into a trie, so the
+    engine walks shared prefixes once. Longer words are preferred, so a
+    match at a position is the longest word starting there.
+    """
+    trie: Dict = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def build(node: Dict) -> str:
+        terminal = "" in node
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch != ""]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if terminal:
+            return "(?:" + body + ")?"
+        return body
+
+    return build(trie)
+
+
+class MultiPatternMatcher:
+    """
+    Finds which of many regexes match a text with one pass over it.
+
+    Every pattern is reduced to a set of required literals ("atoms"). All
+    atoms are merged into a single trie-shaped regex that is run once over
+    the lower-cased text; only the patterns whose atoms were seen (plus the
+    few without any usable atom) are then run for real.
+
+    Finding the atoms means parsing every regex; pass a `known_atoms`
+    table (e.g. unpickled from the rule cache) to skip that. Atoms
+    computed here are added to it. The merged regex is compiled on first use.
+    """
+
+    def __init__(self, patterns: Sequence[Pattern], known_atoms: Optional[AtomTable] = None):
+        self.patterns = list(patterns)
+        self._owners: Dict[str, List[int]] = {}
+        self._always: List[int] = []
+        known_atoms = {} if known_atoms is None else known_atoms
+        for idx, pattern in enumerate(self.patterns):
+            key = (pattern.pattern, pattern.flags)
+            if key not in known_atoms:
+                known_atoms[key] = required_atoms(pattern)
+            atoms = known_atoms[key]
+            if atoms is None:
+                self._always.append(idx)
+                continue
+            for atom in atoms:
+                self._owners.setdefault(atom, []).append(idx)
+        self._scanner: Optional[Pattern] = None
+
+    def warm(self) -> None:
+        """Compile the merged prefilter regex now rather than on the first text."""
+        if self._scanner is None and self._owners:
+            self._scanner = re.compile("(?=(" + trie_regex(self._owners) + "))", re.S)
+
+    def candidates(self, text: str) -> Set[int]:
+        """Indexes of the patterns that may match `text`."""
+        found: Set[int] = set(self._always)
+        if not self._owners:
+            return found
+        self.warm()
+        seen: Set[str] = set()
+        for m in self._scanner.finditer(text.lower()):
+            hit = m.group(1)
+            if hit in seen:
+                continue
+            seen.add(hit)
+            # the trie reports the longest atom at each position; shorter
+            # atoms that are prefixes of it are present as well
+            for end in range(MIN_ATOM_LENGTH, len(hit) + 1):
+                owners = self._owners.get(hit[:end])
+                if owners:
+                    found.update(owners)
+        return found
+
+    def search(self, text: str, among: Optional[Set[int]] = None,
+               costs: Optional[Dict[int, float]] = None) -> Set[int]:
+        """
+        Indexes of the patterns (restricted to `among`, if given) that match
+        `text`. With `costs`, the seconds spent running each candidate
+        pattern are added to costs[index].
+        """
+        return self.search_any([text], among, costs)
+
+    def search_any(self, texts: Sequence[str], among: Optional[Set[int]] = None,
+                   costs: Optional[Dict[int, float]] = None) -> Set[int]:
+        """Indexes of the patterns (restricted to `among`, if given) that match at least one of `texts`."""
+        if not texts:
+            return set()
+        candidates = self.candidates(texts[0] if len(texts) == 1 else "\n".join(texts))
+        if among is not None:
+            candidates &= among
+        if costs is None:
+            return {idx for idx in candidates if any(self.patterns[idx].search(t) for t in texts)}
+        found = set()
+        for idx in candidates:
+            started = time.perf_counter()
+            if any(self.patterns[idx].search(t) for t in texts):
+                found.add(idx)
+            costs[idx] = costs.get(idx, 0.0) + time.perf_counter() - started
+        return found
@@ -1,51 +1,162 @@
+import asyncio
+import functools
+import os
 import socket
-from ipaddress import ip_network
+from collections import OrderedDict
+from contextlib import nullcontext
+from ipaddress import IPv4Address, IPv6Address, ip_address, ip_network
 import errno
-from typing import List, Optional
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import AsyncIterable, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Sized, Tuple, Union
+from concurrent.futures import FIRST_COMPLETED, wait
+from itertools import islice
 
 from models import PortResult
+from tools.Metrics import Counter, Gauge, timed
+from tools.PortSpec import by_frequency
+from tools.Probers import Prober, SynProber, UdpProber
+from tools.ResultStore import Finding, ResultStore
+from tools.Scheduler import Lease, SocketScheduler, default_scheduler
+from tools.ServiceProbe import default_signatures
+from tools.ServiceTable import SERVICES
+
+
+ENGINES = ("async", "thread")
+
+IPAddress = Union[IPv4Address, IPv6Address]
+
+# end-of-stream marker passed through the async result queue
+_DONE = object()
+
+# connect() errno -> probe outcome, for metrics
+_OUTCOMES = {0: "open", errno.ECONNREFUSED: "closed", errno.ETIMEDOUT: "filtered"}
+
+# ports probed per address by the host discovery pass
+DISCOVERY_PORTS = (80, 443, 22, 445, 3389)
+
+# how many per-host RTT estimators are kept around during one scan
+RTT_TABLE_SIZE = 4096
+
+# addresses swept together, one port at a time across all of them, so that
+# consecutive probes go to different hosts
+HOST_BLOCK = 256
+
+# packets sent per second by UDP and SYN scans (first tries and retransmissions)
+UDP_RATE = float(os.environ.get("SCANNER_UDP_RATE", 2000))
+SYN_RATE = float(os.environ.get("SCANNER_SYN_RATE", 10000))
+
+PROBES = Counter("scanner_probes_total", "Port probes finished, by outcome.", ("protocol", "status"))
+INFLIGHT = Gauge("scanner_inflight_sockets", "Sockets currently open for probing.")
+
+
+class RttEstimator:
+    """
+    Smoothed RTT / RTT variance tracker for one host (RFC 6298, as used by
+    nmap): timeout = srtt + 4 * rttvar, clamped to [min_timeout, max_timeout].
+    Until the first sample arrives the timeout is `max_timeout`.
+    """
+    __slots__ = ("srtt", "rttvar", "min_timeout", "max_timeout")
+
+    def __init__(self, min_timeout: float, max_timeout: float):
+        self.srtt: Optional[float] = None
+        self.rttvar = 0.0
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+
+    def update(self, rtt: float) -> None:
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            delta = rtt - self.srtt
+            self.srtt += delta / 8
+            self.rttvar += (abs(delta) - self.rttvar) / 4
+
+    @property
+    def timeout(self) -> float:
+        if self.srtt is None:
+            return self.max_timeout
+        return min(self.max_timeout, max(self.min_timeout, self.srtt + 4 * self.rttvar))
+
+
+# connect_ex codes of a connection still being set up
+_IN_PROGRESS = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN)
+# loops without add_writer (Windows' proactor) connect through sock_connect
+_NO_WRITERS = (asyncio.ProactorEventLoop,) if hasattr(asyncio, "ProactorEventLoop") else ()
+
+
+def _settle(future: asyncio.Future, value: bool) -> None:
+    if not future.done():
+        future.set_result(value)
 
 
 class PortScanner:
-    def __init__(self, timeout: float = 1.0):
+    def __init__(self, timeout: float = 1.0, engine: str = "async",
+                 max_concurrency: int = 500, per_host_limit: int = 250,
+                 adaptive_timeout: bool = True, min_timeout: float = 0.05,
+                 retries: int = 1, udp_rate: float = UDP_RATE, syn_rate: float = SYN_RATE,
+                 scheduler: Optional[SocketScheduler] = None, scan_rate: Optional[float] = None):
+        """
+        `engine` selects how probes are driven: "async" keeps up to
+        `max_concurrency` non-blocking connects in flight on one event loop
+        (at most `per_host_limit` against a single address), "thread" is the
+        original one-blocking-socket-per-worker path, on the thread pool
+        shared by all such scans (see `SocketScheduler.executor`).
+        Against loopback or a LAN, where a connect completes in microseconds,
+        "thread" is faster (the loop's per-probe bookkeeping dominates);
+        "async" is the default because it holds far more probes in flight
+        than there are threads, which is what counts against remote hosts.
+        For UDP, "async" sends every probe from one socket at `udp_rate`
+        datagrams per second (see `_iter_packets`).
+
+        Protocol "syn" is a half-open TCP scan from one raw socket at
+        `syn_rate` packets per second; it needs CAP_NET_RAW (Linux) and
+        falls back to a connect scan with the chosen engine without it.
+
+        With `adaptive_timeout` the async engine derives each host's connect
+        timeout from its observed RTT (never above `timeout`, never below
+        `min_timeout`) and retransmits a timed-out probe up to `retries`
+        times with a doubled timeout before calling the port filtered.
+
+        Whatever the engine, every socket and probe counts against
+        `scheduler` (by default the one shared by the whole process), which
+        divides a global socket budget and probe rate among concurrent scans;
+        `scan_rate`, if given, further caps the probes per second of each scan.
+        """
+        if engine not in ENGINES:
+            raise ValueError(f"Engine inválido; use um de {ENGINES}.")
         self.timeout = timeout
+        self.engine = engine
+        self.max_concurrency = max_concurrency
+        self.per_host_limit = per_host_limit
+        self.adaptive_timeout = adaptive_timeout
+        self.min_timeout = min_timeout
+        self.retries = retries
+        self.udp_rate = udp_rate
+        self.syn_rate = syn_rate
+        self.scheduler = scheduler or default_scheduler()
+        self.scan_rate = scan_rate
 
     @staticmethod
     def get_service_name(port: int, protocol: str = 'tcp') -> str:
-        try:
-            return socket.getservbyport(port, protocol)
-        except OSError:
-            return "unknown"
+        return SERVICES.lookup(port, protocol)
 
     @staticmethod
     def identify_os(banner: str) -> str:
-        bl = banner.lower()
-        if "windows" in bl:
-            return "Windows"
-        if any(k in bl for k in ("ubuntu", "debian", "centos", "fedora", "linux")):
-            return "Linux"
-        if "freebsd" in bl:
-            return "FreeBSD"
-        if "openbsd" in bl:
-            return "OpenBSD"
-        if any(k in bl for k in ("ios", "macos", "darwin")):
-            return "Mac OS"
-        return "Unknown"
-
-    def _scan_tcp(self, ip: str, port: int, print_closed: bool, print_filtered: bool) -> Optional[PortResult]:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(self.timeout)
-        code = sock.connect_ex((ip, port))
-        banner = ""
+        """OS hinted at by a banner, per the OS hints of the signature database."""
+        return default_signatures().guess_os(banner) or "Unknown"
+
+    def _tcp_result(self, ip: str, port: int, code: int,
+                    print_closed: bool, print_filtered: bool) -> Optional[Finding]:
+        """
+        Map a connect() errno (0 on success) to a Finding, or None if it is
+        not reported. The connection is not read from: banners, versions
+        and OS come from the separate service probe stage (ServiceProbe).
+        """
+        PROBES.labels("tcp", _OUTCOMES.get(code, "unknown")).inc()
         status = None
         error_code = None
         if code == 0:
             status = "open"
-            try:
-                banner = sock.recv(1024).decode(errors="ignore").strip()
-            except socket.timeout:
-                pass
         elif code == errno.ECONNREFUSED and print_closed:
             status = "closed"
         elif code == errno.ETIMEDOUT and print_filtered:
@@ -53,69 +164,676 @@ class PortScanner:
         elif code not in (0, errno.ECONNREFUSED, errno.ETIMEDOUT):
             status = "unknown"
             error_code = code
-        sock.close()
         if status is None:
             return None
-        service = self.get_service_name(port, 'tcp')
-        os_info = self.identify_os(banner) if banner else "Unknown"
+        return Finding(ip, port, status, error_code=error_code)
+
+    def to_port_result(self, finding: Finding, protocol: str) -> PortResult:
+        """Build the API model for a finding, filling in service and OS guess."""
+        if protocol == "udp" and finding.status in ("closed", "error"):
+            return PortResult(ip=finding.ip, port=finding.port, protocol=protocol,
+                              status=finding.status, error_message=finding.error_message)
+        banner = finding.banner
         return PortResult(
-            ip=ip, port=port, protocol="tcp", status=status,
-            service=service, os_info=os_info, banner=banner,
-            error_code=error_code
+            ip=finding.ip, port=finding.port, protocol=protocol, status=finding.status,
+            service=finding.service or self.get_service_name(finding.port, protocol),
+            version=finding.version,
+            os_info=finding.os_info or (self.identify_os(banner) if banner else "Unknown"),
+            banner=banner, error_code=finding.error_code
         )
 
-    def _scan_udp(self, ip: str, port: int, print_closed: bool, print_filtered: bool) -> Optional[PortResult]:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.settimeout(self.timeout)
+    def _scan_tcp(self, ip: str, port: int, print_closed: bool, print_filtered: bool,
+                  lease: Lease) -> Optional[Finding]:
+        lease.pace()
+        with lease.open_socket() as sock, INFLIGHT.labels().track():
+            sock.settimeout(self.timeout)
+            code = sock.connect_ex((ip, port))
+        return self._tcp_result(ip, port, code, print_closed, print_filtered)
+
+    @staticmethod
+    async def _connect_async(sock: socket.socket, ip: str, port: int, timeout: float) -> int:
+        """Non-blocking connect; returns 0 on success or the errno (ETIMEDOUT on timeout)."""
+        loop = asyncio.get_running_loop()
+        if isinstance(loop, _NO_WRITERS):
+            try:
+                await asyncio.wait_for(loop.sock_connect(sock, (ip, port)), timeout)
+                return 0
+            except asyncio.TimeoutError:
+                return errno.ETIMEDOUT
+            except OSError as e:
+                return e.errno or errno.EIO
+        # by hand rather than wait_for(sock_connect): no task or extra
+        # callbacks per probe, which is most of the cost of a local probe
         try:
-            sock.sendto(b'', (ip, port))
-            banner = ""
-            status = None
+            code = sock.connect_ex((ip, port))
+        except OSError as e:
+            return e.errno or errno.EIO
+        if code not in _IN_PROGRESS:
+            return code
+        writable = loop.create_future()
+        fd = sock.fileno()
+        loop.add_writer(fd, _settle, writable, True)
+        timer = loop.call_later(timeout, _settle, writable, False)
+        try:
+            if not await writable:
+                return errno.ETIMEDOUT
+        finally:
+            loop.remove_writer(fd)
+            timer.cancel()
+        return sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+
+    async def _scan_tcp_async(self, ip: str, port: int, print_closed: bool,
+                              print_filtered: bool, lease: Lease,
+                              rtt: Optional[RttEstimator] = None) -> Optional[Finding]:
+        """Non-blocking counterpart of `_scan_tcp`; same statuses."""
+        loop = asyncio.get_running_loop()
+        timeout = rtt.timeout if rtt else self.timeout
+        attempts = 1 + (self.retries if rtt else 0)
+        for attempt in range(attempts):
+            await lease.pace_async()
+            async with lease.open_socket_async() as sock:
+                sock.setblocking(False)
+                with INFLIGHT.labels().track():
+                    started = loop.time()
+                    code = await self._connect_async(sock, ip, port, timeout)
+                if rtt is not None and code in (0, errno.ECONNREFUSED):
+                    # both SYN-ACK and RST are full round trips
+                    rtt.update(loop.time() - started)
+            if code != errno.ETIMEDOUT or timeout >= self.timeout:
+                break
+            timeout = min(timeout * 2, self.timeout)
+        return self._tcp_result(ip, port, code, print_closed, print_filtered)
+
+    async def _host_alive(self, ip: str, slots: asyncio.Semaphore,
+                          rtt: Optional[RttEstimator], lease: Lease) -> bool:
+        """A host is alive if any discovery port answers, with either SYN-ACK or RST."""
+        loop = asyncio.get_running_loop()
+
+        async def probe(port: int) -> bool:
+            async with slots:
+                await lease.pace_async()
+                async with lease.open_socket_async() as sock:
+                    sock.setblocking(False)
+                    with INFLIGHT.labels().track():
+                        started = loop.time()
+                        code = await self._connect_async(sock, ip, port, self.timeout)
+            if code in (0, errno.ECONNREFUSED):
+                if rtt is not None:
+                    rtt.update(loop.time() - started)
+                return True
+            return False
+
+        return any(await asyncio.gather(*(probe(p) for p in DISCOVERY_PORTS)))
+
+    async def _live_hosts(self, hosts: Iterable[str], slots: asyncio.Semaphore,
+                          rtts: "OrderedDict[str, RttEstimator]", lease: Lease) -> AsyncIterator[List[str]]:
+        """
+        Discovery pass: probe a batch of addresses at a time and yield the
+        ones that answer, a batch at a time.
+        """
+        batch_size = max(1, self.max_concurrency // len(DISCOVERY_PORTS))
+        for batch in self._blocks(hosts, batch_size):
+            alive = await asyncio.gather(*(
+                self._host_alive(ip, slots, self._rtt_for(rtts, ip), lease) for ip in batch))
+            live = [ip for ip, ok in zip(batch, alive) if ok]
+            if live:
+                yield live
+
+    def _rtt_for(self, rtts: "OrderedDict[str, RttEstimator]", ip: str) -> Optional[RttEstimator]:
+        if not self.adaptive_timeout:
+            return None
+        rtt = rtts.get(ip)
+        if rtt is None:
+            rtt = rtts[ip] = RttEstimator(self.min_timeout, self.timeout)
+            if len(rtts) > RTT_TABLE_SIZE:
+                rtts.popitem(last=False)
+        else:
+            rtts.move_to_end(ip)
+        return rtt
+
+    def _scan_udp(self, ip: str, port: int, print_closed: bool, print_filtered: bool,
+                  lease: Lease) -> Optional[Finding]:
+        lease.pace()
+        with lease.open_socket(socket.SOCK_DGRAM) as sock, INFLIGHT.labels().track():
+            sock.settimeout(self.timeout)
             try:
-                data, _ = sock.recvfrom(1024)
-                banner = data.decode(errors="ignore").strip()
-                status = "open"
-            except socket.timeout:
-                if print_filtered:
-                    status = "open|filtered"
-            sock.close()
-            if not status:
-                return None
-            service = self.get_service_name(port, 'udp')
-            os_info = self.identify_os(banner) if banner else "Unknown"
-            return PortResult(
-                ip=ip, port=port, protocol="udp", status=status,
-                service=service, os_info=os_info, banner=banner
-            )
-        except socket.error as e:
-            if e.errno == errno.ECONNREFUSED and print_closed:
-                return PortResult(ip=ip, port=port, protocol="udp", status="closed")
-            return PortResult(ip=ip, port=port, protocol="udp", status="error", error_message=str(e))
+                sock.sendto(b'', (ip, port))
+                banner = ""
+                status = None
+                try:
+                    data, _ = sock.recvfrom(1024)
+                    banner = data.decode(errors="ignore").strip()
+                    status = "open"
+                    PROBES.labels("udp", "open").inc()
+                except socket.timeout:
+                    PROBES.labels("udp", "open|filtered").inc()
+                    if print_filtered:
+                        status = "open|filtered"
+                if not status:
+                    return None
+                return Finding(ip, port, status, banner)
+            except socket.error as e:
+                PROBES.labels("udp", "closed" if e.errno == errno.ECONNREFUSED else "error").inc()
+                if e.errno == errno.ECONNREFUSED and print_closed:
+                    return Finding(ip, port, "closed")
+                return Finding(ip, port, "error", error_message=str(e))
+
+    @staticmethod
+    def host_range(target: str) -> Optional[Tuple[IPAddress, IPAddress]]:
+        """
+        First and last address scanned for a network ("10.0.0.0/24") or an
+        address range ("10.0.0.5-10.0.1.20") target; None for a single host.
+        Raises ValueError on a malformed network or range.
+        """
+        if '/' in target:
+            network = ip_network(target, strict=False)
+            first, last = network.network_address, network.broadcast_address
+            if network.num_addresses > 2:
+                # hosts() leaves out the network and broadcast (IPv4) or the
+                # subnet-router anycast (IPv6) address
+                first += 1
+                if network.version == 4:
+                    last -= 1
+            return first, last
+        low, sep, high = target.partition('-')
+        if not sep:
+            return None
+        try:
+            first, last = ip_address(low.strip()), ip_address(high.strip())
+        except ValueError:
+            return None  # a host name with a dash in it
+        if first.version != last.version or first > last:
+            raise ValueError("Invalid address range")
+        return first, last
+
+    @classmethod
+    def _expand_hosts(cls, target: str) -> Iterable[str]:
+        """Lazily yield the addresses of `target`; it is parsed eagerly so bad input fails fast."""
+        span = cls.host_range(target)
+        if span is None:
+            return [target]
+        first, last = span
+        return (str(first + i) for i in range(int(last) - int(first) + 1))
+
+    def _engine_for(self, protocol: str, engine: Optional[str]) -> Tuple[str, str]:
+        """(protocol the results are reported under, engine that drives the probes)."""
+        proto = protocol.lower()
+        if proto not in ('tcp', 'udp', 'syn'):
+            raise ValueError("Protocol inválido; use 'tcp', 'udp' ou 'syn'.")
+        engine = engine or self.engine
+        if engine not in ENGINES:
+            raise ValueError(f"Engine inválido; use um de {ENGINES}.")
+        if proto == "syn":
+            # the ports are TCP ports either way; without raw sockets it is a connect scan
+            proto = "tcp"
+            if SynProber.available():
+                engine = "syn"
+        return proto, engine
 
+    def _prepare(self, target: str, start_port: int, end_port: int,
+                 protocol: str, engine: Optional[str], discovery: bool,
+                 ports: Optional[Sequence[int]] = None) -> Tuple[Iterable[str], Sequence[int], str, str, bool]:
+        proto, engine = self._engine_for(protocol, engine)
+        hosts = self._expand_hosts(target)
+        if ports is None:
+            if not 1 <= start_port <= end_port <= 65535:
+                raise ValueError("Port range must be within 1-65535")
+            # most likely open first, so open services turn up early
+            ports = by_frequency(range(start_port, end_port + 1), proto)
+        elif not all(1 <= port <= 65535 for port in ports):
+            raise ValueError("Port range must be within 1-65535")
+        # a single explicit target is always scanned; discovery only prunes networks and ranges
+        return hosts, ports, proto, engine, discovery and self.host_range(target) is not None
+
+    @staticmethod
+    def _blocks(items: Iterable[str], size: int) -> Iterator[List[str]]:
+        it = iter(items)
+        while block := list(islice(it, size)):
+            yield block
+
+    @classmethod
+    def _sweep(cls, hosts: Iterable[str], ports: Sequence[int],
+               skip: Optional[Set[Tuple[str, int]]] = None) -> Iterator[Tuple[str, int]]:
+        """
+        (ip, port) pairs of `hosts` x `ports`, leaving out those in `skip`.
+        Hosts are taken HOST_BLOCK at a time and each port is probed on the
+        whole block before the next one, so `ports` keeps its order while
+        no single host is hammered with consecutive probes.
+        """
+        for block in cls._blocks(hosts, HOST_BLOCK):
+            for port in ports:
+                for ip in block:
+                    if not skip or (ip, port) not in skip:
+                        yield ip, port
+
+    @classmethod
+    def count_probes(cls, target: str, start_port: int, end_port: int,
+                     ports: Optional[Sequence[int]] = None) -> int:
+        """Number of (ip, port) probes a scan of `target` runs without discovery."""
+        ports = len(ports) if ports is not None else max(0, end_port - start_port + 1)
+        span = cls.host_range(target)
+        if span is None:
+            return ports
+        first, last = span
+        return ports * (int(last) - int(first) + 1)
+
+    @timed("scanner", "scan")
     def scan(self, target: str, start_port: int, end_port: int,
              protocol: str, print_closed: bool, print_filtered: bool,
-             max_workers: int = 100) -> List[PortResult]:
-        proto = protocol.lower()
-        if proto not in ('tcp', 'udp'):
-            raise ValueError("Protocol inválido; use 'tcp' ou 'udp'.")
+             max_workers: int = 100, engine: Optional[str] = None,
+             discovery: bool = False,
+             progress: Optional[Callable[[], None]] = None,
+             ports: Optional[Sequence[int]] = None,
+             skip: Optional[Set[Tuple[str, int]]] = None) -> ResultStore:
+        """
+        Run a whole scan and return its findings in a compact ResultStore;
+        use `to_port_result` to turn them into API models.
+
+        `progress`, if given, is called once per finished probe (reported
+        or not); an exception raised from it aborts the scan.
+        `ports`, if given, replaces the start/end range and is probed in
+        that order; (ip, port) pairs in `skip` are not probed.
+        """
+        hosts, ports, proto, engine, discovery = self._prepare(
+            target, start_port, end_port, protocol, engine, discovery, ports)
+        store = ResultStore(proto)
+        if engine == "thread":
+            for finding in self._iter_threaded(hosts, ports, proto, print_closed, print_filtered,
+                                               max_workers, discovery, progress, skip):
+                store.add(finding)
+            return store
+
+        iter_async = self._async_driver(proto, engine)
+
+        async def collect():
+            async for finding in iter_async(hosts, ports, print_closed, print_filtered,
+                                            discovery, progress, skip):
+                store.add(finding)
+
+        asyncio.run(collect())
+        return store
+
+    def stream(self, target: str, start_port: int, end_port: int,
+               protocol: str, print_closed: bool, print_filtered: bool,
+               max_workers: int = 100, engine: Optional[str] = None,
+               discovery: bool = False,
+               progress: Optional[Callable[[], None]] = None,
+               ports: Optional[Sequence[int]] = None,
+               skip: Optional[Set[Tuple[str, int]]] = None) -> Union[Iterator[PortResult], AsyncIterator[PortResult]]:
+        """`stream_findings` as PortResults, for callers that hand them straight to the API."""
+        proto, _ = self._engine_for(protocol, engine)
+        return self.port_results(self.stream_findings(target, start_port, end_port, protocol, print_closed,
+                                                      print_filtered, max_workers, engine, discovery,
+                                                      progress, ports, skip), proto)
+
+    def stream_findings(self, target: str, start_port: int, end_port: int,
+                        protocol: str, print_closed: bool, print_filtered: bool,
+                        max_workers: int = 100, engine: Optional[str] = None,
+                        discovery: bool = False,
+                        progress: Optional[Callable[[], None]] = None,
+                        ports: Optional[Sequence[int]] = None,
+                        skip: Optional[Set[Tuple[str, int]]] = None) -> Union[Iterator[Finding], AsyncIterator[Finding]]:
+        """
+        Like `scan`, but yields each Finding as soon as its probe finishes.
+        Work is generated lazily and only a bounded number of probes is in
+        flight, so memory does not grow with the size of the target.
+        Returns a plain iterator for the thread engine and an async iterator
+        for the async engine. Arguments are validated before returning.
 
-        # expand hosts as before…
-        hosts = ([str(h) for h in ip_network(target, strict=False).hosts()]
-                 if '/' in target
-                 else [target])
+        With `discovery`, addresses of a CIDR target are first probed on a
+        few common ports and those that do not answer are skipped.
+        `progress`, `ports` and `skip` work as in `scan`.
+        """
+        hosts, ports, proto, engine, discovery = self._prepare(
+            target, start_port, end_port, protocol, engine, discovery, ports)
+        return self._findings(proto, engine, hosts, ports, print_closed, print_filtered,
+                              max_workers, discovery, progress, skip)
 
-        results: List[PortResult] = []
+    def stream_pair_findings(self, pairs: Iterable[Tuple[str, int]], protocol: str,
+                             print_closed: bool, print_filtered: bool,
+                             max_workers: int = 100, engine: Optional[str] = None,
+                             progress: Optional[Callable[[], None]] = None) -> Union[Iterator[Finding], AsyncIterator[Finding]]:
+        """Like `stream_findings`, for an explicit list of (ip, port) pairs probed in the given order."""
+        proto, engine = self._engine_for(protocol, engine)
+        return self._findings(proto, engine, (), (), print_closed, print_filtered,
+                              max_workers, False, progress, None, pairs)
+
+    def port_results(self, findings: Union[Iterable[Finding], AsyncIterable[Finding]],
+                     protocol: str) -> Union[Iterator[PortResult], AsyncIterator[PortResult]]:
+        """`to_port_result` over a plain or async iterator of findings, keeping its kind."""
+        if not hasattr(findings, "__aiter__"):
+            return (self.to_port_result(f, protocol) for f in findings)
+
+        async def results():
+            async for finding in findings:
+                yield self.to_port_result(finding, protocol)
+
+        return results()
+
+    def _findings(self, proto: str, engine: str, hosts: Iterable[str], ports: Sequence[int],
+                  print_closed: bool, print_filtered: bool, max_workers: int, discovery: bool,
+                  progress: Optional[Callable[[], None]], skip: Optional[Set[Tuple[str, int]]],
+                  pairs: Optional[Iterable[Tuple[str, int]]] = None) -> Union[Iterator[Finding], AsyncIterator[Finding]]:
+        if engine == "thread":
+            return self._iter_threaded(hosts, ports, proto, print_closed, print_filtered,
+                                       max_workers, discovery, progress, skip, pairs)
+        return self._async_driver(proto, engine)(hosts, ports, print_closed, print_filtered,
+                                                 discovery, progress, skip, pairs)
+
+    def _discover_blocking(self, hosts: Iterable[str], lease: Lease) -> Iterator[str]:
+        """Discovery pass for the thread engine: run the async probes one batch at a time."""
+        async def live(batch: List[str]) -> List[str]:
+            slots = asyncio.Semaphore(self.max_concurrency)
+            return [ip async for alive in self._live_hosts(batch, slots, OrderedDict(), lease)
+                    for ip in alive]
+
+        batch_size = max(1, self.max_concurrency // len(DISCOVERY_PORTS))
+        for batch in self._blocks(hosts, batch_size):
+            yield from asyncio.run(live(batch))
+
+    def _iter_threaded(self, hosts: Iterable[str], ports: Sequence[int], proto: str,
+                       print_closed: bool, print_filtered: bool,
+                       max_workers: int, discovery: bool,
+                       progress: Optional[Callable[[], None]] = None,
+                       skip: Optional[Set[Tuple[str, int]]] = None,
+                       pairs: Optional[Iterable[Tuple[str, int]]] = None) -> Iterator[Finding]:
+        """Thread-pool probing of hosts x ports, or of `pairs` instead when given."""
         scan_fn = self._scan_tcp if proto == 'tcp' else self._scan_udp
+        lease = self.scheduler.lease(f"{proto} (thread)", self.scan_rate)
+        if pairs is not None:
+            work = pairs
+        else:
+            if discovery:
+                hosts = self._discover_blocking(hosts, lease)
+            work = self._sweep(hosts, ports, skip)
+
+        # probes run on the scheduler's pool, shared with concurrent scans;
+        # this one keeps at most 2x max_workers of them queued or running
+        max_workers = min(max_workers, self.scheduler.threads)
+        pool = self.scheduler.executor()
+        pending = set()
+        try:
+            for ip, port in work:
+                pending.add(pool.submit(scan_fn, ip, port, print_closed, print_filtered, lease))
+                if len(pending) >= max_workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        res = future.result()
+                        if progress:
+                            progress()
+                        if res:
+                            yield res
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    res = future.result()
+                    if progress:
+                        progress()
+                    if res:
+                        yield res
+        finally:
+            for future in pending:
+                future.cancel()
+            lease.close()
+
+    async def _iter_async(self, hosts: Iterable[str], ports: Sequence[int],
+                          print_closed: bool, print_filtered: bool,
+                          discovery: bool,
+                          progress: Optional[Callable[[], None]] = None,
+                          skip: Optional[Set[Tuple[str, int]]] = None,
+                          pairs: Optional[Iterable[Tuple[str, int]]] = None) -> AsyncIterator[Finding]:
+        """
+        Drive TCP probes from `max_concurrency` worker coroutines, so the
+        number of open sockets is bounded and no per-pair task is created up
+        front. Workers take (ip, port) pairs straight from the sweep, or,
+        with discovery, through a bounded queue fed as live hosts are found.
+        Results are handed over through a second bounded queue as they complete.
+        `pairs`, when given, is probed instead of hosts x ports.
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.max_concurrency)
+        work: asyncio.Queue = asyncio.Queue(maxsize=self.max_concurrency)
+        # shared by the workers and the discovery probes; without discovery
+        # there are never more workers than slots, so they skip it
+        slots = asyncio.Semaphore(self.max_concurrency)
+        host_slots: Dict[str, asyncio.Semaphore] = {}
+        host_users: Dict[str, int] = {}
+        rtts: "OrderedDict[str, RttEstimator]" = OrderedDict()
+        lease = self.scheduler.lease("tcp", self.scan_rate)
+
+        # with discovery, pairs come through `work`; otherwise each worker
+        # pulls the next one itself, which saves two hand-offs per probe
+        sweep = None if discovery and pairs is None else \
+            iter(pairs if pairs is not None else self._sweep(hosts, ports, skip))
+        limit = slots if sweep is None else nullcontext()
 
-        # spin up a pool of worker threads
-        with ThreadPoolExecutor(max_workers=max_workers) as pool:
-            futures = {
-                pool.submit(scan_fn, ip, port, print_closed, print_filtered): (ip, port)
-                for ip in hosts
-                for port in range(start_port, end_port + 1)
-            }
-            for future in as_completed(futures):
-                res = future.result()
+        async def feed():
+            async for live in self._live_hosts(hosts, slots, rtts, lease):
+                for item in self._sweep(live, ports, skip):
+                    await work.put(item)
+            for _ in workers:
+                await work.put(None)
+
+        async def worker():
+            while True:
+                item = await work.get() if sweep is None else next(sweep, None)
+                if item is None:
+                    return
+                ip, port = item
+                slot = host_slots.get(ip)
+                if slot is None:
+                    slot = host_slots[ip] = asyncio.Semaphore(self.per_host_limit)
+                host_users[ip] = host_users.get(ip, 0) + 1
+                try:
+                    async with slot, limit:
+                        res = await self._scan_tcp_async(ip, port, print_closed, print_filtered,
+                                                         lease, self._rtt_for(rtts, ip))
+                finally:
+                    host_users[ip] -= 1
+                    if not host_users[ip]:
+                        # drop per-host state once nobody is probing that address
+                        del host_users[ip]
+                        del host_slots[ip]
+                if progress:
+                    progress()
                 if res:
-                    results.append(res)
-        return results
+                    await queue.put(res)
+
+        count = self.max_concurrency
+        if sweep is not None and pairs is None and isinstance(hosts, Sized):
+            # workers past the per-host limits would only queue on a host's slot
+            count = max(1, min(count, self.per_host_limit * len(hosts)))
+        workers = [asyncio.ensure_future(worker()) for _ in range(count)]
+        tasks = workers + ([asyncio.ensure_future(feed())] if sweep is None else [])
+
+        async def supervise():
+            try:
+                await asyncio.gather(*tasks)
+            except Exception as e:
+                await queue.put(e)
+            else:
+                await queue.put(_DONE)
+
+        supervisor = asyncio.ensure_future(supervise())
+        try:
+            while True:
+                item = await queue.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # the consumer may stop early (client disconnect): stop probing too
+            for task in tasks:
+                task.cancel()
+            supervisor.cancel()
+            lease.close()
+
+    def _async_driver(self, proto: str, engine: str) -> Callable[..., AsyncIterator[Finding]]:
+        if engine == "syn":
+            return functools.partial(self._iter_packets, SynProber, self.syn_rate)
+        if proto == "udp":
+            return functools.partial(self._iter_packets, UdpProber, self.udp_rate)
+        return self._iter_async
+
+    async def _iter_packets(self, prober_cls: Callable[[], Prober], rate: float,
+                            hosts: Iterable[str], ports: Sequence[int],
+                            print_closed: bool, print_filtered: bool,
+                            discovery: bool,
+                            progress: Optional[Callable[[], None]] = None,
+                            skip: Optional[Set[Tuple[str, int]]] = None,
+                            pairs: Optional[Iterable[Tuple[str, int]]] = None) -> AsyncIterator[Finding]:
+        """
+        Connectionless counterpart of `_iter_async`, for UDP and SYN scans.
+        Every probe goes out of the one socket of a Prober, paced to `rate`
+        packets per second (retransmissions included) with at most
+        `max_concurrency` probes awaiting an answer; the prober reads and
+        classifies whatever comes back whenever the socket is readable.
+        A probe left unanswered for `timeout` is retransmitted up to
+        `retries` times, then reported with the prober's `silent` status.
+        """
+        loop = asyncio.get_running_loop()
+        lease = self.scheduler.lease(prober_cls.protocol, self.scan_rate)
+        # the prober's one socket counts against the budget like any other
+        await lease.acquire_async()
+        try:
+            prober = prober_cls()
+        except BaseException:
+            lease.release()
+            lease.close()
+            raise
+        INFLIGHT.inc()
+        window = asyncio.Semaphore(self.max_concurrency)
+        # (address, port) -> [deadline, retransmissions], oldest first
+        waiting: "OrderedDict[Tuple[str, int], List[float]]" = OrderedDict()
+        # (address, port) -> hosts as given that its probe answers for
+        askers: Dict[Tuple[str, int], List[str]] = {}
+        names: Dict[str, str] = {}       # host as given -> probed address
+        outcomes: asyncio.Queue = asyncio.Queue()
+        fed = asyncio.Event()
+        interval = 1 / rate
+        pace = {"next": loop.time()}
+
+        def settle(key: Tuple[str, int], status: str, banner: str = "",
+                   error: Optional[str] = None) -> None:
+            if waiting.pop(key, None) is None:
+                return  # late or duplicate answer
+            window.release()
+            outcomes.put_nowait((askers.pop(key), key[1], status, banner, error))
+
+        async def transmit(key: Tuple[str, int]) -> None:
+            # one packet per `interval`; sleeping only once a few ms ahead
+            # keeps the timer granularity out of it
+            now = loop.time()
+            slot = max(pace["next"], now)
+            pace["next"] = slot + interval
+            # the scan's own rate, and the one of all scans together
+            delay = max(slot - now, lease.delay())
+            if delay > 0.005:
+                await asyncio.sleep(delay)
+            try:
+                await prober.send(loop, *key)
+            except OSError as e:
+                settle(key, "error", error=str(e))
+                return
+            entry = waiting.get(key)
+            if entry is not None:
+                entry[0] = loop.time() + self.timeout
+
+        async def address(host: str) -> str:
+            ip = names.get(host)
+            if ip is None:
+                try:
+                    ip = str(ip_address(host))
+                except ValueError:
+                    infos = await loop.getaddrinfo(host, None, family=socket.AF_INET,
+                                                   type=socket.SOCK_DGRAM)
+                    ip = infos[0][4][0]
+                names[host] = ip
+            return ip
+
+        async def probe(host: str, port: int) -> None:
+            await window.acquire()
+            try:
+                key = (await address(host), port)
+            except OSError as e:
+                window.release()
+                outcomes.put_nowait(([host], port, "error", "", str(e)))
+                return
+            if key in waiting:
+                # already in flight (overlapping targets, or two hostnames
+                # of one address): its answer is reported for both
+                askers[key].append(host)
+                window.release()
+                return
+            # the deadline is set once the packet is actually sent
+            waiting[key] = [float("inf"), 0]
+            askers[key] = [host]
+            await transmit(key)
+
+        async def feed():
+            if pairs is not None:
+                for host, port in pairs:
+                    await probe(host, port)
+            elif discovery:
+                async for live in self._live_hosts(hosts, asyncio.Semaphore(self.max_concurrency),
+                                                   OrderedDict(), lease):
+                    for host, port in self._sweep(live, ports, skip):
+                        await probe(host, port)
+            else:
+                for host, port in self._sweep(hosts, ports, skip):
+                    await probe(host, port)
+            fed.set()
+
+        async def expire():
+            while not (fed.is_set() and not waiting):
+                now = loop.time()
+                while waiting:
+                    key, entry = next(iter(waiting.items()))
+                    if entry[0] > now:
+                        break
+                    if entry[1] < self.retries:
+                        entry[1] += 1
+                        waiting.move_to_end(key)
+                        await transmit(key)
+                    else:
+                        settle(key, prober.silent)
+                head = next(iter(waiting.values()), None)
+                await asyncio.sleep(min(max(head[0] - loop.time(), 0.001), 0.05) if head else 0.01)
+            outcomes.put_nowait(_DONE)
+
+        loop.add_reader(prober.fileno(), prober.read, settle)
+        tasks = [asyncio.ensure_future(feed()), asyncio.ensure_future(expire())]
+
+        async def supervise():
+            try:
+                await asyncio.gather(*tasks)
+            except Exception as e:
+                outcomes.put_nowait(e)
+
+        supervisor = asyncio.ensure_future(supervise())
+        try:
+            while True:
+                item = await outcomes.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                reported, port, status, banner, error = item
+                PROBES.labels(prober.protocol, status).inc()
+                for host in reported:
+                    if progress:
+                        progress()
+                    if (status == "closed" and not print_closed) or \
+                            (status in ("filtered", "open|filtered") and not print_filtered):
+                        continue
+                    yield Finding(host, port, status, banner, error_message=error)
+        finally:
+            for task in tasks:
+                task.cancel()
+            supervisor.cancel()
+            loop.remove_reader(prober.fileno())
+            prober.close()
+            INFLIGHT.dec()
+            lease.release()
+            lease.close()
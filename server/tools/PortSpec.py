@@ -0,0 +1,96 @@
+# tools/PortSpec.py
+import json
+import os
+from functools import lru_cache
+from typing import Dict, Iterable, List, Sequence
+
+from tools.RuleCache import cache_key, file_stamp, mapped_array
+
+# Ports most often found open, by protocol, most common first: nmap's top
+# 100 in frequency order (plus a few services common today), then the rest
+# of nmap's top 1000 TCP / top 100 UDP ports, whose relative order is kept
+# numeric. Shipped, so that "top-N" means the same ports on every machine.
+PORT_TABLE_FILE = os.environ.get(
+    "PORT_FREQUENCY_TABLE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "port_frequency.json"),
+)
+
+
+@lru_cache(maxsize=None)
+def _table() -> Dict[str, List[int]]:
+    with open(PORT_TABLE_FILE) as f:
+        return json.load(f)
+
+
+def _key(protocol: str) -> str:
+    return cache_key(protocol, file_stamp(PORT_TABLE_FILE))
+
+
+def _build_order(protocol: str) -> List[int]:
+    head = list(dict.fromkeys(_table().get(protocol, _table()["tcp"])))
+    seen = set(head)
+    return head + [p for p in range(1, 65536) if p not in seen]
+
+
+def _build_ranks(protocol: str) -> List[int]:
+    ranks = [0] * 65536
+    for rank, port in enumerate(frequency_order(protocol)):
+        ranks[port] = rank
+    return ranks
+
+
+@lru_cache(maxsize=None)
+def frequency_order(protocol: str = "tcp") -> Sequence[int]:
+    """
+    Every port 1-65535, most likely open first: the shipped table (see
+    PORT_TABLE_FILE), then all the others in numeric order.
+    Built once and memory-mapped from the rule cache after that.
+    """
+    return mapped_array(f"port-order-{protocol}", PORT_TABLE_FILE, _key(protocol), "H",
+                        lambda: _build_order(protocol))
+
+
+@lru_cache(maxsize=None)
+def _ranks(protocol: str) -> Sequence[int]:
+    return mapped_array(f"port-ranks-{protocol}", PORT_TABLE_FILE, _key(protocol), "H",
+                        lambda: _build_ranks(protocol))
+
+
+def port_rank(port: int, protocol: str = "tcp") -> int:
+    """Position of `port` in `frequency_order` (0 is the most common)."""
+    return _ranks(protocol)[port]
+
+
+def by_frequency(ports: Iterable[int], protocol: str = "tcp") -> List[int]:
+    """`ports` without repeats, most likely open first."""
+    return sorted(set(ports), key=_ranks(protocol).__getitem__)
+
+
+def parse_ports(spec: str, protocol: str = "tcp") -> List[int]:
+    """
+    Parse a port list such as "22,80,443,8000-8100,top-1000" into the
+    ports it names, without repeats and in frequency order.
+    Raises ValueError on malformed input or ports outside 1-65535.
+    """
+    ports = set()
+    for token in spec.replace(" ", "").lower().split(","):
+        if not token:
+            continue
+        try:
+            if token.startswith("top-"):
+                count = int(token[4:])
+                if not 1 <= count <= 65535:
+                    raise ValueError
+                ports.update(frequency_order(protocol)[:count])
+                continue
+            first, sep, last = token.partition("-")
+            low = int(first)
+            high = int(last) if sep else low
+        except ValueError:
+            raise ValueError(f"Invalid port list entry: {token!r}") from None
+        if not 1 <= low <= high <= 65535:
+            raise ValueError("Port range must be within 1-65535")
+        ports.update(range(low, high + 1))
+    if not ports:
+        raise ValueError("Port list is empty")
+    return by_frequency(ports, protocol)
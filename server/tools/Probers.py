@@ -0,0 +1,216 @@
+# tools/Probers.py
+import asyncio
+import os
+import random
+import socket
+import struct
+import sys
+import zlib
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Callable, Dict, Optional, Tuple
+
+from tools.UdpProbes import payload
+
+# settle(address-port key, status, banner, error message)
+Settle = Callable[[Tuple[str, int], str, str, Optional[str]], None]
+
+# Linux: ICMP errors of an unconnected UDP socket are queued on its error queue
+_IP_RECVERR = getattr(socket, "IP_RECVERR", 11)
+_MSG_ERRQUEUE = getattr(socket, "MSG_ERRQUEUE", 0x2000)
+_SO_EE_ORIGIN_ICMP = 2
+_ICMP_UNREACH, _ICMP_PORT_UNREACH = 3, 3
+
+_TCP_SYN, _TCP_RST, _TCP_ACK = 0x02, 0x04, 0x10
+# SYN scans send from a port outside Linux's default ephemeral range
+# (32768-60999), so replies never belong to a real connection
+_SYN_PORTS = (61000, 65535)
+# sends of one UDP probe that may fail with the ICMP error of another
+# before the probe is reported as an error
+_SEND_ATTEMPTS = 16
+
+
+class Prober(ABC):
+    """
+    One socket that sends every probe of a scan, and the parser of what
+    comes back on it. PortScanner._iter_packets drives it: `send` for each
+    probe, `read` whenever the socket is readable, which reports each
+    answer through `settle`. Probes nobody answers end up as `silent`.
+    """
+    protocol = ""   # label in scanner_probes_total
+    silent = ""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        sock.setblocking(False)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        except OSError:
+            pass
+
+    def fileno(self) -> int:
+        return self.sock.fileno()
+
+    @abstractmethod
+    async def send(self, loop: asyncio.AbstractEventLoop, ip: str, port: int) -> None:
+        """Send one probe; raises OSError if it could not be sent."""
+
+    @abstractmethod
+    def read(self, settle: Settle) -> None:
+        """Settle every answer waiting on the socket."""
+
+    def close(self) -> None:
+        self.sock.close()
+
+
+class UdpProber(Prober):
+    """
+    Datagrams with a service-specific payload (see UdpProbes). A reply from
+    the probed address and port means open; an ICMP port unreachable
+    (from the socket's error queue, Linux only) closed; any other ICMP
+    error filtered; silence open|filtered.
+    """
+    protocol = "udp"
+    silent = "open|filtered"
+
+    def __init__(self):
+        super().__init__(socket.socket(socket.AF_INET, socket.SOCK_DGRAM))
+        self.recverr = False
+        if sys.platform.startswith("linux"):
+            try:
+                self.sock.setsockopt(socket.IPPROTO_IP, _IP_RECVERR, 1)
+                self.recverr = True
+            except OSError:
+                pass
+
+    async def send(self, loop: asyncio.AbstractEventLoop, ip: str, port: int) -> None:
+        for attempt in range(_SEND_ATTEMPTS):
+            try:
+                await loop.sock_sendto(self.sock, payload(port), (ip, port))
+                return
+            except ConnectionRefusedError:
+                # the ICMP error of another probe, flagged on the socket and
+                # cleared by this failed send; giving up silently would
+                # report a probe never sent as open|filtered
+                if attempt == _SEND_ATTEMPTS - 1:
+                    raise
+
+    def read(self, settle: Settle) -> None:
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(4096)
+            except (BlockingIOError, InterruptedError):
+                break
+            except ConnectionRefusedError:
+                continue  # an ICMP error also flags the socket; it is read below
+            except OSError:
+                break
+            settle(addr[:2], "open", data.decode(errors="ignore").strip(), None)
+        while self.recverr:
+            try:
+                _, ancdata, _, addr = self.sock.recvmsg(0, 512, _MSG_ERRQUEUE)
+            except OSError:
+                break
+            # the address is that of the probe the error is about
+            settle(addr[:2], *self._icmp_outcome(ancdata))
+
+    @staticmethod
+    def _icmp_outcome(ancdata) -> Tuple[str, str, Optional[str]]:
+        """(status, banner, error) for an entry of the socket error queue."""
+        for level, kind, data in ancdata:
+            if level != socket.IPPROTO_IP or kind != _IP_RECVERR or len(data) < 8:
+                continue
+            err, origin, icmp_type, code = struct.unpack_from("=IBBB", data)
+            if origin != _SO_EE_ORIGIN_ICMP:
+                return "error", "", os.strerror(err)
+            if icmp_type == _ICMP_UNREACH and code == _ICMP_PORT_UNREACH:
+                return "closed", "", None
+            return "filtered", "", None
+        return "filtered", "", None
+
+
+def _checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+
+class SynProber(Prober):
+    """
+    Half-open TCP scan over a raw socket (needs CAP_NET_RAW): a bare SYN
+    per probe, no connection state and no file descriptor per port. The
+    same raw socket sees every incoming TCP segment; SYN-ACK means open,
+    RST closed, silence filtered. The kernel answers the SYN-ACK with a
+    RST of its own, as nothing listens on the source port.
+
+    The initial sequence number is a keyed hash of the destination, so a
+    reply is matched to its probe (ack = seq + 1) without keeping state.
+    """
+    protocol = "syn"
+    silent = "filtered"
+
+    def __init__(self):
+        super().__init__(socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_TCP))
+        self.sport = random.randint(*_SYN_PORTS)
+        self._key = random.getrandbits(32)
+        self._sources: Dict[str, bytes] = {}
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def available() -> bool:
+        """True if raw TCP sockets can be opened here (Linux with CAP_NET_RAW)."""
+        if not sys.platform.startswith("linux"):
+            return False
+        try:
+            socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_TCP).close()
+            return True
+        except OSError:
+            return False
+
+    def _seq(self, ip: str, port: int) -> int:
+        return zlib.crc32(f"{ip}:{port}".encode(), self._key)
+
+    def _source(self, ip: str) -> bytes:
+        """Local address the kernel routes `ip` from, needed for the checksum."""
+        src = self._sources.get(ip)
+        if src is None:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+                probe.connect((ip, 9))
+                src = self._sources[ip] = socket.inet_aton(probe.getsockname()[0])
+        return src
+
+    def _packet(self, ip: str, port: int) -> bytes:
+        dst = socket.inet_aton(ip)
+        # MSS option, as sent by real stacks: 24-byte header (data offset 6)
+        header = struct.pack("!HHIIBBHHH", self.sport, port, self._seq(ip, port), 0,
+                             6 << 4, _TCP_SYN, 64240, 0, 0) + b"\x02\x04\x05\xb4"
+        pseudo = self._source(ip) + dst + struct.pack("!BBH", 0, socket.IPPROTO_TCP, len(header))
+        checksum = _checksum(pseudo + header)
+        return header[:16] + struct.pack("!H", checksum) + header[18:]
+
+    async def send(self, loop: asyncio.AbstractEventLoop, ip: str, port: int) -> None:
+        await loop.sock_sendto(self.sock, self._packet(ip, port), (ip, 0))
+
+    def read(self, settle: Settle) -> None:
+        while True:
+            try:
+                data = self.sock.recv(65535)
+            except OSError:
+                break
+            ihl = (data[0] & 0x0F) * 4
+            if len(data) < ihl + 14:
+                continue
+            sport, dport, _, ack = struct.unpack_from("!HHII", data, ihl)
+            if dport != self.sport:
+                continue  # someone else's traffic (or our own SYN on loopback)
+            flags = data[ihl + 13]
+            ip = socket.inet_ntoa(data[12:16])
+            if not flags & _TCP_ACK or ack != (self._seq(ip, sport) + 1) & 0xFFFFFFFF:
+                continue
+            if flags & _TCP_SYN:
+                settle((ip, sport), "open", "", None)
+            elif flags & _TCP_RST:
+                settle((ip, sport), "closed", "", None)
@@ -0,0 +1,82 @@
+# tools/Resolver.py
+import os
+from typing import Dict, List, Optional
+
+import dns.asyncresolver
+import dns.exception
+import dns.resolver
+
+from tools.Metrics import Counter, Gauge
+
+# comma-separated upstream nameservers; empty means the system resolv.conf
+DEFAULT_NAMESERVERS = [ns.strip() for ns in os.environ.get("DNS_NAMESERVERS", "").split(",") if ns.strip()]
+
+QUERIES = Counter("dns_queries_total", "DNS queries, by calling tool, record type and outcome.",
+                  ("tool", "rtype", "outcome"))
+# read from the served SharedResolver's cache statistics (see `SharedResolver.export_metrics`)
+CACHE_HITS = Counter("dns_cache_hits_total", "Answers served from the shared DNS cache.")
+CACHE_MISSES = Counter("dns_cache_misses_total", "Lookups the shared DNS cache could not answer.")
+CACHE_SIZE = Gauge("dns_cache_entries", "Answers held in the shared DNS cache.")
+
+
+def query_outcome(error: Optional[BaseException]) -> str:
+    """Metrics label for how a query ended; `error` is None on success."""
+    if error is None:
+        return "ok"
+    if isinstance(error, dns.resolver.NXDOMAIN):
+        return "nxdomain"
+    if isinstance(error, dns.resolver.NoAnswer):
+        return "noanswer"
+    if isinstance(error, dns.exception.Timeout):
+        return "timeout"
+    return "error"
+
+
+class SharedResolver:
+    """
+    One answer cache shared by every DNS-based tool, with a blocking and an
+    asyncio resolver both reading from and writing to it.
+
+    The cache is dnspython's LRUCache: entries expire with the record TTL,
+    NXDOMAIN / NoAnswer responses are cached for the SOA minimum carried in
+    the authority section, and the least recently used entry is evicted
+    once `cache_size` answers are held.
+
+    Both resolvers query the same explicit `nameservers` (on `port`), give
+    each nameserver `timeout` seconds and give up on a query after
+    `lifetime` seconds overall.
+    """
+
+    def __init__(self, cache_size: int = 10000, nameservers: Optional[List[str]] = None,
+                 port: int = 53, timeout: float = 2.0, lifetime: float = 4.0):
+        self.cache = dns.resolver.LRUCache(cache_size)
+        self.sync = self._configure(dns.resolver.Resolver(), nameservers, port, timeout, lifetime)
+        self.aio = self._configure(dns.asyncresolver.Resolver(), nameservers, port, timeout, lifetime)
+
+    def _configure(self, resolver, nameservers: Optional[List[str]], port: int,
+                   timeout: float, lifetime: float):
+        nameservers = nameservers or DEFAULT_NAMESERVERS
+        if nameservers:
+            resolver.nameservers = list(nameservers)
+        resolver.port = port
+        resolver.timeout = timeout
+        resolver.lifetime = lifetime
+        resolver.cache = self.cache
+        return resolver
+
+    def export_metrics(self) -> None:
+        """Expose this resolver's cache statistics as the dns_cache_* metrics."""
+        CACHE_HITS.set_function(lambda: self.stats()["hits"])
+        CACHE_MISSES.set_function(lambda: self.stats()["misses"])
+        CACHE_SIZE.set_function(lambda: self.stats()["size"])
+
+    def stats(self) -> Dict[str, int]:
+        snapshot = self.cache.get_statistics_snapshot()
+        with self.cache.lock:
+            size = len(self.cache.data)
+        return {
+            "hits": snapshot.hits,
+            "misses": snapshot.misses,
+            "size": size,
+            "max_size": self.cache.max_size,
+        }
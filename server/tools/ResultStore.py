@@ -0,0 +1,90 @@
+# tools/ResultStore.py
+from array import array
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+
+class Finding(NamedTuple):
+    """
+    What a probe reports; service and OS are derived later, at the API edge,
+    unless the service probe stage identified them.
+    """
+    ip: str
+    port: int
+    status: str
+    banner: str = ""
+    error_code: Optional[int] = None
+    error_message: Optional[str] = None
+    service: Optional[str] = None
+    version: Optional[str] = None
+    os_info: Optional[str] = None
+
+
+STATUSES = ("open", "closed", "filtered", "open|filtered", "unknown", "error")
+_STATUS_CODES = {s: i for i, s in enumerate(STATUSES)}
+_UNIDENTIFIED = (None, None, None)
+
+
+class ResultStore:
+    """
+    Column-oriented storage for the findings of one scan.
+
+    Each finding costs a few bytes in typed arrays (ip index, port, status
+    code, banner offset, errno) instead of a full PortResult object.
+    Addresses and banners are interned, so repeated values are stored once.
+    """
+    __slots__ = ("protocol", "_ips", "_ip_index", "_banners", "_banner_index",
+                 "_ip", "_port", "_status", "_banner", "_error_code", "_error_messages", "_identities")
+
+    def __init__(self, protocol: str):
+        self.protocol = protocol
+        self._ips: List[str] = []
+        self._ip_index: Dict[str, int] = {}
+        self._banners: List[str] = [""]
+        self._banner_index: Dict[str, int] = {"": 0}
+        self._ip = array("I")
+        self._port = array("H")
+        self._status = array("B")
+        self._banner = array("I")
+        self._error_code = array("i")
+        # error messages only appear on failed UDP probes, keep them sparse
+        self._error_messages: Dict[int, str] = {}
+        # so do identified services: only open ports go through the probe stage
+        self._identities: Dict[int, Tuple[Optional[str], Optional[str], Optional[str]]] = {}
+
+    def add(self, finding: Finding) -> None:
+        ip_idx = self._ip_index.get(finding.ip)
+        if ip_idx is None:
+            ip_idx = self._ip_index[finding.ip] = len(self._ips)
+            self._ips.append(finding.ip)
+        banner_idx = self._banner_index.get(finding.banner)
+        if banner_idx is None:
+            banner_idx = self._banner_index[finding.banner] = len(self._banners)
+            self._banners.append(finding.banner)
+        if finding.error_message is not None:
+            self._error_messages[len(self._port)] = finding.error_message
+        if finding.service is not None or finding.version is not None or finding.os_info is not None:
+            self._identities[len(self._port)] = (finding.service, finding.version, finding.os_info)
+        self._ip.append(ip_idx)
+        self._port.append(finding.port)
+        self._status.append(_STATUS_CODES[finding.status])
+        self._banner.append(banner_idx)
+        # errno 0 is never reported as an error, so it stands for "none"
+        self._error_code.append(finding.error_code or 0)
+
+    def __len__(self) -> int:
+        return len(self._port)
+
+    def __iter__(self) -> Iterator[Finding]:
+        for i in range(len(self._port)):
+            service, version, os_info = self._identities.get(i, _UNIDENTIFIED)
+            yield Finding(
+                ip=self._ips[self._ip[i]],
+                port=self._port[i],
+                status=STATUSES[self._status[i]],
+                banner=self._banners[self._banner[i]],
+                error_code=self._error_code[i] or None,
+                error_message=self._error_messages.get(i),
+                service=service,
+                version=version,
+                os_info=os_info,
+            )
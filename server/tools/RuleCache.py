@@ -0,0 +1,110 @@
+# tools/RuleCache.py
+import glob
+import hashlib
+import mmap
+import os
+import pickle
+import sys
+import tempfile
+from array import array
+from typing import Any, Callable, Iterable, Optional, Sequence, Tuple
+
+from tools.utils import DATA_DIR
+
+# preprocessed rule databases and lookup tables, rebuilt when their sources
+# change. Cached objects are unpickled, so this directory must only be
+# writable by the user running the server: whoever can write a file there
+# can run code in it. Point it elsewhere (or at a read-only path) otherwise.
+CACHE_DIR = os.environ.get("RULE_CACHE_DIR", os.path.join(DATA_DIR, "cache"))
+# bump when the layout of anything cached here changes
+CACHE_VERSION = 1
+
+
+def file_stamp(path: str) -> Tuple[str, Optional[int], Optional[int]]:
+    """(path, mtime, size) of a source file, for cache keys; None fields if it is missing."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return path, None, None
+    return path, st.st_mtime_ns, st.st_size
+
+
+def cache_key(*parts: Any) -> str:
+    """Short digest of `parts` (reprs of plain values, e.g. file stamps)."""
+    raw = repr((CACHE_VERSION, sys.version_info[:2], sys.byteorder) + parts)
+    return hashlib.sha1(raw.encode()).hexdigest()[:20]
+
+
+def _prefix(name: str, source: str) -> str:
+    # the source path is part of the name, so that processes built from
+    # different sources (e.g. another rules file) keep separate entries
+    origin = hashlib.sha1(os.path.abspath(source).encode()).hexdigest()[:12]
+    return os.path.join(CACHE_DIR, f"{name}-{origin}-")
+
+
+def _path(name: str, source: str, key: str, ext: str) -> str:
+    return f"{_prefix(name, source)}{key}.{ext}"
+
+
+def _write(name: str, source: str, key: str, ext: str, data: bytes) -> None:
+    """
+    Atomically write a cache file and drop older versions of it built from
+    the same source; a read-only cache is fine.
+    """
+    path = _path(name, source, key, ext)
+    try:
+        os.makedirs(CACHE_DIR, mode=0o700, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, prefix=f".{name}-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            os.unlink(tmp)
+            raise
+        for stale in glob.glob(f"{glob.escape(_prefix(name, source))}*.{ext}"):
+            if stale != path:
+                os.unlink(stale)
+    except OSError:
+        pass
+
+
+def cached_object(name: str, source: str, key: str, build: Callable[[], Any]) -> Any:
+    """
+    `build()`, unpickled from the cache when it was already built from
+    `source` (the path it is read from) for `key`. Only as trustworthy as
+    CACHE_DIR: the file is unpickled as is.
+    """
+    try:
+        with open(_path(name, source, key, "pickle"), "rb") as f:
+            return pickle.load(f)
+    except Exception:
+        pass  # missing, or written by an incompatible version: rebuild
+    value = build()
+    _write(name, source, key, "pickle", pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+    return value
+
+
+def _mapped(name: str, source: str, key: str, typecode: str) -> Optional[memoryview]:
+    try:
+        with open(_path(name, source, key, "bin"), "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):  # ValueError: empty file
+        return None
+    return memoryview(mapped).cast(typecode)
+
+
+def mapped_array(name: str, source: str, key: str, typecode: str,
+                 build: Callable[[], Iterable[int]]) -> Sequence[int]:
+    """
+    Read-only array of `typecode` items, memory-mapped from the cache file
+    built from `source` for `key`: later starts (and every process on the machine) share
+    the pages instead of rebuilding the table. Without a writable cache
+    directory the table is kept in memory.
+    """
+    view = _mapped(name, source, key, typecode)
+    if view is not None:
+        return view
+    table = array(typecode, build())
+    _write(name, source, key, "bin", table.tobytes())
+    return _mapped(name, source, key, typecode) or table
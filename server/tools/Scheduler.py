@@ -0,0 +1,339 @@
+# tools/Scheduler.py
+import asyncio
+import errno
+import os
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from functools import lru_cache
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, List, Optional
+
+from tools.Metrics import Counter, Gauge, Histogram
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# file descriptors left to everything but scan sockets (HTTP clients, DNS,
+# WHOIS, databases, the listening socket); default: a quarter of the limit, 64-1024
+FD_RESERVE = int(os.environ.get("SCANNER_FD_RESERVE", 0)) or None
+# explicit cap on the sockets all scans may hold at once (0: from the fd limit)
+SOCKET_BUDGET = int(os.environ.get("SCANNER_SOCKET_BUDGET", 0)) or None
+# probes (connects and packets) sent per second by all scans together; 0: no limit
+PROBE_RATE = float(os.environ.get("SCANNER_PROBE_RATE", 20000))
+# how long a socket() that fails for lack of descriptors is retried before giving up
+FD_WAIT = 30.0
+# threads shared by all thread-engine scans (never more than the socket budget)
+SCAN_THREADS = int(os.environ.get("SCANNER_THREADS", 512))
+
+BUDGET = Gauge("scheduler_socket_budget", "Sockets all scans may hold at once.")
+IN_USE = Gauge("scheduler_sockets_in_use", "Sockets held by scans.")
+WAITING = Gauge("scheduler_socket_waiters", "Probes waiting for a socket.")
+LEASES = Gauge("scheduler_leases", "Scans (and probe stages) holding a lease.")
+WAITS = Counter("scheduler_socket_waits_total", "Socket requests that had to wait for the budget.")
+WAIT_SECONDS = Histogram("scheduler_socket_wait_seconds", "Time spent waiting for a socket of the budget.")
+FD_EXHAUSTED = Counter("scheduler_fd_exhausted_total",
+                       "socket() calls that failed for lack of descriptors and were retried.")
+
+_FD_ERRORS = (errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.ENOMEM)
+
+
+def fd_limit() -> int:
+    if resource is None:
+        return 2048
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    return soft if soft != resource.RLIM_INFINITY else 65536
+
+
+def default_budget(limit: Optional[int] = None, reserve: Optional[int] = FD_RESERVE) -> int:
+    limit = limit or fd_limit()
+    if reserve is None:
+        reserve = min(1024, max(64, limit // 4))
+    return max(1, limit - reserve)
+
+
+class _Waiter:
+    """A probe waiting for a socket: a blocked thread, or a future on some event loop."""
+    __slots__ = ("event", "loop", "future", "granted")
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.loop = loop
+        self.event = threading.Event() if loop is None else None
+        self.future: Optional[asyncio.Future] = loop.create_future() if loop is not None else None
+        self.granted = False
+
+
+class Lease:
+    """
+    One scan's claim on the scheduler: sockets are taken through it and
+    counted against both the global budget and the scan's own holdings,
+    which is what the scheduler divides fairly. Close it when the scan ends.
+    """
+
+    def __init__(self, scheduler: "SocketScheduler", name: str, rate: Optional[float] = None):
+        self.scheduler = scheduler
+        self.name = name
+        # probes per second of this lease alone, below the scheduler's rate
+        self.rate = rate
+        self.held = 0
+        self.waiters: Deque[_Waiter] = deque()
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def close(self) -> None:
+        self.scheduler._close(self)
+
+    def acquire(self) -> None:
+        """Take a socket of the budget, blocking the thread until one is free."""
+        waiter = self.scheduler._request(self, None)
+        if waiter is not None:
+            with WAIT_SECONDS.labels().time():
+                waiter.event.wait()
+
+    async def acquire_async(self) -> None:
+        """Take a socket of the budget, waiting on the running loop until one is free."""
+        waiter = self.scheduler._request(self, asyncio.get_running_loop())
+        if waiter is None:
+            return
+        try:
+            with WAIT_SECONDS.labels().time():
+                await waiter.future
+        except asyncio.CancelledError:
+            self.scheduler._abandon(self, waiter)
+            raise
+
+    def release(self) -> None:
+        self.scheduler._release(self)
+
+    def delay(self) -> float:
+        """Seconds until the next probe may go out under the global and lease rates (reserves it)."""
+        delay = self.scheduler._next_slot()
+        if not self.rate:
+            return delay
+        now = time.monotonic()
+        with self._lock:
+            slot = max(self._next, now + delay)
+            self._next = slot + 1 / self.rate
+        return slot - now
+
+    def pace(self) -> None:
+        delay = self.delay()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def pace_async(self) -> None:
+        delay = self.delay()
+        # sleeping only once a few ms ahead keeps the timer granularity out of it
+        if delay > 0.005:
+            await asyncio.sleep(delay)
+
+    @asynccontextmanager
+    async def slot_async(self) -> AsyncIterator[None]:
+        """Hold one socket of the budget, e.g. around a connection opened by asyncio streams."""
+        await self.acquire_async()
+        try:
+            yield
+        finally:
+            self.release()
+
+    @contextmanager
+    def open_socket(self, kind: int = socket.SOCK_STREAM, proto: int = 0) -> Iterator[socket.socket]:
+        """An IPv4 socket counted against the budget, closed (and given back) on exit."""
+        self.acquire()
+        try:
+            sock = _open(kind, proto)
+            try:
+                yield sock
+            finally:
+                sock.close()
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def open_socket_async(self, kind: int = socket.SOCK_STREAM, proto: int = 0) -> AsyncIterator[socket.socket]:
+        """`open_socket` for coroutines: waits for the budget without blocking the loop."""
+        # not built on slot_async: this is on the path of every probe
+        await self.acquire_async()
+        try:
+            sock = await _open_async(kind, proto)
+            try:
+                yield sock
+            finally:
+                sock.close()
+        finally:
+            self.release()
+
+
+def _backoff(error: OSError, waited: float) -> float:
+    """
+    Pause before retrying a socket() that failed with `error`: descriptors
+    held outside the budget can still run out, and then the scan waits
+    for some instead of failing. Re-raises other errors, or after FD_WAIT.
+    """
+    if error.errno not in _FD_ERRORS or waited >= FD_WAIT:
+        raise error
+    FD_EXHAUSTED.inc()
+    # as long as all previous pauses together: doubling, from 10 ms up to 0.5 s
+    return min(max(waited, 0.01), 0.5)
+
+
+def _open(kind: int, proto: int) -> socket.socket:
+    waited = 0.0
+    while True:
+        try:
+            return socket.socket(socket.AF_INET, kind, proto)
+        except OSError as e:
+            pause = _backoff(e, waited)
+        time.sleep(pause)
+        waited += pause
+
+
+async def _open_async(kind: int, proto: int) -> socket.socket:
+    waited = 0.0
+    while True:
+        try:
+            return socket.socket(socket.AF_INET, kind, proto)
+        except OSError as e:
+            pause = _backoff(e, waited)
+        await asyncio.sleep(pause)
+        waited += pause
+
+
+class SocketScheduler:
+    """
+    Process-wide budget of scan sockets and probes per second, shared by
+    every scan whatever drives it (event loops in any thread, thread
+    pools, the service probe stage).
+
+    The socket budget defaults to the RLIMIT_NOFILE soft limit minus a
+    reserve, so that the lightweight endpoints still get descriptors while
+    scans saturate it. A scan takes sockets through its Lease; when none
+    is free the request waits (backpressure) instead of failing with
+    EMFILE, and each socket given back goes to the waiting scan that holds
+    the fewest: a lone scan may use the whole budget, and concurrent scans
+    converge on equal shares as their sockets turn over.
+
+    Probes are also paced to `rate` per second overall, so aggregate
+    throughput does not depend on how many scans run. Thread-engine scans
+    all run their blocking probes on its one pool of `threads` threads.
+    """
+
+    def __init__(self, budget: Optional[int] = None, rate: float = PROBE_RATE):
+        self.budget = budget or SOCKET_BUDGET or default_budget()
+        self.rate = rate
+        self.in_use = 0
+        self._lock = threading.Lock()
+        self._leases: Dict[int, Lease] = {}
+        self._waiting: List[Lease] = []    # leases with waiters, in arrival order
+        self._next = 0.0
+        # more threads than sockets would only wait for one
+        self.threads = min(self.budget, SCAN_THREADS)
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def export_metrics(self) -> None:
+        """Expose this scheduler's state as the scheduler_* gauges."""
+        BUDGET.set_function(lambda: self.budget)
+        IN_USE.set_function(lambda: self.in_use)
+        WAITING.set_function(lambda: sum(len(lease.waiters) for lease in self._waiting))
+        LEASES.set_function(lambda: len(self._leases))
+
+    def executor(self) -> ThreadPoolExecutor:
+        """The thread pool shared by thread-engine scans, started on first use."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.threads, thread_name_prefix="scan")
+            return self._executor
+
+    def lease(self, name: str = "scan", rate: Optional[float] = None) -> Lease:
+        lease = Lease(self, name, rate)
+        with self._lock:
+            self._leases[id(lease)] = lease
+        return lease
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            leases = [{"name": lease.name, "sockets": lease.held, "waiting": len(lease.waiters)}
+                      for lease in self._leases.values()]
+        return {"budget": self.budget, "in_use": self.in_use, "rate": self.rate,
+                "fd_limit": fd_limit(), "threads": self.threads, "leases": leases}
+
+    def _request(self, lease: Lease, loop: Optional[asyncio.AbstractEventLoop]) -> Optional[_Waiter]:
+        """Grant a socket right away (None) or queue a waiter for one."""
+        with self._lock:
+            if self.in_use < self.budget and not self._waiting:
+                self.in_use += 1
+                lease.held += 1
+                return None
+            waiter = _Waiter(loop)
+            lease.waiters.append(waiter)
+            if len(lease.waiters) == 1:
+                self._waiting.append(lease)
+            self._dispatch()
+        WAITS.inc()
+        return waiter
+
+    def _dispatch(self) -> None:
+        # under self._lock: hand free sockets to the waiting lease holding the fewest
+        while self.in_use < self.budget and self._waiting:
+            lease = min(self._waiting, key=lambda l: l.held)
+            waiter = lease.waiters.popleft()
+            if not lease.waiters:
+                self._waiting.remove(lease)
+            self.in_use += 1
+            lease.held += 1
+            waiter.granted = True
+            if waiter.loop is None:
+                waiter.event.set()
+            else:
+                try:
+                    waiter.loop.call_soon_threadsafe(self._wake, lease, waiter)
+                except RuntimeError:  # its loop is gone
+                    self.in_use -= 1
+                    lease.held -= 1
+
+    def _wake(self, lease: Lease, waiter: _Waiter) -> None:
+        # on the waiter's loop
+        if waiter.future.cancelled():
+            self._release(lease)
+        else:
+            waiter.future.set_result(None)
+
+    def _abandon(self, lease: Lease, waiter: _Waiter) -> None:
+        """A waiting coroutine was cancelled: withdraw its request, or give back what it got."""
+        with self._lock:
+            if not waiter.granted:
+                lease.waiters.remove(waiter)
+                if not lease.waiters:
+                    self._waiting.remove(lease)
+                return
+        if waiter.future.done() and not waiter.future.cancelled():
+            self._release(lease)  # granted and woken; otherwise `_wake` releases it
+
+    def _release(self, lease: Lease) -> None:
+        with self._lock:
+            self.in_use -= 1
+            lease.held -= 1
+            self._dispatch()
+
+    def _close(self, lease: Lease) -> None:
+        with self._lock:
+            self._leases.pop(id(lease), None)
+
+    def _next_slot(self) -> float:
+        if not self.rate:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            slot = self._next if self._next > now else now
+            self._next = slot + 1 / self.rate
+        return slot - now
+
+
+@lru_cache(maxsize=None)
+def default_scheduler() -> SocketScheduler:
+    """The scheduler shared by every scan of this process."""
+    return SocketScheduler()
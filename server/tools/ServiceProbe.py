@@ -0,0 +1,331 @@
+# tools/ServiceProbe.py
+import asyncio
+import json
+import os
+import re
+import ssl
+import threading
+from functools import lru_cache
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import (AsyncIterable, AsyncIterator, Iterable, Iterator, List, NamedTuple,
+                    Optional, Pattern, Set, Tuple)
+
+from tools.Metrics import Counter
+from tools.PatternMatcher import MultiPatternMatcher
+from tools.ResultStore import Finding
+from tools.Scheduler import Lease, SocketScheduler, default_scheduler
+
+# signature database (see service_signatures.json for the format)
+SIGNATURES_FILE = os.environ.get(
+    "SERVICE_SIGNATURES",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "service_signatures.json"),
+)
+
+# open ports probed at once by one scan
+PROBE_CONCURRENCY = int(os.environ.get("SERVICE_PROBE_CONCURRENCY", 50))
+# open ports waiting for a probe before the scan feeding them is held back
+PROBE_BACKLOG = 10_000
+# how long a service gets to speak first (SSH, SMTP, FTP...) before it is probed
+GREETING_TIMEOUT = float(os.environ.get("SERVICE_GREETING_TIMEOUT", 2.0))
+# connect, TLS handshake and reply timeout of each probe
+PROBE_TIMEOUT = float(os.environ.get("SERVICE_PROBE_TIMEOUT", 3.0))
+# bytes of reply kept as the banner
+MAX_BANNER = 1024
+
+PROBES = Counter("service_probes_total", "Service probes sent to open ports, by probe and outcome.",
+                 ("probe", "outcome"))
+
+# end-of-stream marker passed through the result queue
+_DONE = object()
+
+_HTTP_HEAD = "HEAD / HTTP/1.0\r\nHost: {}\r\nUser-Agent: target-recon\r\nAccept: */*\r\n\r\n"
+# first bytes of a TLS alert record: a TLS service answering plain text
+_TLS_ALERT = b"\x15\x03"
+
+
+class Signature(NamedTuple):
+    service: str
+    pattern: Pattern
+    version: Optional[str]    # template, $1... are the pattern's groups
+    os: Optional[str]
+
+
+class SignatureDB:
+    """
+    Service signatures loaded from a JSON file: regexes over a service's
+    reply, each naming the service and optionally a version template and
+    OS, plus the ports that are probed as HTTP or TLS first. Patterns are
+    merged into one MultiPatternMatcher, so a reply is checked against the
+    whole database in one pass; the first signature in file order wins.
+    """
+
+    def __init__(self, path: str = SIGNATURES_FILE):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        self.signatures: List[Signature] = []
+        for entry in data.get("services", []):
+            flags = 0
+            for flag in entry.get("flags", ""):
+                flags |= {"i": re.I, "s": re.S, "m": re.M}[flag]
+            version = entry.get("version")
+            self.signatures.append(Signature(
+                service=entry["service"],
+                pattern=re.compile(entry["pattern"], flags),
+                version=re.sub(r"\$(\d)", r"\\g<\1>", version) if version else None,
+                os=entry.get("os"),
+            ))
+        self.os_hints = [(re.compile(hint["pattern"], re.I), hint["os"]) for hint in data.get("os", [])]
+        probes = data.get("probes", {})
+        self.http_ports: Set[int] = set(probes.get("http", []))
+        self.tls_ports: Set[int] = set(probes.get("tls", []))
+        self._matcher = MultiPatternMatcher([s.pattern for s in self.signatures])
+
+    def identify(self, text: str) -> Optional[Tuple[str, Optional[str], Optional[str]]]:
+        """(service, version, os) of the first signature matching `text`, or None."""
+        for idx in sorted(self._matcher.candidates(text)):
+            signature = self.signatures[idx]
+            m = signature.pattern.search(text)
+            if m is None:
+                continue
+            version = None
+            if signature.version:
+                version = " ".join(m.expand(signature.version).split()) or None
+            return signature.service, version, signature.os or self.guess_os(text)
+        return None
+
+    def guess_os(self, text: str) -> Optional[str]:
+        for pattern, name in self.os_hints:
+            if pattern.search(text):
+                return name
+        return None
+
+
+@lru_cache(maxsize=None)
+def default_signatures() -> SignatureDB:
+    """The database in SIGNATURES_FILE, loaded on first use."""
+    return SignatureDB()
+
+
+class ServiceProber:
+    """
+    Fingerprinting stage for open TCP ports, run apart from the port sweep.
+    Each port gets its own connection: a service that speaks first (SSH,
+    SMTP, FTP...) is given a moment to do so, the rest are sent an HTTP
+    HEAD, and ports that look like TLS are retried (or first tried) through
+    a TLS handshake. The reply is matched against the signature database
+    for service, version and OS.
+
+    Probe connections count against the scheduler's socket budget, under
+    a lease of their own for each scan, so that the scheduler shares the
+    budget out between the scans being fingerprinted too.
+    """
+
+    def __init__(self, signatures: Optional[SignatureDB] = None,
+                 concurrency: int = PROBE_CONCURRENCY,
+                 greeting_timeout: float = GREETING_TIMEOUT,
+                 timeout: float = PROBE_TIMEOUT,
+                 scheduler: Optional[SocketScheduler] = None):
+        self._signatures = signatures
+        self.scheduler = scheduler or default_scheduler()
+        self.concurrency = concurrency
+        self.greeting_timeout = greeting_timeout
+        self.timeout = timeout
+        self._tls: Optional[ssl.SSLContext] = None
+        # event loop of the probes of thread-engine scans, started on first use
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_lock = threading.Lock()
+
+    @property
+    def signatures(self) -> SignatureDB:
+        return self._signatures or default_signatures()
+
+    @property
+    def tls(self) -> ssl.SSLContext:
+        # built on first use: loading the CA store takes a while, and none is needed
+        if self._tls is None:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            # fingerprinting only: any certificate will do
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+            self._tls = context
+        return self._tls
+
+    @staticmethod
+    def wanted(res: Finding) -> bool:
+        # callers only pass findings of TCP scans through the probe stage
+        return res.status == "open"
+
+    async def identify(self, res: Finding, lease: Optional[Lease] = None) -> Finding:
+        """`res` with the service, version, OS and banner its probes found."""
+        if lease is None:
+            lease = self.scheduler.lease("service probe")
+            try:
+                return await self.identify(res, lease)
+            finally:
+                lease.close()
+        text, tls = await self._probe(res.ip, res.port, lease)
+        if not text:
+            return res
+        update = {"banner": text, "os_info": self.signatures.guess_os(text) or "Unknown"}
+        match = self.signatures.identify(text)
+        if match is not None:
+            service, version, os_info = match
+            update["service"] = "https" if tls and service == "http" else service
+            update["version"] = version
+            update["os_info"] = os_info or "Unknown"
+        return res._replace(**update)
+
+    async def _probe(self, ip: str, port: int, lease: Lease) -> Tuple[str, bool]:
+        """(reply text, whether it came over TLS); empty if nothing answered."""
+        order = (True, False) if port in self.signatures.tls_ports else (False, True)
+        for tls in order:
+            data = await self._session(ip, port, tls, port not in self.signatures.http_ports, lease)
+            if data is None:
+                break  # connected but kept silent: the other probe would not do better
+            if data and not data.startswith(_TLS_ALERT):
+                return data.decode(errors="ignore").strip(), tls
+        return "", False
+
+    async def _session(self, ip: str, port: int, tls: bool, greet: bool, lease: Lease) -> Optional[bytes]:
+        """
+        One connection: wait for a greeting (if `greet`), else send HEAD.
+        Returns the reply, empty if the connection failed or was closed, or
+        None if the service never answered.
+        """
+        probe = "tls" if tls else "greeting" if greet else "http"
+        async with lease.slot_async():
+            try:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(ip, port, ssl=self.tls if tls else None), self.timeout)
+            except (OSError, asyncio.TimeoutError):
+                PROBES.labels(probe, "failed").inc()
+                return b""
+            try:
+                data = b""
+                if greet:
+                    try:
+                        data = await asyncio.wait_for(reader.read(MAX_BANNER), self.greeting_timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                if not data:
+                    if probe == "greeting":
+                        probe = "http"
+                    writer.write(_HTTP_HEAD.format(ip).encode())
+                    data = await asyncio.wait_for(self._read_reply(reader), self.timeout)
+                PROBES.labels(probe, "answered" if data else "closed").inc()
+                return data
+            except asyncio.TimeoutError:
+                PROBES.labels(probe, "silent").inc()
+                return None
+            except OSError:
+                PROBES.labels(probe, "failed").inc()
+                return b""
+            finally:
+                writer.close()
+
+    @staticmethod
+    async def _read_reply(reader: asyncio.StreamReader) -> bytes:
+        # the status line and headers are what the signatures look at
+        data = b""
+        while len(data) < MAX_BANNER and b"\r\n\r\n" not in data:
+            chunk = await reader.read(MAX_BANNER - len(data))
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    async def enrich(self, results: AsyncIterable[Finding]) -> AsyncIterator[Finding]:
+        """
+        Pass `results` through, fingerprinting open TCP ports on the way.
+        Other results come out right away; open ports are probed in the
+        background, at most `concurrency` at once, and come out once
+        identified, so the sweep feeding `results` never waits on a slow
+        service (only on a backlog of PROBE_BACKLOG unprobed ports).
+        """
+        out: asyncio.Queue = asyncio.Queue()
+        active = asyncio.Semaphore(self.concurrency)
+        backlog = asyncio.Semaphore(PROBE_BACKLOG)
+        probes: Set[asyncio.Future] = set()
+        lease = self.scheduler.lease("service probe")
+
+        async def probe(res: Finding):
+            try:
+                async with active:
+                    res = await self.identify(res, lease)
+                await out.put(res)
+            finally:
+                backlog.release()
+
+        async def feed():
+            try:
+                async for res in results:
+                    if not self.wanted(res):
+                        await out.put(res)
+                        continue
+                    await backlog.acquire()
+                    task = asyncio.ensure_future(probe(res))
+                    probes.add(task)
+                    task.add_done_callback(probes.discard)
+                await asyncio.gather(*probes)
+            except Exception as e:
+                await out.put(e)
+            else:
+                await out.put(_DONE)
+
+        feeder = asyncio.ensure_future(feed())
+        try:
+            while True:
+                item = await out.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            feeder.cancel()
+            for task in list(probes):
+                task.cancel()
+            lease.close()
+
+    def _event_loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="service-probe", daemon=True).start()
+            return self._loop
+
+    def enrich_sync(self, results: Iterable[Finding]) -> Iterator[Finding]:
+        """
+        `enrich` for a plain iterator (thread engine): probes run on one
+        event loop thread, shared by every thread-engine scan of this prober.
+        """
+        loop = self._event_loop()
+        active = asyncio.Semaphore(self.concurrency)
+        lease = self.scheduler.lease("service probe")
+
+        async def probe(res: Finding) -> Finding:
+            async with active:
+                return await self.identify(res, lease)
+
+        pending: Set[Future] = set()
+        try:
+            for res in results:
+                if not self.wanted(res):
+                    yield res
+                    continue
+                pending.add(asyncio.run_coroutine_threadsafe(probe(res), loop))
+                if len(pending) >= PROBE_BACKLOG:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                else:
+                    done = {f for f in pending if f.done()}
+                    pending -= done
+                for future in done:
+                    yield future.result()
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+            lease.close()
@@ -0,0 +1,61 @@
+# tools/ServiceTable.py
+import socket
+from typing import Dict, List, Optional, Tuple
+
+SERVICES_FILE = "/etc/services"
+
+
+class ServiceTable:
+    """
+    port -> service name table for tcp and udp, built once from the services
+    database instead of calling socket.getservbyport for every finding.
+    Falls back to (memoized) getservbyport when the file is not available.
+    """
+
+    def __init__(self, path: str = SERVICES_FILE):
+        self._tables: Dict[str, List[Optional[str]]] = {
+            "tcp": [None] * 65536,
+            "udp": [None] * 65536,
+        }
+        self._fallback: Optional[Dict[Tuple[int, str], str]] = None
+        try:
+            self._load(path)
+        except OSError:
+            self._fallback = {}
+
+    def _load(self, path: str) -> None:
+        with open(path, encoding="utf-8", errors="ignore") as f:
+            for line in f:
+                fields = line.split("#", 1)[0].split()
+                if len(fields) < 2 or "/" not in fields[1]:
+                    continue
+                port, _, proto = fields[1].partition("/")
+                table = self._tables.get(proto)
+                if table is None or not port.isdigit() or int(port) > 65535:
+                    continue
+                # first entry wins, like getservbyport
+                if table[int(port)] is None:
+                    table[int(port)] = fields[0]
+
+    def lookup(self, port: int, protocol: str = "tcp") -> str:
+        if self._fallback is not None:
+            key = (port, protocol)
+            name = self._fallback.get(key)
+            if name is None:
+                try:
+                    name = socket.getservbyport(port, protocol)
+                except OSError:
+                    name = "unknown"
+                self._fallback[key] = name
+            return name
+        table = self._tables.get(protocol)
+        if table is None or not 0 <= port <= 65535:
+            return "unknown"
+        return table[port] or "unknown"
+
+    def is_named(self, port: int, protocol: str = "tcp") -> bool:
+        """True if the services database has a name for `port`."""
+        return self.lookup(port, protocol) != "unknown"
+
+
+SERVICES = ServiceTable()
@@ -1,6 +1,22 @@
 # tools/SubdomainScanner.py
+import asyncio
+import os
+import secrets
+from typing import AsyncIterator, Iterable, Iterator, List, Optional, Set
+
+import dns.exception
 import dns.resolver
-from typing import List
+
+from tools.Metrics import timed
+from tools.Resolver import QUERIES, SharedResolver, query_outcome
+from tools.utils import normalize_domain
+
+# external wordlists are looked up by file name in this directory; the
+# default one ships "common.txt" (about 470 common prefixes)
+WORDLIST_DIR = os.environ.get(
+    "SUBDOMAIN_WORDLIST_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "wordlists"),
+)
 
 
 class SubdomainTool:
@@ -16,23 +32,123 @@ class SubdomainTool:
         "studio"
     ]
 
-    def scan(self, domain: str) -> List[str]:
-        # normalize input
-        domain = domain.strip().lower()
-        if domain.startswith(("http://", "https://")):
-            domain = domain.split("://", 1)[1].split("/", 1)[0]
+    # random labels resolved up front to detect wildcard DNS
+    WILDCARD_PROBES = 3
+
+    def __init__(self, concurrency: int = 100, retries: int = 2,
+                 backoff: float = 0.25, lifetime: float = 3.0,
+                 resolver: Optional[SharedResolver] = None):
+        """
+        `concurrency` is the number of lookups kept in flight. A lookup that
+        times out (or finds no usable nameserver) is retried up to `retries`
+        times, sleeping `backoff`, 2*`backoff`, ... between attempts.
+        """
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.lifetime = lifetime
+        self.resolver = resolver or SharedResolver()
 
-        found: List[str] = []
-        for prefix in self.COMMON_SUBDOMAINS:
-            fqdn = f"{prefix}.{domain}"
+    @staticmethod
+    def _wordlist_path(name: str) -> str:
+        base = os.path.realpath(WORDLIST_DIR)
+        path = os.path.realpath(os.path.join(base, name))
+        if os.path.dirname(path) != base or not os.path.isfile(path):
+            raise ValueError(f"Wordlist not found: {name}")
+        return path
+
+    @staticmethod
+    def _read_wordlist(path: str) -> Iterator[str]:
+        """Stream prefixes from disk, one per line, skipping blanks and comments."""
+        with open(path, encoding="utf-8", errors="ignore") as f:
+            for line in f:
+                prefix = line.strip().lower()
+                if prefix and not prefix.startswith("#"):
+                    yield prefix
+
+    async def _resolve_a(self, fqdn: str) -> Set[str]:
+        """A records of `fqdn` (empty if it does not exist), retrying timeouts with backoff."""
+        for attempt in range(self.retries + 1):
             try:
-                # only checking A records here
-                dns.resolver.resolve(fqdn, "A")
-                found.append(fqdn)
-            except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer, dns.resolver.NoNameservers):
-                continue
-            except Exception:
-                # timeouts, etc.
-                continue
-
-        return found
+                answers = await self.resolver.aio.resolve(fqdn, "A", lifetime=self.lifetime)
+                QUERIES.labels("subdomains", "A", "ok").inc()
+                return {rdata.to_text() for rdata in answers}
+            except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer) as e:
+                QUERIES.labels("subdomains", "A", query_outcome(e)).inc()
+                return set()
+            except (dns.exception.Timeout, dns.resolver.NoNameservers) as e:
+                QUERIES.labels("subdomains", "A", query_outcome(e)).inc()
+                if attempt == self.retries:
+                    return set()
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+            except Exception as e:
+                QUERIES.labels("subdomains", "A", query_outcome(e)).inc()
+                return set()
+        return set()
+
+    async def detect_wildcard(self, domain: str) -> Set[str]:
+        """
+        Resolve a few random labels under `domain`; any address they return
+        belongs to a wildcard record. Empty set means no wildcard.
+        """
+        domain = normalize_domain(domain)
+        probes = [f"{secrets.token_hex(8)}.{domain}" for _ in range(self.WILDCARD_PROBES)]
+        wildcard: Set[str] = set()
+        for addrs in await asyncio.gather(*(self._resolve_a(p) for p in probes)):
+            wildcard |= addrs
+        return wildcard
+
+    async def iter_scan(self, domain: str, wordlist: Optional[str] = None,
+                        wildcard: Optional[Set[str]] = None) -> AsyncIterator[str]:
+        """
+        Yield each `<prefix>.<domain>` that resolves to an A record, as soon
+        as it is found. Prefixes come from the `wordlist` file (streamed, so
+        its size does not matter) or from COMMON_SUBDOMAINS.
+
+        Wildcard DNS is detected once before the sweep (unless `wildcard`
+        is passed in); names whose addresses all belong to the wildcard are
+        dropped without any extra query.
+        """
+        domain = normalize_domain(domain)
+        prefixes: Iterable[str] = (self._read_wordlist(self._wordlist_path(wordlist))
+                                   if wordlist else self.COMMON_SUBDOMAINS)
+        if wildcard is None:
+            wildcard = await self.detect_wildcard(domain)
+
+        names = iter(prefixes)
+        found: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency)
+
+        async def worker():
+            # names is shared; next() never yields to the loop, so no locking needed
+            for prefix in names:
+                fqdn = f"{prefix}.{domain}"
+                addrs = await self._resolve_a(fqdn)
+                if addrs and not addrs <= wildcard:
+                    await found.put(fqdn)
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(self.concurrency)]
+        done = asyncio.ensure_future(asyncio.gather(*workers))
+        try:
+            while True:
+                getter = asyncio.ensure_future(found.get())
+                await asyncio.wait((getter, done), return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    yield getter.result()
+                    continue
+                getter.cancel()
+                done.result()  # re-raise worker failures
+                while not found.empty():
+                    yield found.get_nowait()
+                return
+        finally:
+            for task in workers:
+                task.cancel()
+            done.cancel()
+
+    @timed("subdomains", "scan")
+    async def ascan(self, domain: str, wordlist: Optional[str] = None,
+                    wildcard: Optional[Set[str]] = None) -> List[str]:
+        return [fqdn async for fqdn in self.iter_scan(domain, wordlist, wildcard)]
+
+    def scan(self, domain: str, wordlist: Optional[str] = None) -> List[str]:
+        return asyncio.run(self.ascan(domain, wordlist))
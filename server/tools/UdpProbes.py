@@ -0,0 +1,56 @@
+# tools/UdpProbes.py
+import struct
+from typing import Dict
+
+
+def _dns_query(name: str, qtype: int, qclass: int = 1, txid: int = 0x5243) -> bytes:
+    """A one-question DNS query with recursion desired."""
+    labels = b"".join(bytes([len(part)]) + part.encode() for part in name.split(".") if part)
+    return struct.pack(">HHHHHH", txid, 0x0100, 1, 0, 0, 0) + labels + b"\x00" + struct.pack(">HH", qtype, qclass)
+
+
+def _ber(tag: int, content: bytes) -> bytes:
+    # every length used here fits the short form
+    return bytes([tag, len(content)]) + content
+
+
+def _snmp_get(community: bytes, oid: bytes) -> bytes:
+    """SNMPv1 GetRequest for one (already encoded) OID."""
+    varbind = _ber(0x30, _ber(0x06, oid) + b"\x05\x00")
+    pdu = _ber(0xA0, _ber(0x02, b"\x52\x43") + _ber(0x02, b"\x00") + _ber(0x02, b"\x00")
+               + _ber(0x30, varbind))
+    return _ber(0x30, _ber(0x02, b"\x00") + _ber(0x04, community) + pdu)
+
+
+# A probe each service answers even from an unknown client, so that an
+# open port is told apart from a silent (filtered) one. Ports not listed
+# get an empty datagram.
+PAYLOADS: Dict[int, bytes] = {
+    # DNS: NS of the root zone
+    53: _dns_query("", 2),
+    # TFTP: read request; a missing file still gets an error packet back
+    69: b"\x00\x01recon.txt\x00octet\x00",
+    # ONC RPC portmapper: NULL call
+    111: struct.pack(">IIIIIIIIII", 0x52430001, 0, 2, 100000, 2, 0, 0, 0, 0, 0),
+    # NTP: version 3 client request
+    123: b"\x1b" + b"\x00" * 47,
+    # NetBIOS name service: node status request for "*"
+    137: struct.pack(">HHHHHH", 0x5243, 0, 1, 0, 0, 0) + b"\x20CK" + b"A" * 30 + b"\x00\x00\x21\x00\x01",
+    # SNMP: sysDescr.0 with the "public" community
+    161: _snmp_get(b"public", b"\x2b\x06\x01\x02\x01\x01\x01\x00"),
+    # SQL Server browser: instance list
+    1434: b"\x02",
+    # SSDP: search for every device and service
+    1900: (b"M-SEARCH * HTTP/1.1\r\nHOST: 239.255.255.250:1900\r\n"
+           b"MAN: \"ssdp:discover\"\r\nMX: 1\r\nST: ssdp:all\r\n\r\n"),
+    # STUN: binding request
+    3478: struct.pack(">HHI", 0x0001, 0, 0x2112A442) + b"recon-probe!",
+    # mDNS: service enumeration, asking for a unicast answer
+    5353: _dns_query("_services._dns-sd._udp.local", 12, qclass=0x8001, txid=0),
+    # memcached: UDP frame header + "version"
+    11211: b"\x00\x00\x00\x00\x00\x01\x00\x00version\r\n",
+}
+
+
+def payload(port: int) -> bytes:
+    return PAYLOADS.get(port, b"")
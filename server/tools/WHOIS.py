@@ -1,22 +1,129 @@
 # tools/Whois.py
+import os
+import socket
+import threading
 import whois
-from typing import Any, Dict
+from whois.parser import WhoisEntry
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
 
 from models import WhoisRecord
+from tools.Metrics import Counter, Histogram, timed
+from tools.WhoisCache import RegistryRateLimiter, WhoisCache
+from tools.utils import normalize_domain, unique_domains
+
+# minimum spacing between two queries to the same registry, in seconds
+REGISTRY_INTERVAL = float(os.environ.get("WHOIS_REGISTRY_INTERVAL", 2.0))
+# "host:port" of a WHOIS server to send every query to (a mirror or a local
+# stand-in) instead of the registry's own server; empty means the registries
+WHOIS_SERVER = os.environ.get("WHOIS_SERVER") or None
+
+# "hit" (cache), "shared" (joined an in-flight query) or "query"
+LOOKUPS = Counter("whois_lookups_total", "WHOIS lookups, by how they were answered.", ("source",))
+QUERY_SECONDS = Histogram("whois_query_seconds", "Time spent querying WHOIS servers, by registry.",
+                          ("registry",))
 
 
 class WhoisTool:
+    def __init__(self, cache: Optional[WhoisCache] = None,
+                 registry_interval: float = REGISTRY_INTERVAL,
+                 server: Optional[str] = WHOIS_SERVER):
+        self.cache = cache or WhoisCache()
+        self.server = server
+        self.limiter = RegistryRateLimiter(registry_interval)
+        self._inflight_lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+
+    @staticmethod
+    def registry_for(domain: str) -> str:
+        """The WHOIS server is picked by TLD, so the TLD identifies the registry."""
+        return domain.rsplit(".", 1)[-1]
+
+    @timed("whois", "lookup")
     def lookup(self, domain: str) -> WhoisRecord:
         """
         Perform a WHOIS lookup and return every available field.
+        Answers come from the local cache while fresh; otherwise one query
+        per domain goes out (concurrent callers share it), paced per registry.
         Raises ValueError on failure.
         """
-        domain = domain.lower().strip()
-        if domain.startswith(("http://", "https://")):
-            domain = domain.split("://", 1)[1].split("/", 1)[0]
+        domain = normalize_domain(domain)
+        cached = self.cache.get(domain)
+        if cached is not None:
+            LOOKUPS.labels("hit").inc()
+            return cached
+
+        with self._inflight_lock:
+            pending = self._inflight.get(domain)
+            leader = pending is None
+            if leader:
+                pending = self._inflight[domain] = Future()
+        if not leader:
+            LOOKUPS.labels("shared").inc()
+            return pending.result()
+        LOOKUPS.labels("query").inc()
+
+        try:
+            record = self._query(domain)
+            self.cache.put(domain, record)
+            pending.set_result(record)
+            return record
+        except Exception as e:
+            pending.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[domain]
+
+    def lookup_many(self, domains: Iterable[str], max_workers: int = 8
+                    ) -> Iterator[Tuple[str, Optional[WhoisRecord], Optional[str]]]:
+        """
+        Look up every distinct normalized domain on a bounded thread pool,
+        yielding (domain, record, error) as each one finishes.
+        """
+        def run(domain: str):
+            try:
+                return domain, self.lookup(domain), None
+            except ValueError as e:
+                return domain, None, str(e)
+            except Exception:
+                return domain, None, "Internal WHOIS error"
+
+        pool = ThreadPoolExecutor(max_workers=max_workers)
+        pending = set()
+        try:
+            for domain in unique_domains(domains):
+                pending.add(pool.submit(run, domain))
+                if len(pending) >= max_workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _ask_server(self, domain: str) -> WhoisEntry:
+        """Query the configured `server` directly and parse its answer like whois.whois does."""
+        host, _, port = self.server.rpartition(":")
+        chunks = []
+        with socket.create_connection((host, int(port)), timeout=10) as sock:
+            sock.sendall(domain.encode("idna") + b"\r\n")
+            while True:
+                data = sock.recv(4096)
+                if not data:
+                    break
+                chunks.append(data)
+        return WhoisEntry.load(domain, b"".join(chunks).decode("utf-8", errors="replace"))
 
+    def _query(self, domain: str) -> WhoisRecord:
+        registry = self.registry_for(domain)
+        self.limiter.wait(registry)
         try:
-            raw = whois.whois(domain)
+            with QUERY_SECONDS.labels(registry).time():
+                raw = self._ask_server(domain) if self.server else whois.whois(domain)
         except Exception as e:
             raise ValueError(f"WHOIS lookup failed: {e}")
 
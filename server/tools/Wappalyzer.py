@@ -1,10 +1,140 @@
+import codecs
+import glob
+import json
+import os
 import re
 import requests
-from bs4 import BeautifulSoup
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from requests.adapters import HTTPAdapter
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from tools.Metrics import Counter, Histogram, timed
+from tools.PatternMatcher import AtomTable, LazyPattern, MultiPatternMatcher, required_atoms
+from tools.RuleCache import cache_key, cached_object, file_stamp
+
+# extra rules in upstream Wappalyzer format: a technologies.json file or a
+# directory of per-letter *.json files (optionally with categories.json)
+RULES_PATH = os.environ.get("WAPPALYZER_RULES")
+
+# stop reading a response body after this many bytes
+MAX_BODY_BYTES = int(os.environ.get("WAPPALYZER_MAX_BYTES", 2 * 1024 * 1024))
+CHUNK_SIZE = 64 * 1024
+# characters of the previous chunk re-scanned with the next one, so a match
+# cut by a chunk boundary is still found if it is shorter than this
+CHUNK_OVERLAP = 4096
+
+# connections kept per origin, and how many origins keep a pool
+MAX_CONNECTIONS_PER_HOST = int(os.environ.get("WAPPALYZER_CONNECTIONS_PER_HOST", 4))
+MAX_POOLED_HOSTS = 256
+
+# per analyzed page: "fetch" (network), "parse" (decoding, script extraction), "match" (rules)
+PHASE_SECONDS = Histogram("wappalyzer_phase_seconds", "Time per page spent in each analysis phase.",
+                          ("phase",))
+RULE_SECONDS = Counter("wappalyzer_rule_seconds_total", "Time spent evaluating each technology's patterns.",
+                       ("technology",))
+RULE_EVALUATIONS = Counter("wappalyzer_rule_evaluations_total",
+                           "Pages on which a technology's patterns had to be evaluated.", ("technology",))
+
+# html patterns of tags that only belong in <head>, and where it ends: those
+# patterns are not looked for past it
+_HEAD_TAG = re.compile(r"\^?<(?:meta|title|base)\b", re.I)
+_HEAD_END = re.compile(r"</head\s*>|<body[\s>]", re.I)
+
+# <script ... src=...> without building a DOM
+_SCRIPT_SRC = re.compile(
+    r"""<script\b[^>]*?\bsrc\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))""", re.I)
+
+
+def script_sources(html: str) -> List[str]:
+    return [next(g for g in m.groups() if g is not None) for m in _SCRIPT_SRC.finditer(html)]
+
+
+def _as_list(value) -> List[str]:
+    if value is None:
+        return []
+    return [value] if isinstance(value, str) else list(value)
+
+
+def _compile_upstream(pattern: str) -> LazyPattern:
+    # upstream appends tags such as "\;version:\1" and matches case-insensitively
+    return LazyPattern(pattern.split("\\;", 1)[0], re.I)
+
+
+def _rule_files(path: str) -> Tuple[List[str], Optional[str]]:
+    """(technology files, categories file) of a rules path."""
+    if os.path.isdir(path):
+        files = sorted(f for f in glob.glob(os.path.join(path, "*.json"))
+                       if os.path.basename(f) != "categories.json")
+        return files, os.path.join(path, "categories.json")
+    return [path], None
+
+
+def load_technologies(path: str) -> List[Dict]:
+    """
+    Convert upstream Wappalyzer technology definitions into rules.
+    Only the `html`, `scriptSrc` and `headers` matchers are used. Patterns
+    are compiled on first use; those Python's `re` can't compile never match.
+    """
+    files, categories_file = _rule_files(path)
+
+    technologies: Dict[str, Dict] = {}
+    categories: Dict[str, Dict] = {}
+    for file in files:
+        with open(file, encoding="utf-8") as f:
+            data = json.load(f)
+        if "technologies" in data:
+            technologies.update(data["technologies"])
+            categories.update(data.get("categories", {}))
+        else:
+            technologies.update(data)
+    if categories_file and os.path.isfile(categories_file):
+        with open(categories_file, encoding="utf-8") as f:
+            categories.update(json.load(f))
+
+    rules = []
+    for name, tech in technologies.items():
+        cats = tech.get("cats") or []
+        category = categories.get(str(cats[0]), {}).get("name", "Unknown") if cats else "Unknown"
+        html = [_compile_upstream(p) for p in _as_list(tech.get("html"))]
+        script = [_compile_upstream(p) for p in _as_list(tech.get("scriptSrc"))]
+        headers = []
+        for header, pattern in (tech.get("headers") or {}).items():
+            # an empty pattern only asks for the header to be present
+            headers.append((header.lower(), _compile_upstream(pattern or r".+")))
+        if html or script or headers:
+            rules.append({"name": name, "category": category,
+                          "html": html, "script": script, "headers": headers})
+    return rules
 
 
 class Wappalyzer:
-    def __init__(self):
+    HEADERS = {
+        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
+        'Accept-Language': 'en-US,en;q=0.5',
+        'Accept-Encoding': 'gzip, deflate, br',
+        'Connection': 'keep-alive',
+        'Upgrade-Insecure-Requests': '1',
+        'Sec-Fetch-Dest': 'document',
+        'Sec-Fetch-Mode': 'navigate',
+        'Sec-Fetch-Site': 'none',
+        'Sec-Fetch-User': '?1',
+        'DNT': '1'
+    }
+
+    def __init__(self, rules_path: Optional[str] = RULES_PATH,
+                 max_bytes: int = MAX_BODY_BYTES,
+                 connections_per_host: int = MAX_CONNECTIONS_PER_HOST):
+        self.max_bytes = max_bytes
+        # one keep-alive pool per origin; pool_block makes extra requests to
+        # the same host wait for a free connection instead of opening more
+        self.session = requests.Session()
+        self.session.headers.update(self.HEADERS)
+        adapter = HTTPAdapter(pool_connections=MAX_POOLED_HOSTS,
+                              pool_maxsize=connections_per_host, pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
         self.rules = [
             # — Front-end Frameworks —
             {
@@ -157,65 +287,229 @@ class Wappalyzer:
                 "headers": [("x-amzn-requestid", re.compile(r".+"))]
             },
         ]
+        # atoms of the upstream patterns, kept with them in the rule cache
+        self._atoms: AtomTable = {}
+        if rules_path:
+            rules, self._atoms = self._load_rules(rules_path)
+            self.rules.extend(rules)
+        self._compile()
+
+    @staticmethod
+    def _load_rules(path: str) -> Tuple[List[Dict], AtomTable]:
+        """
+        Upstream rules and the prefilter atoms of their patterns. Both come
+        from the rule cache unless a rules file changed since they were
+        cached, so restarts skip the JSON parsing and the regex analysis.
+        """
+        files, categories_file = _rule_files(path)
+        key = cache_key(*map(file_stamp, files + ([categories_file] if categories_file else [])))
+
+        def build() -> Tuple[List[Dict], AtomTable]:
+            rules = load_technologies(path)
+            atoms = {(rx.pattern, rx.flags): required_atoms(rx)
+                     for rule in rules for rx in rule["html"] + rule["script"]}
+            return rules, atoms
+        return cached_object("wappalyzer", path, key, build)
+
+    def warm(self) -> None:
+        """Compile the prefilters now instead of on the first analyzed page."""
+        self._html_matcher.warm()
+        self._script_matcher.warm()
 
+    def _compile(self) -> None:
+        """Merge the html and script patterns of every rule into one matcher each."""
+        self._html_owner: List[int] = []
+        self._script_owner: List[int] = []
+        html, script = [], []
+        for idx, rule in enumerate(self.rules):
+            html.extend(rule["html"])
+            self._html_owner.extend([idx] * len(rule["html"]))
+            script.extend(rule["script"])
+            self._script_owner.extend([idx] * len(rule["script"]))
+        self._html_matcher = MultiPatternMatcher(html, self._atoms)
+        self._script_matcher = MultiPatternMatcher(script, self._atoms)
+        self._body_rules = {idx for idx, rule in enumerate(self.rules) if rule["html"] or rule["script"]}
+        self._head_only = {i for i, rx in enumerate(html) if _HEAD_TAG.match(rx.pattern)}
+        # rules that can still match once the head is over
+        self._after_head = {idx for idx, rule in enumerate(self.rules) if rule["script"]}
+        self._after_head.update(owner for i, owner in enumerate(self._html_owner) if i not in self._head_only)
+
+    def _match_headers(self, headers, costs: Dict[int, float]) -> Set[int]:
+        found = set()
+        for idx, rule in enumerate(self.rules):
+            if not rule["headers"]:
+                continue
+            started = time.perf_counter()
+            for header_name, rx in rule["headers"]:
+                if rx.search(headers.get(header_name, "")):
+                    found.add(idx)
+                    break
+            costs[idx] = costs.get(idx, 0.0) + time.perf_counter() - started
+        return found
+
+    def _match_text(self, html: str, script_srcs: List[str], pending: Set[int],
+                    costs: Dict[int, float], head: bool = True) -> Set[int]:
+        """
+        Rules among `pending` matched by `html` or by one of `script_srcs`;
+        time spent per rule goes to `costs`. Without `head`, patterns of
+        head-only tags are left out.
+        """
+        html_among = {i for i, owner in enumerate(self._html_owner)
+                      if owner in pending and (head or i not in self._head_only)}
+        script_among = {i for i, owner in enumerate(self._script_owner) if owner in pending}
+        html_costs: Dict[int, float] = {}
+        script_costs: Dict[int, float] = {}
+        found = {self._html_owner[i] for i in self._html_matcher.search(html, html_among, html_costs)}
+        found.update(self._script_owner[i]
+                     for i in self._script_matcher.search_any(script_srcs, script_among, script_costs))
+        for owners, pattern_costs in ((self._html_owner, html_costs), (self._script_owner, script_costs)):
+            for i, seconds in pattern_costs.items():
+                costs[owners[i]] = costs.get(owners[i], 0.0) + seconds
+        return found
+
+    def _record(self, costs: Dict[int, float], parse: float, match: float) -> None:
+        PHASE_SECONDS.labels("parse").observe(parse)
+        PHASE_SECONDS.labels("match").observe(match)
+        for idx, seconds in costs.items():
+            name = self.rules[idx]["name"]
+            RULE_SECONDS.labels(name).inc(seconds)
+            RULE_EVALUATIONS.labels(name).inc()
+
+    def _report(self, found: Set[int]) -> List[Dict[str, str]]:
+        return [{"name": rule["name"], "category": rule["category"]}
+                for idx, rule in enumerate(self.rules) if idx in found]
+
+    def match(self, html: str, script_srcs: List[str], headers) -> List[Dict[str, str]]:
+        """
+        Technologies whose rules match the page: any HTML pattern in the
+        body, any script pattern in a <script src>, or any header pattern.
+        The body and the script URLs are each scanned once for all rules.
+        """
+        started = time.perf_counter()
+        costs: Dict[int, float] = {}
+        found = self._match_headers(headers, costs)
+        found |= self._match_text(html, script_srcs, self._body_rules - found, costs)
+        self._record(costs, 0.0, time.perf_counter() - started)
+        return self._report(found)
+
+    def match_stream(self, chunks: Iterable[bytes], encoding: Optional[str], headers) -> List[Dict[str, str]]:
+        """
+        Like `match`, for a body arriving in chunks. Header rules are decided
+        first; body rules are then checked chunk by chunk (with a small
+        overlap). Once the page's <head> is over, rules whose only patterns
+        are head tags (<meta>, <title>, <base>) are dropped. Reading stops at
+        `max_bytes`, or as soon as no rule is left that could still match;
+        with rules for scripts and markup anywhere in the page, that usually
+        means the whole body up to `max_bytes` is read.
+        """
+        started = time.perf_counter()
+        costs: Dict[int, float] = {}
+        found = self._match_headers(headers, costs)
+        pending = self._body_rules - found
+        match_time = time.perf_counter() - started
+        parse_time = 0.0
+        if not pending:
+            self._record(costs, parse_time, match_time)
+            return self._report(found)
+
+        try:
+            decoder = codecs.getincrementaldecoder(encoding or "utf-8")(errors="replace")
+        except LookupError:
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        seen_srcs: Set[str] = set()
+        tail = ""
+        read = 0
+        head = True
+        for chunk in chunks:
+            started = time.perf_counter()
+            chunk = chunk[:self.max_bytes - read]
+            read += len(chunk)
+            last = read >= self.max_bytes
+            window = tail + decoder.decode(chunk, final=last)
+            new_srcs = [src for src in script_sources(window) if src not in seen_srcs]
+            seen_srcs.update(new_srcs)
+            parsed = time.perf_counter()
+            matched = self._match_text(window, new_srcs, pending, costs, head)
+            if head and _HEAD_END.search(window):
+                head = False
+                pending &= self._after_head
+            parse_time += parsed - started
+            match_time += time.perf_counter() - parsed
+            found |= matched
+            pending -= matched
+            if not pending or last:
+                break
+            tail = window[-CHUNK_OVERLAP:]
+        self._record(costs, parse_time, match_time)
+        return self._report(found)
+
+    @timed("wappalyzer", "analyze")
     def analyze(self, url: str) -> dict:
         """
-        Fetches the given URL and applies each rule.
+        Fetches the given URL and applies each rule, streaming the body
+        (see `match_stream`) instead of downloading all of it.
         Returns a dict with 'url' and a list of detected {name, category}.
         """
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.5',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1',
-            'Sec-Fetch-Dest': 'document',
-            'Sec-Fetch-Mode': 'navigate',
-            'Sec-Fetch-Site': 'none',
-            'Sec-Fetch-User': '?1',
-            'DNT': '1'
-        }
+        fetch_time = 0.0
+
+        def timed_chunks(chunks: Iterator[bytes]) -> Iterator[bytes]:
+            # time spent waiting on the network for the next chunk
+            nonlocal fetch_time
+            while True:
+                started = time.perf_counter()
+                chunk = next(chunks, None)
+                fetch_time += time.perf_counter() - started
+                if chunk is None:
+                    return
+                yield chunk
 
+        started = time.perf_counter()
         try:
-            resp = requests.get(url, headers=headers, timeout=10)
+            resp = self.session.get(url, timeout=10, stream=True)
         except Exception as e:
             raise ValueError(f"Could not fetch URL: {e}")
+        fetch_time += time.perf_counter() - started
 
-        html = resp.text or ""
-        # gather all <script src="…">
-        soup = BeautifulSoup(html, "html.parser")
-        script_srcs = [tag["src"] for tag in soup.find_all("script", src=True)]
-
-        detected = []
-        for rule in self.rules:
-            found = False
+        # a fully read body hands its connection back to the pool; one cut
+        # short by max_bytes or an early match is closed instead
+        try:
+            technologies = self.match_stream(timed_chunks(resp.iter_content(CHUNK_SIZE)),
+                                             resp.encoding, resp.headers)
+        except requests.RequestException as e:
+            raise ValueError(f"Could not fetch URL: {e}")
+        finally:
+            resp.close()
+            PHASE_SECONDS.labels("fetch").observe(fetch_time)
+        return {"url": url, "technologies": technologies}
 
-            # 1) check HTML body
-            for rx in rule["html"]:
-                if rx.search(html):
-                    found = True
-                    break
+    def analyze_many(self, urls: Iterable[str], max_workers: int = 32) -> Iterator[dict]:
+        """
+        Analyze many URLs concurrently over the pooled session, yielding one
+        dict per distinct URL as soon as it is done. Failures are reported
+        per URL as {'url', 'error'} instead of aborting the batch.
+        """
+        def run(url: str) -> dict:
+            try:
+                return self.analyze(url)
+            except ValueError as e:
+                return {"url": url, "error": str(e)}
 
-            # 2) check <script> URLs
-            if not found:
-                for rx in rule["script"]:
-                    if any(rx.search(src) for src in script_srcs):
-                        found = True
-                        break
-
-            # 3) check headers
-            if not found:
-                for header_name, rx in rule["headers"]:
-                    val = resp.headers.get(header_name, "")
-                    if rx.search(val):
-                        found = True
-                        break
-
-            if found:
-                detected.append({
-                    "name": rule["name"],
-                    "category": rule["category"]
-                })
-
-        return {"url": url, "technologies": detected}
+        pool = ThreadPoolExecutor(max_workers=max_workers)
+        pending = set()
+        seen: Set[str] = set()
+        try:
+            for url in urls:
+                if url in seen:
+                    continue
+                seen.add(url)
+                pending.add(pool.submit(run, url))
+                if len(pending) >= max_workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
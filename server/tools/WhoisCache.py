@@ -0,0 +1,72 @@
+# tools/WhoisCache.py
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+from models import WhoisRecord
+from tools.utils import DATA_DIR
+
+DEFAULT_PATH = os.environ.get("WHOIS_CACHE_PATH", os.path.join(DATA_DIR, "whois.sqlite3"))
+DEFAULT_TTL = float(os.environ.get("WHOIS_CACHE_TTL", 7 * 24 * 3600))
+
+
+class WhoisCache:
+    """
+    SQLite-backed cache of parsed WhoisRecords keyed by normalized domain.
+    Entries older than `ttl` seconds are treated as missing.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, ttl: float = DEFAULT_TTL):
+        self.ttl = ttl
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS whois ("
+            " domain TEXT PRIMARY KEY,"
+            " fetched_at REAL NOT NULL,"
+            " record TEXT NOT NULL)"
+        )
+        self._db.commit()
+
+    def get(self, domain: str) -> Optional[WhoisRecord]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT record FROM whois WHERE domain = ? AND fetched_at >= ?",
+                (domain, time.time() - self.ttl),
+            ).fetchone()
+        return WhoisRecord.model_validate_json(row[0]) if row else None
+
+    def put(self, domain: str, record: WhoisRecord) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO whois (domain, fetched_at, record) VALUES (?, ?, ?)",
+                (domain, time.time(), record.model_dump_json()),
+            )
+            self._db.commit()
+
+
+class RegistryRateLimiter:
+    """
+    Spaces out queries to the same WHOIS registry by at least `interval`
+    seconds. Callers reserve the next free slot for their registry and sleep
+    until it comes up, so bursts queue up in arrival order instead of
+    hammering the registry.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._next_slot: Dict[str, float] = {}
+
+    def wait(self, registry: str) -> None:
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(registry, now))
+            self._next_slot[registry] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
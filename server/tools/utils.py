@@ -0,0 +1,28 @@
+# tools/utils.py
+import os
+from typing import Iterable, Iterator, Set
+
+# where the server keeps its local state (caches, job and scan stores)
+DATA_DIR = os.environ.get(
+    "TARGET_RECON_DATA_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data"),
+)
+
+
+def normalize_domain(domain: str) -> str:
+    """Lower-case `domain` and strip any URL scheme, path, port and trailing dot."""
+    domain = domain.strip().lower()
+    if domain.startswith(("http://", "https://")):
+        domain = domain.split("://", 1)[1].split("/", 1)[0]
+    return domain.split(":", 1)[0].rstrip(".")
+
+
+def unique_domains(lines: Iterable[str]) -> Iterator[str]:
+    """Normalize `lines` into domains, skipping blanks, comments and repeats."""
+    seen: Set[str] = set()
+    for line in lines:
+        domain = normalize_domain(line)
+        if not domain or domain.startswith("#") or domain in seen:
+            continue
+        seen.add(domain)
+        yield domain